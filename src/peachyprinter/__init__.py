@@ -1,6 +1,7 @@
 # -*- mode: python; basic-offset: 4 -*-
 import os
 import sys
+import types
 import logging
 
 logger = logging.getLogger('peachy')
@@ -13,7 +14,26 @@ try:
 except:
     version = "DEV"
 
-try:
-    from infrastructure.peachyusb import lib_version
-except:
-    lib_version = "Unknown"
\ No newline at end of file
+
+def get_lib_version():
+    '''Returns the version of the native USB library, loading it if it has not been already'''
+    try:
+        from peachyprinter.infrastructure.peachyusb import library_version
+        return library_version()
+    except:
+        return "Unknown"
+
+
+class _PeachyPrinterModule(types.ModuleType):
+    '''Gives lib_version as a module attribute worked out on first use so importing peachyprinter does not load the USB library'''
+
+    def __getattr__(self, name):
+        if name == 'lib_version':
+            return get_lib_version()
+        raise AttributeError("'module' object has no attribute '%s'" % name)
+
+
+_module = _PeachyPrinterModule(__name__, __doc__)
+_module.__dict__.update(sys.modules[__name__].__dict__)
+_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _module
@@ -104,6 +104,11 @@ class CalibrationAPI(object):
 
         self._communicator.register_handler(PrinterStatusMessage, callback)
 
+    def get_link_metrics(self):
+        '''Returns the current USB link metrics, see LinkMetrics.snapshot'''
+
+        return self._communicator.metrics.snapshot()
+
     def set_print_area(self, width, height, depth):
         '''Set the print area (width, height, depth) in mm'''
 
@@ -12,6 +12,8 @@ from peachyprinter.domain.laser_control import LaserControl
 from peachyprinter.infrastructure.micro_disseminator import MicroDisseminator
 from peachyprinter.infrastructure.communicator import UsbPacketCommunicator, NullCommunicator
 from peachyprinter.infrastructure.gcode_layer_generator import GCodeReader
+from peachyprinter.infrastructure.layer_cache import LayerCache
+from peachyprinter.infrastructure.layer_index import LayerIndex
 from peachyprinter.infrastructure.transformer import HomogenousTransformer
 from peachyprinter.infrastructure.layer_generators import SubLayerGenerator, ShuffleGenerator, OverLapGenerator
 from peachyprinter.infrastructure.commander import SerialCommander, NullCommander
@@ -79,6 +81,11 @@ class PrintAPI(object):
             time.sleep(1)
         print_api.close()
     '''
+    PREFETCH_LAYERS = 4
+    GCODE_BATCH_SIZE = 1024
+    SEND_BUFFER_SECONDS = 0.25
+    HANDLER_QUEUE_SIZE = 256
+
     def __init__(self, configuration, start_height=0.0):
         logger.info('Print API Startup')
         self._configuration = configuration
@@ -88,6 +95,7 @@ class PrintAPI(object):
         self._start_height = start_height
         self._current_file_name = None
         self._current_file = None
+        self._gcode_layers = None
         if self._configuration.email.on:
             self._email_gateway = EmailGateway(self._configuration.email.host, self._configuration.email.port, self._configuration.email.username, self._configuration.email.password)
             self._notification_service = EmailNotificationService(self._email_gateway, self._configuration.email.sender, self._configuration.email.recipient)
@@ -104,9 +112,17 @@ class PrintAPI(object):
         '''Take a gcode file and starts the printing it with current settings.'''
 
         self._current_file_name = file_name
-        self._current_file = open(file_name, 'r')
-        gcode_reader = GCodeReader(self._current_file, scale=self._configuration.options.scaling_factor, start_height=self._start_height)
+        self._current_file = open(file_name, 'rb')
+        gcode_reader = GCodeReader(
+            self._current_file,
+            scale=self._configuration.options.scaling_factor,
+            start_height=self._start_height,
+            batch_size=self.GCODE_BATCH_SIZE,
+            layer_cache=LayerCache(),
+            layer_index=LayerIndex(),
+            )
         gcode_layer_generator = gcode_reader.get_layers()
+        self._gcode_layers = gcode_layer_generator
         layer_generator = gcode_layer_generator
         self.print_layers(layer_generator, print_sub_layers, dry_run, force_source_speed=force_source_speed)
 
@@ -148,10 +164,17 @@ class PrintAPI(object):
         if dry_run:
             self._communicator = NullCommunicator()
         else:
-            self._communicator = UsbPacketCommunicator(self._configuration.circut.print_queue_length)
+            self._communicator = UsbPacketCommunicator(
+                self._configuration.circut.print_queue_length,
+                send_buffer_size=self._send_buffer_size(),
+                handler_queue_size=self.HANDLER_QUEUE_SIZE,
+                )
             self._communicator.start()
         return self._communicator
 
+    def _send_buffer_size(self):
+        return max(1, int(self._configuration.circut.data_rate * self.SEND_BUFFER_SECONDS))
+
     def _get_digital_disseminator(self, dry_run):
 
             return MicroDisseminator(
@@ -238,6 +261,7 @@ class PrintAPI(object):
             post_fire_delay_speed=post_fire_delay_speed,
             slew_delay_speed=slew_delay_speed
             )
+        self._writer.start_render_pool(depth=self.PREFETCH_LAYERS)
 
         self._layer_processing = LayerProcessing(
             self._writer,
@@ -265,6 +289,7 @@ class PrintAPI(object):
             layer_generator,
             self._status,
             abort_on_error=abort_on_error,
+            prefetch_layers=self.PREFETCH_LAYERS,
             )
 
         self._controller.start()
@@ -282,10 +307,16 @@ class PrintAPI(object):
                 drips_per_second
                 model_height
                 skipped_layers
+                layer_queue_depth
                 drip_histor
+                link -> USB link metrics, see LinkMetrics.snapshot, when printing to a printer
         '''
 
-        return self._controller.get_status()
+        status = self._controller.get_status()
+        metrics = getattr(getattr(self, '_communicator', None), 'metrics', None)
+        if metrics:
+            status['link'] = metrics.snapshot()
+        return status
 
     def can_set_drips_per_second(self):
         '''When using an emulated dripper this returns if the use can cahnge the drip rate manually via software'''
@@ -327,6 +358,8 @@ class PrintAPI(object):
             self._controller.close()
         else:
             logger.warning('Stopped before printing')
+        if getattr(self._gcode_layers, 'close', None):
+            self._gcode_layers.close()
         if self._current_file:
             self._current_file.close()
             logger.info("File Closed")
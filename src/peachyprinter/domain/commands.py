@@ -1,3 +1,6 @@
+import numpy as np
+
+COMMAND_DTYPE = np.dtype([('start', '<f8', (2,)), ('end', '<f8', (2,)), ('speed', '<f8'), ('draw', '?')])
 
 class Command(object):
     pass
@@ -37,4 +40,80 @@ class Layer(object):
         self.z = z
 
     def __str__(self):
-        return "Layer[Z:%f,Commands: %s]" % (self.z,[str(command) for command in self.commands])
\ No newline at end of file
+        return "Layer[Z:%f,Commands: %s]" % (self.z,[str(command) for command in self.commands])
+
+
+class ArrayLayer(Layer):
+    '''Layer holding its lateral commands as a COMMAND_DTYPE record array instead of command objects.
+    commands gives a list of LateralDraw / LateralMove for code that still works with command objects,
+    once used the list is the master copy and records is rebuilt from it'''
+
+    def __init__(self, z, records=None):
+        self.z = z
+        self._records = records if records is not None else np.empty(0, dtype=COMMAND_DTYPE)
+        self._commands = None
+
+    @classmethod
+    def from_commands(cls, z, commands):
+        return cls(z, records_from_commands(commands))
+
+    @property
+    def records(self):
+        if self._commands is not None:
+            return records_from_commands(self._commands)
+        return self._records
+
+    @records.setter
+    def records(self, records):
+        self._records = records
+        self._commands = None
+
+    @property
+    def commands(self):
+        if self._commands is None:
+            self._commands = commands_from_records(self._records)
+        return self._commands
+
+    @commands.setter
+    def commands(self, commands):
+        self._commands = list(commands)
+
+    def __len__(self):
+        if self._commands is not None:
+            return len(self._commands)
+        return len(self._records)
+
+    def __nonzero__(self):
+        '''A layer without commands is still a layer, as it is for Layer'''
+        return True
+
+
+def _lateral_command(start, end, speed, draw):
+    if draw:
+        return LateralDraw(start, end, speed)
+    return LateralMove(start, end, speed)
+
+
+def commands_from_records(records):
+    return map(_lateral_command, records['start'].tolist(), records['end'].tolist(), records['speed'].tolist(), records['draw'].tolist())
+
+
+def records_from_commands(commands):
+    '''Converts lateral commands and COMMAND_DTYPE arrays, in any mix, into a single record array'''
+    chunks = []
+    pending = []
+    for command in commands:
+        if isinstance(command, np.ndarray):
+            if pending:
+                chunks.append(np.array(pending, dtype=COMMAND_DTYPE))
+                pending = []
+            chunks.append(command)
+        else:
+            pending.append((command.start, command.end, command.speed, type(command) == LateralDraw))
+    if pending:
+        chunks.append(np.array(pending, dtype=COMMAND_DTYPE))
+    if not chunks:
+        return np.empty(0, dtype=COMMAND_DTYPE)
+    if len(chunks) == 1:
+        return chunks[0]
+    return np.concatenate(chunks)
@@ -14,6 +14,10 @@ class ZAxis(object):
 
     def move_to(self, height_mm):
         raise NotImplementedError('move_to unimplmented')
+
+    def seconds_until(self, height_mm):
+        '''Predicted seconds until height_mm is reached or None if it cannot be predicted'''
+        return None
  
     def start(self):
         pass
@@ -3,8 +3,10 @@ import time
 from messages import ProtoBuffableMessage
 import Queue as queue
 from Queue import Empty
-from threading import Lock
+from threading import Lock, Condition, Thread
+from collections import deque
 from peachyprinter.infrastructure.peachyusb import PeachyUSB, PeachyUSBException
+from peachyprinter.infrastructure.link_metrics import LinkMetrics
 
 logger = logging.getLogger('peachy')
 
@@ -21,9 +23,217 @@ class MissingPrinterException(Exception):
     pass
 
 
+class SendTimeoutException(Exception):
+    pass
+
+
+class FrameSender(object):
+    '''Writes buffers of pre-encoded frames on its own thread so producing samples overlaps with USB writes.
+    Holds at most size packets, when full put blocks, blocks for up to timeout seconds or drops the oldest buffer
+    depending on backpressure. A buffer larger than size is taken when nothing else is waiting.
+    watermark_call_back(high, depth) is called when the depth in packets reaches high_watermark and again when it
+    falls back to low_watermark. A None buffer pauses the sender briefly as a throttle.'''
+
+    BLOCK = 'block'
+    TIMEOUT = 'timeout'
+    DROP_OLDEST = 'drop_oldest'
+    BACKPRESSURE = [BLOCK, TIMEOUT, DROP_OLDEST]
+    THROTTLE_SECONDS = 1.0 / 2000.0
+
+    def __init__(self, write, size, backpressure=BLOCK, timeout=None, high_watermark=None, low_watermark=None, watermark_call_back=None):
+        if backpressure not in self.BACKPRESSURE:
+            logger.error("Backpressure must be one of %s was %s" % (self.BACKPRESSURE, backpressure))
+            raise Exception("Backpressure must be one of %s was %s" % (self.BACKPRESSURE, backpressure))
+        if backpressure == self.TIMEOUT and timeout is None:
+            logger.error("Timeout backpressure requires a timeout")
+            raise Exception("Timeout backpressure requires a timeout")
+        self._write = write
+        self._size = max(1, size)
+        self._backpressure = backpressure
+        self._timeout = timeout
+        self._high_watermark = self._size if high_watermark is None else high_watermark
+        self._low_watermark = self._size // 4 if low_watermark is None else low_watermark
+        self._watermark_call_back = watermark_call_back
+        self._high = False
+        self._buffer = deque()
+        self._depth = 0
+        self._final = None
+        self._writing = False
+        self._running = True
+        self._error = None
+        self.dropped = 0
+        self._condition = Condition()
+        self._thread = Thread(target=self._send)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, frames, packets=1):
+        with self._condition:
+            if self._error:
+                raise self._error
+            if not self._running:
+                return
+            deadline = None if self._timeout is None else time.time() + self._timeout
+            while self._running and self._depth and self._depth + packets > self._size:
+                if self._backpressure == self.DROP_OLDEST:
+                    self._depth -= self._buffer.popleft()[1]
+                    self.dropped += 1
+                elif self._backpressure == self.BLOCK:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        logger.error("Timed out after %s seconds waiting to send" % self._timeout)
+                        raise SendTimeoutException("Timed out after %s seconds waiting to send" % self._timeout)
+                    self._condition.wait(remaining)
+            if self._error:
+                raise self._error
+            if not self._running:
+                return
+            self._buffer.append((frames, packets))
+            self._depth += packets
+            self._buffer_changed()
+
+    def flush(self, timeout=None):
+        '''Waits until every buffer has been written, returns False if timeout seconds pass first'''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._running and (self._buffer or self._writing):
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            return not (self._buffer or self._writing)
+
+    def depth(self):
+        '''Returns the number of packets waiting to be written'''
+        return self._depth
+
+    def discard(self, final=None, packets=1):
+        '''Drops everything waiting to be written, final is then the only buffer waiting such as a laser off'''
+        with self._condition:
+            if self._buffer:
+                logger.info("Discarding %s unsent packets" % self._depth)
+            self._clear()
+            if final and self._running:
+                self._final = (final, packets)
+                self._buffer.append(self._final)
+                self._depth += packets
+            self._buffer_changed()
+
+    def close(self):
+        '''Stops the sender discarding anything waiting to be written, once a write in progress finishes.
+        Returns the final buffer given to discard if it has not been written yet'''
+        with self._condition:
+            if self._buffer:
+                logger.warning("Discarding %s unsent packets" % self._depth)
+            final = self._final
+            self._running = False
+            self._clear()
+            self._condition.notify_all()
+            while self._writing:
+                self._condition.wait()
+            return final[0] if final else None
+
+    def _clear(self):
+        self._buffer.clear()
+        self._depth = 0
+        self._final = None
+
+    def _buffer_changed(self):
+        self._condition.notify_all()
+        depth = self._depth
+        if not self._high and depth >= self._high_watermark:
+            self._high = True
+            if self._watermark_call_back:
+                self._watermark_call_back(True, depth)
+        elif self._high and depth <= self._low_watermark:
+            self._high = False
+            if self._watermark_call_back:
+                self._watermark_call_back(False, depth)
+
+    def _send(self):
+        while True:
+            with self._condition:
+                while self._running and not self._buffer:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                entry = self._buffer.popleft()
+                self._depth -= entry[1]
+                self._writing = True
+                self._buffer_changed()
+            frames = entry[0]
+            try:
+                if frames is None:
+                    time.sleep(self.THROTTLE_SECONDS)
+                else:
+                    self._write(frames)
+            except Exception as ex:
+                logger.error("Sending stopped: %s" % ex)
+                with self._condition:
+                    self._error = ex
+                    self._running = False
+                    self._clear()
+            finally:
+                with self._condition:
+                    if self._final is entry:
+                        self._final = None
+                    self._writing = False
+                    self._condition.notify_all()
+
+
+class HandlerExecutor(object):
+    '''Runs message handlers in order on its own thread so slow handlers do not hold up USB reads.
+    Messages are never dropped, when size messages are waiting submit blocks until there is room'''
+
+    def __init__(self, size):
+        self._queue = queue.Queue(size)
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, handlers, message):
+        self._queue.put((handlers, message))
+
+    def close(self):
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            (handlers, message) = item
+            for handler in handlers:
+                try:
+                    handler(message)
+                except Exception as ex:
+                    logger.error("Handler failed for %s: %s" % (message.__class__.__name__, ex))
+
+
 class UsbPacketCommunicator(Communicator):
-    def __init__(self, queue_size):
+    '''Sends messages to the printer over USB.
+    With a send_buffer_size, in packets, writes are made on a FrameSender thread, see FrameSender for the remaining options.
+    With a handler_queue_size received messages are handled on a HandlerExecutor thread instead of the USB read thread.
+    Writes, send buffer fill and detaches are recorded in metrics'''
+
+    def __init__(self, queue_size, send_buffer_size=0, backpressure=FrameSender.BLOCK, send_timeout=None, high_watermark=None, low_watermark=None, watermark_call_back=None, handler_queue_size=0):
+        self._sender = None
+        self._handler_executor = None
+        self._handler_queue_size = handler_queue_size
+        self._send_buffer_size = send_buffer_size
+        self._sender_options = (backpressure, send_timeout, high_watermark, low_watermark, watermark_call_back)
+        self.metrics = LinkMetrics()
         self._handlers = {}
+        self._dispatch = {}
         self._device = None
         self.sent_bytes = 0
         self.last_sent_time = time.time()
@@ -44,57 +254,164 @@ class UsbPacketCommunicator(Communicator):
                 raise MissingPrinterException()
         except PeachyUSBException:
             raise MissingPrinterException()
+        if self._handler_queue_size and not self._handler_executor:
+            self._handler_executor = HandlerExecutor(self._handler_queue_size)
+            self._handler_executor.start()
+        if self._send_buffer_size and not self._sender:
+            (backpressure, send_timeout, high_watermark, low_watermark, watermark_call_back) = self._sender_options
+            self._sender = FrameSender(
+                self._write_frames,
+                self._send_buffer_size,
+                backpressure=backpressure,
+                timeout=send_timeout,
+                high_watermark=high_watermark,
+                low_watermark=low_watermark,
+                watermark_call_back=watermark_call_back,
+                )
+            self._sender.start()
+
+    def flush(self, timeout=None):
+        '''Waits until everything sent has been handed to the device, returns False if timeout seconds pass first'''
+        if self._sender:
+            return self._sender.flush(timeout)
+        return True
+
+    def discard(self, final_frames=None, packets=None):
+        '''Drops everything waiting to be sent so only final_frames, such as a laser off, are sent next.
+        packets is the number of frames in final_frames, counted from final_frames when not given'''
+        if self._sender:
+            if not final_frames:
+                packets = 1
+            self._sender.discard(final_frames, packets if packets is not None else _count_frames(final_frames))
+        elif final_frames:
+            self._write_frames(final_frames)
 
     def close(self):
+        '''Closes the device discarding anything still waiting to be sent other than the final frames given to discard'''
+        sender = getattr(self, '_sender', None)
+        if sender:
+            self._sender = None
+            final_frames = sender.close()
+            if final_frames:
+                self._write_frames(final_frames)
+        handler_executor = getattr(self, '_handler_executor', None)
+        if handler_executor:
+            handler_executor.close()
+            self._handler_executor = None
         dev = self._device
         self._device = None
         del dev
 
     def _process(self, data, length):
         data = data[:length]
-        message_type_id = ord(data[0])
-        with self._handler_lock:
-            for (message, handlers) in self._handlers.items():
-                if message.TYPE_ID == message_type_id:
-                    for handler in handlers:
-                        handler(message.from_bytes(data[1:]))
+        handler_executor = self._handler_executor
+        for (message_type, handlers) in self._dispatch.get(ord(data[0]), ()):
+            message = message_type.from_bytes(data[1:])
+            if handler_executor:
+                handler_executor.submit(handlers, message)
+            else:
+                for handler in handlers:
+                    handler(message)
 
     def send(self, message):
         if self._detached:
             raise MissingPrinterException(self._detached)
-        self._send(message)
+        if self._sender:
+            self._sender.put(self._frame(message) if message.TYPE_ID != 99 else None, 1)
+        else:
+            self._send(message)
+
+    def send_frames(self, frames, packets=None):
+        '''Sends a buffer of already framed messages, such as from MoveMessage.frames, in a single bulk write.
+        packets is the number of frames in the buffer, counted from frames when not given'''
+        if self._detached:
+            raise MissingPrinterException(self._detached)
+        if not frames:
+            return
+        if self._sender:
+            self._sender.put(frames, packets if packets is not None else _count_frames(frames))
+        else:
+            self._write_frames(frames)
+
+    def send_many(self, messages):
+        '''Sends messages as send would, framing them into one buffer for a bulk write'''
+        if self._detached:
+            raise MissingPrinterException(self._detached)
+        if not (self._device or self._sender):
+            return
+        frames = bytearray()
+        packets = 0
+        for message in messages:
+            if message.TYPE_ID != 99:
+                frames.extend(self._frame(message))
+                packets += 1
+            else:
+                if frames:
+                    self._send_frames_or_sleep(frames, packets)
+                    frames = bytearray()
+                    packets = 0
+                self._send_frames_or_sleep(None, 1)
+        if frames:
+            self._send_frames_or_sleep(frames, packets)
+
+    def _send_frames_or_sleep(self, frames, packets):
+        if self._sender:
+            self._sender.put(frames, packets)
+        elif frames is None:
+            time.sleep(FrameSender.THROTTLE_SECONDS)
+        else:
+            self._write_frames(frames)
+
+    def _frame(self, message):
+        data = chr(message.TYPE_ID) + message.get_bytes()
+        return chr(len(data)) + data
+
+    def _write_frames(self, frames):
+        self._write(frames, bulk=True)
+        sender = self._sender
+        if sender:
+            self.metrics.record_queue(sender.depth(), self._send_buffer_size)
 
     def _send(self, message):
+        if not self._device:
+            return
+        if message.TYPE_ID != 99:
+            self._write(self._frame(message))
+        else:
+            time.sleep(FrameSender.THROTTLE_SECONDS)
+
+    def _write(self, data, bulk=False):
         if not self._device:
             return
         try:
-            if message.TYPE_ID != 99:
-                per_start_time = time.time()
-                data = chr(message.TYPE_ID) + message.get_bytes()
-                data = chr(len(data)) + data
-                self._device.write(data)
-                per_end_time = time.time() - per_start_time
-                self.send_time = self.send_time + per_end_time
-                self.sent_bytes += len(data)
-                if self.sent_bytes > 100000:
-                    seconds = time.time() - self.last_sent_time
-                    real_time_per_byte = (seconds * 1000.0) / (self.sent_bytes / 1024)
-                    cpu_time_per_byte = (self.send_time * 1000.0) / (self.sent_bytes / 1024)
-                    bps = self.sent_bytes / seconds
-                    self.last_sent_time = time.time()
-                    self.send_time = 0
-                    self.sent_bytes = 0
-                    logger.info("Real Time   : %.2f uspKB" % real_time_per_byte)
-                    logger.info("CPU Time    : %.2f uspKB" % cpu_time_per_byte)
-                    logger.info("Bytes       : %.2f bps" % bps)
+            per_start_time = time.time()
+            if bulk:
+                packets = self._device.write_many(data)
             else:
-                time.sleep(1.0 / 2000.0)
-
+                self._device.write(data)
+                packets = 1
+            per_end_time = time.time() - per_start_time
+            self.metrics.record_write(packets, len(data), per_end_time)
+            self.send_time = self.send_time + per_end_time
+            self.sent_bytes += len(data)
+            if self.sent_bytes > 100000:
+                seconds = time.time() - self.last_sent_time
+                real_time_per_byte = (seconds * 1000.0) / (self.sent_bytes / 1024)
+                cpu_time_per_byte = (self.send_time * 1000.0) / (self.sent_bytes / 1024)
+                bps = self.sent_bytes / seconds
+                self.last_sent_time = time.time()
+                self.send_time = 0
+                self.sent_bytes = 0
+                logger.info("Real Time   : %.2f uspKB" % real_time_per_byte)
+                logger.info("CPU Time    : %.2f uspKB" % cpu_time_per_byte)
+                logger.info("Bytes       : %.2f bps" % bps)
         except (PeachyUSBException), e:
             if e.value == -1 or e.value == -4:
                 logger.error("Printer missing or detached")
+                self.metrics.record_detach(e)
                 self._detached = e
                 raise MissingPrinterException(e)
+            logger.error("USB write failed: %s" % e)
 
     def register_handler(self, message_type, handler):
         logger.info("Registering handler for: {}".format(message_type.__name__))
@@ -102,15 +419,42 @@ class UsbPacketCommunicator(Communicator):
             logger.error("ProtoBuffableMessage required for message type")
             raise Exception("ProtoBuffableMessage required for message type")
         with self._handler_lock:
-            if message_type in self._handlers:
-                self._handlers[message_type].append(handler)
-            else:
-                self._handlers[message_type] = [handler]
+            handlers = dict(self._handlers)
+            handlers[message_type] = handlers.get(message_type, ()) + (handler,)
+            dispatch = {}
+            for (registered_type, registered_handlers) in handlers.items():
+                dispatch.setdefault(registered_type.TYPE_ID, []).append((registered_type, registered_handlers))
+            self._handlers = handlers
+            self._dispatch = dict((type_id, tuple(entries)) for (type_id, entries) in dispatch.items())
 
 
 class NullCommunicator(Communicator):
     def send(self, message):
         pass
 
+    def send_frames(self, frames, packets=None):
+        pass
+
+    def send_many(self, messages):
+        pass
+
+    def discard(self, final_frames=None, packets=None):
+        pass
+
+    def flush(self, timeout=None):
+        return True
+
     def register_handler(self, message_type, handler):
         pass
+
+
+def _count_frames(frames):
+    '''Returns the number of length prefixed packets in frames, which may be a str, bytearray or memoryview'''
+    data = bytearray(frames)
+    packets = 0
+    offset = 0
+    end = len(data)
+    while offset < end:
+        offset += data[offset] + 1
+        packets += 1
+    return packets
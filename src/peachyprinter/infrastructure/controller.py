@@ -1,4 +1,5 @@
 import threading
+import collections
 import logging
 logger = logging.getLogger('peachy')
 import time
@@ -7,6 +8,83 @@ from peachyprinter.domain.commands import *
 from peachyprinter.infrastructure.machine import MachineError
 from peachyprinter.infrastructure.communicator import MissingPrinterException
 
+class LayerPrefetcher(object):
+    '''Generates up to depth layers ahead on its own thread so slow generators do not stall the layer being drawn.
+    Each layer is passed to layer_call_back, in order, as it is generated.
+    Changing the generator discards any layers already generated.'''
+
+    def __init__(self, layer_generator, depth, depth_call_back=None, layer_call_back=None, discard_call_back=None):
+        self._layer_generator = layer_generator
+        self._depth = depth
+        self._depth_call_back = depth_call_back
+        self._layer_call_back = layer_call_back
+        self._discard_call_back = discard_call_back
+        self._buffer = collections.deque()
+        self._generation = 0
+        self._exhausted = False
+        self._running = True
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._generate)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def next(self):
+        '''Returns the next layer or None if closed'''
+        with self._condition:
+            while self._running and not self._buffer:
+                self._condition.wait()
+            if not self._buffer:
+                return None
+            (layer, error) = self._buffer.popleft()
+            self._buffer_changed()
+        if error:
+            raise error
+        return layer
+
+    def change_generator(self, layer_generator):
+        with self._condition:
+            self._layer_generator = layer_generator
+            self._generation += 1
+            self._exhausted = False
+            self._buffer.clear()
+            if self._discard_call_back:
+                self._discard_call_back()
+            self._buffer_changed()
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+    def _buffer_changed(self):
+        self._condition.notify_all()
+        if self._depth_call_back:
+            self._depth_call_back(len(self._buffer))
+
+    def _generate(self):
+        while True:
+            with self._condition:
+                while self._running and (self._exhausted or len(self._buffer) >= self._depth):
+                    self._condition.wait()
+                if not self._running:
+                    return
+                layer_generator = self._layer_generator
+                generation = self._generation
+            try:
+                item = (layer_generator.next(), None)
+            except Exception as ex:
+                item = (None, ex)
+            with self._condition:
+                if generation == self._generation:
+                    self._exhausted = type(item[1]) == StopIteration
+                    if item[0] is not None and self._layer_call_back:
+                        self._layer_call_back(item[0])
+                    self._buffer.append(item)
+                    self._buffer_changed()
+
+
 class Controller(threading.Thread,):
     def __init__(self,
                  layer_writer,
@@ -14,6 +92,7 @@ class Controller(threading.Thread,):
                  layer_generator,
                  status,
                  abort_on_error=True,
+                 prefetch_layers=0,
                  ):
         threading.Thread.__init__(self)
 
@@ -31,14 +110,28 @@ class Controller(threading.Thread,):
         self._next_layer_generator = None
         self._run_lock = threading.Lock()
         self._generator_lock = threading.Lock()
+        self._prefetcher = None
+        if prefetch_layers:
+            self._prefetcher = LayerPrefetcher(
+                layer_generator,
+                prefetch_layers,
+                self._status.layer_queue_call_back,
+                getattr(layer_writer, 'render_ahead', None),
+                getattr(layer_writer, 'discard_rendered', None),
+                )
 
     def run(self):
         with self._run_lock:
             logger.info('Running Controller')
+            if self._prefetcher:
+                self._prefetcher.start()
             self._process_layers()
+            if self._prefetcher:
+                self._prefetcher.close()
             if self._failed:
                 self._status.set_failed()
             elif self._complete:
+                self._writer.finish()
                 self._status.set_complete()
             else:
                 self._status.set_aborted()
@@ -51,6 +144,8 @@ class Controller(threading.Thread,):
         with self._generator_lock:
             self._layer_processing.abort_current_command()
             self._layer_generator = layer_generator
+            if self._prefetcher:
+                self._prefetcher.change_generator(layer_generator)
 
     def get_status(self):
         return self._status.status()
@@ -58,15 +153,24 @@ class Controller(threading.Thread,):
     def close(self):
         logger.info('Controller shutdown requested')
         self._shutting_down = True
+        if self._prefetcher:
+            self._prefetcher.close()
         self._layer_processing.abort_current_command()
         self._run_lock.acquire()
         self._run_lock.release()
 
+    def _next_layer(self):
+        if self._prefetcher:
+            return self._prefetcher.next()
+        with self._generator_lock:
+            return self._layer_generator.next()
+
     def _process_layers(self):
         while not self._shutting_down:
             try:
-                with self._generator_lock:
-                    layer = self._layer_generator.next()
+                layer = self._next_layer()
+                if layer is None:
+                    return
                 self._layer_processing.process(layer)
             except StopIteration:
                 logger.info('Layers Complete')
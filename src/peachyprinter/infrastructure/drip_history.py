@@ -0,0 +1,55 @@
+import time
+import numpy as np
+
+
+class DripHistory(object):
+    '''Fixed size ring buffer of drip times.
+    Each time is stored twice, size entries apart, so the most recent drips are always one contiguous slice of the buffer
+    and view can hand them out in order without copying. Views are read only and are overwritten as new drips arrive,
+    copy one to keep it longer than the next size drips.'''
+
+    def __init__(self, size=500):
+        self._size = size
+        self._buffer = np.zeros(size * 2)
+        self._total = 0
+
+    def __len__(self):
+        return min(self._total, self._size)
+
+    def append(self, drip_time, drips=1):
+        '''Records drips drips at drip_time'''
+        if drips <= 0:
+            return
+        positions = (self._total + np.arange(max(0, drips - self._size), drips)) % self._size
+        self._buffer[positions] = drip_time
+        self._buffer[positions + self._size] = drip_time
+        self._total += drips
+
+    def clear(self):
+        self._total = 0
+
+    def view(self):
+        '''Returns the recorded drip times oldest first as a read only view'''
+        count = len(self)
+        start = (self._total - count) % self._size
+        history = self._buffer[start:start + count]
+        history.flags.writeable = False
+        return history
+
+    def average(self, drips):
+        '''Returns drips per second over the last drips drips or 0.0 if there are not enough'''
+        if len(self) < drips:
+            return 0.0
+        history = self.view()
+        seconds = history[-1] - history[-drips]
+        if seconds > 0:
+            return drips / seconds
+        return 0.0
+
+    def drips_per_second(self, seconds, now=None):
+        '''Returns drips per second over the last seconds seconds'''
+        if now is None:
+            now = time.time()
+        history = self.view()
+        drips = len(history) - np.searchsorted(history, now - seconds, side='right')
+        return drips / float(seconds)
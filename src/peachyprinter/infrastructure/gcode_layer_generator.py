@@ -1,28 +1,80 @@
 import collections
+import gc
+import re
+from functools import partial
+from itertools import islice
+import numpy as np
 from peachyprinter.domain.commands import *
 from peachyprinter.domain.layer_generator import LayerGenerator
+from peachyprinter.infrastructure.layer_cache import file_hash
 import logging
 logger = logging.getLogger('peachy')
 
 
 class GCodeReader(object):
-    def __init__(self, file_object, scale=1.0, start_height=None):
+    def __init__(self, file_object, scale=1.0, start_height=None, batch_size=None, layer_cache=None, layer_index=None):
         self._start_height = start_height
         self.file_object = file_object
         self.scale = scale
+        self._batch_size = batch_size
+        self._layer_cache = layer_cache
+        self._layer_index = layer_index
 
     def check(self):
-        layers = GCodeToLayerGenerator(self.file_object, scale=self.scale, start_height=self._start_height)
+        layers = self.get_layers()
         for layer in layers:
             pass
         return layers.errors
 
     def get_layers(self):
-        return GCodeToLayerGenerator(self.file_object, scale=self.scale, start_height=self._start_height)
+        content_hash = self._content_hash()
+        if self._layer_cache and content_hash:
+            key = self._layer_cache.key(content_hash, self.scale, self._start_height)
+            return self._layer_cache.get(key) or self._layer_cache.recorder(key, self._parse_layers(content_hash))
+        return self._parse_layers(content_hash)
+
+    def _content_hash(self):
+        if not (self._layer_cache or self._layer_index):
+            return None
+        try:
+            return file_hash(self.file_object)
+        except Exception as ex:
+            logger.warning("Layer cache and index skipped: %s" % ex)
+            return None
+
+    def _parse_layers(self, content_hash):
+        resume = None
+        layer_starts_call_back = None
+        if self._layer_index and content_hash:
+            key = self._layer_index.key(content_hash, self.scale)
+            resume = self._resume_point(key)
+            if not resume:
+                layer_starts_call_back = partial(self._layer_index.record, key)
+        return GCodeToLayerGenerator(
+            self.file_object,
+            scale=self.scale,
+            start_height=self._start_height,
+            batch_size=self._batch_size,
+            resume=resume,
+            layer_starts_call_back=layer_starts_call_back,
+            )
+
+    def _resume_point(self, key):
+        if not self._start_height:
+            return None
+        try:
+            return self._layer_index.find(key, self._start_height)
+        except Exception as ex:
+            logger.warning("Layer index skipped: %s" % ex)
+            return None
 
 
 class GCodeToLayerGenerator(LayerGenerator):
-    def __init__(self, file_object, scale=1.0, start_height=None):
+    '''Turns a gcode file into layers. When batch_size is given lines are read and tokenized batch_size at a time.
+    resume is a point from a LayerIndex, when given reading starts from that point in the file instead of the beginning.
+    When given layer_starts_call_back is called once the whole file has been read with the (z, offset, line_number,
+    reader state) of each line that starts a layer, as LayerIndex.record takes'''
+    def __init__(self, file_object, scale=1.0, start_height=None, batch_size=None, resume=None, layer_starts_call_back=None):
         super(GCodeToLayerGenerator, self).__init__()
         self.errors = []
         self._start_height = start_height
@@ -33,6 +85,15 @@ class GCodeToLayerGenerator(LayerGenerator):
         self._gcode_command_reader = GCodeCommandReader(scale=scale)
         self._command_queue = collections.deque()
         self._file_complete = False
+        self._batch_size = batch_size
+        self._offset = 0
+        self._layer_starts_call_back = layer_starts_call_back
+        self._layer_starts = [] if layer_starts_call_back else None
+        if resume:
+            self._file_object.seek(resume['offset'])
+            self._offset = resume['offset']
+            self._line_number = resume['line_number']
+            self._gcode_command_reader.restore(resume['state'])
 
     def __iter__(self):
         return self
@@ -41,58 +102,109 @@ class GCodeToLayerGenerator(LayerGenerator):
         return self.next()
 
     def next(self):
-        layer = self._get_layer(None)
+        layer = self._get_layer()
         while layer.z < self._start_height:
-            layer = self._get_layer(None)
+            layer = self._get_layer()
         return layer
 
     def _populate_buffer(self):
+        if self._batch_size:
+            self._populate_buffer_batch()
+            return
         try:
             gcode_line = self._file_object.next()
             self._line_number += 1
+            state = self._gcode_command_reader.state() if self._layer_starts is not None and 'Z' in gcode_line else None
             try:
                 commands = self._gcode_command_reader.to_command(gcode_line.strip())
                 for command in commands:
                     self._command_queue.append(command)
+                    if state and type(command) == VerticalMove:
+                        self._layer_starts.append((command.end, self._offset, self._line_number - 1, state))
+                        state = None
             except Exception as ex:
                 logger.error("Error %s: %s" % (self._line_number, ex.message))
                 self.errors.append("Error %s: %s" % (self._line_number, ex.message))
+            self._offset += len(gcode_line)
         except StopIteration:
-            self._file_complete = True
+            self._complete()
 
-    def _clean_up_unneed_moves(self, layer):
-        if (type(layer.commands[-1]) == LateralMove):
-            layer.commands = layer.commands[:-1]
-        return layer
+    def _populate_buffer_batch(self):
+        gcode_lines = list(islice(self._file_object, self._batch_size))
+        if not gcode_lines:
+            self._complete()
+            return
+        line_errors = []
+        layer_starts = [] if self._layer_starts is not None else None
+        commands = self._gcode_command_reader.to_commands([line.strip() for line in gcode_lines], errors=line_errors, records=True, layer_starts=layer_starts)
+        self._command_queue.extend(commands)
+        for (index, ex) in line_errors:
+            logger.error("Error %s: %s" % (self._line_number + index + 1, ex.message))
+            self.errors.append("Error %s: %s" % (self._line_number + index + 1, ex.message))
+        self._add_layer_starts(gcode_lines, self._line_number, layer_starts)
+        self._line_number += len(gcode_lines)
+        self._offset += sum(len(line) for line in gcode_lines)
+
+    def _add_layer_starts(self, gcode_lines, line_number, layer_starts):
+        '''Adds the layer starts found in gcode_lines, read from line_number at the current offset'''
+        if not layer_starts:
+            return
+        for (index, z, state) in layer_starts:
+            offset = self._offset + sum(len(line) for line in gcode_lines[:index])
+            self._layer_starts.append((z, offset, line_number + index, state))
 
-    def _get_layer(self, layer=None):
-        generating_layer = True
-        while generating_layer:
+    def _complete(self):
+        self._file_complete = True
+        if self._layer_starts_call_back:
+            call_back = self._layer_starts_call_back
+            self._layer_starts_call_back = None
+            try:
+                call_back(self._layer_starts)
+            except Exception as ex:
+                logger.warning("Layer index not recorded: %s" % ex)
+
+    def _clean_up_unneed_moves(self, records):
+        if len(records) and not records['draw'][-1]:
+            return records[:-1]
+        return records
+
+    def _make_layer(self, z, commands):
+        return ArrayLayer(z, self._clean_up_unneed_moves(records_from_commands(commands)))
+
+    def _get_layer(self):
+        z = None
+        commands = []
+        while True:
             try:
                 command = self._command_queue.popleft()
-                if type(command) == VerticalMove:
-                    if layer:
-                        self._command_queue.appendleft(command)
-                        return self._clean_up_unneed_moves(layer)
-                    else:
-                        layer = Layer(command.end)
-                else:
-                    if layer:
-                        layer.commands.append(command)
-                    else:
-                        layer = Layer(0.0, [command])
             except IndexError:
                 if self._file_complete:
-                    if layer:
-                        return self._clean_up_unneed_moves(layer)
-                    else:
+                    if z is None and not commands:
                         raise StopIteration
-                else:
-                    self._populate_buffer()
+                    return self._make_layer(0.0 if z is None else z, commands)
+                self._populate_buffer()
+                continue
+            if type(command) == VerticalMove:
+                if z is not None or commands:
+                    self._command_queue.appendleft(command)
+                    return self._make_layer(0.0 if z is None else z, commands)
+                z = command.end
+            else:
+                commands.append(command)
 
 
 class GCodeCommandReader(object):
     _INCHES2MM = 25.4
+    _UNBATCHABLE_LINE = re.compile(r'^(?!G(?:0?1|0)(?: [XYFE][-+]?(?:\d+\.?\d*|\.\d+))+$).*$', re.M)
+    _BATCH_CODES = [
+        ('\nG01 ', ' 0 0 '),
+        ('\nG1 ', ' 0 0 '),
+        ('\nG0 ', ' 0 0 '),
+        (' X', ' 1 '),
+        (' Y', ' 2 '),
+        (' F', ' 3 '),
+        (' E', ' 4 '),
+        ]
 
     def __init__(self, verbose=False, scale=1.0):
         super(GCodeCommandReader, self).__init__()
@@ -112,6 +224,149 @@ class GCodeCommandReader(object):
         logger.error('Unsupported Command: %s' % (gcode))
         raise Exception('Unsupported Command: %s' % (gcode))
 
+    def state(self):
+        '''Everything needed to carry on reading from the current line with a new reader'''
+        return {
+            'xy': list(self._current_xy),
+            'mm_per_s': self._mm_per_s,
+            'z_pos': self._current_z_pos,
+            'layer_height': self._layer_height,
+            'units': self._units,
+            }
+
+    def restore(self, state):
+        self._current_xy = list(state['xy'])
+        self._mm_per_s = state['mm_per_s']
+        self._current_z_pos = state['z_pos']
+        self._layer_height = state['layer_height']
+        self._units = state['units']
+
+    def to_commands(self, gcode_lines, errors=None, records=False, layer_starts=None):
+        '''Batch equivalent of to_command for a list of stripped lines.
+        Runs of lateral G0/G1 lines are tokenized together into arrays, everything else goes through to_command.
+        When errors is a list failing lines are recorded there as (index, exception) instead of raising.
+        When records is True runs of lateral lines are returned as COMMAND_DTYPE arrays rather than command objects.
+        When layer_starts is a list lines with a vertical move are recorded there as (index, z, state before the line)'''
+        text = '\n'.join(gcode_lines)
+        commands = []
+        position = 0
+        line_index = 0
+        for unbatchable in self._UNBATCHABLE_LINE.finditer(text):
+            if unbatchable.start() > position:
+                batch = text[position:unbatchable.start() - 1]
+                self._add_batch(batch, line_index, commands, errors, records)
+                line_index += batch.count('\n') + 1
+            self._add_line(unbatchable.group(), line_index, commands, errors, layer_starts)
+            line_index += 1
+            position = unbatchable.end() + 1
+        if position < len(text):
+            self._add_batch(text[position:], line_index, commands, errors, records)
+        return commands
+
+    def _add_batch(self, batch, line_index, commands, errors, records):
+        if records:
+            batch_commands = self._lateral_records(batch)
+        else:
+            batch_commands = self._lateral_batch(batch)
+        if batch_commands is None:
+            for index, line in enumerate(batch.split('\n')):
+                self._add_line(line, line_index + index, commands, errors)
+        elif records:
+            if len(batch_commands):
+                commands.append(batch_commands)
+        else:
+            commands.extend(batch_commands)
+
+    def _add_line(self, line, line_index, commands, errors, layer_starts=None):
+        state = self.state() if layer_starts is not None and 'Z' in line else None
+        try:
+            line_commands = self.to_command(line)
+        except Exception as ex:
+            if errors is None:
+                raise
+            errors.append((line_index, ex))
+            return
+        commands.extend(line_commands)
+        if state:
+            for command in line_commands:
+                if type(command) == VerticalMove:
+                    layer_starts.append((line_index, command.end, state))
+                    break
+
+    def _tokenize_batch(self, batch):
+        batch = '\n' + batch
+        for (token, code) in self._BATCH_CODES:
+            batch = batch.replace(token, code)
+        pairs = np.fromstring(batch, sep=' ').reshape(-1, 2)
+        codes = pairs[:, 0]
+        line_index = np.cumsum(codes == 0) - 1
+        fields = {}
+        for (field, code) in zip('XYFE', range(1, 5)):
+            found = codes == code
+            column = np.full(line_index[-1] + 1, np.nan)
+            column[line_index[found]] = pairs[found, 1]
+            fields[field] = column
+        return fields
+
+    def _lateral_moves(self, batch):
+        '''Returns the ends, speeds and draw flags of the moves in a batch of lateral lines as arrays,
+        or None when the batch has to be read line by line'''
+        fields = self._tokenize_batch(batch)
+        feeds = fields['F']
+        has_feed = ~np.isnan(feeds)
+        if not self._mm_per_s and not has_feed[0]:
+            return None
+        if has_feed.any():
+            if (feeds[has_feed] == 0.0).any():
+                return None
+            last_feed = np.maximum.accumulate(np.where(has_feed, np.arange(len(feeds)), -1))
+            speeds = np.where(last_feed >= 0, self._to_mm_per_second(feeds[np.maximum(last_feed, 0)]), self._mm_per_s)
+            self._mm_per_s = float(speeds[-1])
+        else:
+            speeds = np.full(len(feeds), self._mm_per_s, dtype=float)
+
+        moves = ~(np.isnan(fields['X']) | np.isnan(fields['Y']))
+        ends = self._to_mm(np.column_stack((fields['X'][moves], fields['Y'][moves]))) * self.scale
+        return (ends, speeds[moves], np.nan_to_num(fields['E'][moves]) > 0.0)
+
+    def _lateral_records(self, batch):
+        moves = self._lateral_moves(batch)
+        if moves is None:
+            return None
+        (ends, speeds, draw) = moves
+        records = np.empty(len(ends), dtype=COMMAND_DTYPE)
+        if not len(records):
+            return records
+        records['end'] = ends
+        records['start'][0] = self._current_xy
+        records['start'][1:] = ends[:-1]
+        records['speed'] = speeds
+        records['draw'] = draw
+        self._current_xy = ends[-1].tolist()
+        return records
+
+    def _lateral_batch(self, batch):
+        '''As _lateral_records but as command objects, each starting at the previous end as to_command does'''
+        moves = self._lateral_moves(batch)
+        if moves is None:
+            return None
+        (ends, speeds, draw) = moves
+        if not len(ends):
+            return []
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            ends = ends.tolist()
+            starts = [self._current_xy] + ends[:-1]
+            self._current_xy = ends[-1]
+            return [
+                LateralDraw(start, end, speed) if write else LateralMove(start, end, speed)
+                for (start, end, speed, write) in zip(starts, ends, speeds.tolist(), draw.tolist())
+                ]
+        finally:
+            if collecting:
+                gc.enable()
+
     def _command_draw(self, line):
         command_details = line.split(' ')
         x_mm = None
@@ -206,16 +461,15 @@ class GCodeCommandReader(object):
     def _can_ignore(self, command):
         if command in ['\n', '']:
             return True
-        for prefix in self._IGNORABLE_PREFIXES:
-            if command.startswith(prefix):
-                return True
-        return False
+        return command.startswith(tuple(self._IGNORABLE_PREFIXES))
 
     def _units_mm(self, line):
         self._units = 'mm'
+        return []
 
     def _units_inches(self, line):
         self._units = 'inches'
+        return []
 
     _COMMAND_HANDLERS = {
         'G01': _command_draw,
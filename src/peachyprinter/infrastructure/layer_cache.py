@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import hashlib
+import logging
+logger = logging.getLogger('peachy')
+import numpy as np
+
+import peachyprinter.config as config
+from peachyprinter.domain.commands import ArrayLayer, COMMAND_DTYPE, records_from_commands
+from peachyprinter.domain.layer_generator import LayerGenerator
+
+INDEX_DTYPE = np.dtype([('z', '<f8'), ('offset', '<i8'), ('count', '<i8')])
+
+
+def file_hash(file_object, chunk_size=1024 * 1024):
+    '''Returns the sha1 of the contents of file_object leaving it at the start, the one hash both caches key files by'''
+    digest = hashlib.sha1()
+    file_object.seek(0)
+    for chunk in iter(lambda: file_object.read(chunk_size), ''):
+        digest.update(chunk)
+    file_object.seek(0)
+    return digest.hexdigest()
+
+
+class LayerCache(object):
+    '''On disk cache of parsed layers keyed by file contents, scale and start height.
+    Least recently used entries are removed once the cache grows beyond max_size_bytes, along with temporary files of
+    recordings left untouched for STALE_TEMP_SECONDS'''
+
+    VERSION = 1
+    CACHE_FOLDER = 'layer_cache'
+    METADATA_EXTENSION = '.json'
+    INDEX_EXTENSION = '.index'
+    COMMANDS_EXTENSION = '.commands'
+    TEMP_EXTENSION = '.tmp'
+    STALE_TEMP_SECONDS = 6 * 60 * 60
+
+    def __init__(self, path=None, max_size_bytes=512 * 1024 * 1024):
+        self._cache_path = path if path else os.path.join(config.PEACHY_PATH, self.CACHE_FOLDER)
+        self._max_size_bytes = max_size_bytes
+
+    def key(self, content_hash, scale, start_height):
+        '''Returns the key for a file with content_hash, from file_hash, read at scale from start_height'''
+        digest = hashlib.sha1(content_hash)
+        digest.update('scale=%r;start_height=%r;version=%d' % (float(scale), start_height, self.VERSION))
+        return digest.hexdigest()
+
+    def get(self, key):
+        metadata_file = self._file_name(key, self.METADATA_EXTENSION)
+        if not os.path.isfile(metadata_file):
+            return None
+        try:
+            with open(metadata_file, 'r') as file_handle:
+                metadata = json.loads(file_handle.read())
+            if metadata['version'] != self.VERSION:
+                return None
+            index = self._map(self._file_name(key, self.INDEX_EXTENSION), INDEX_DTYPE)
+            commands = self._map(self._file_name(key, self.COMMANDS_EXTENSION), COMMAND_DTYPE)
+            if len(index) != metadata['layers'] or len(commands) != metadata['commands']:
+                logger.warning("Layer cache entry %s is incomplete, ignoring it" % key)
+                return None
+            os.utime(metadata_file, None)
+        except Exception as ex:
+            logger.warning("Layer cache entry %s could not be read: %s" % (key, ex))
+            return None
+        logger.info("Using cached layers: %s" % key)
+        return CachedLayerGenerator(index, commands, metadata['errors'])
+
+    def recorder(self, key, layer_generator):
+        return CachingLayerGenerator(self, key, layer_generator)
+
+    def _map(self, file_name, dtype):
+        if os.path.getsize(file_name) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(file_name, dtype=dtype, mode='r')
+
+    def _path(self):
+        if not os.path.exists(self._cache_path):
+            os.makedirs(self._cache_path)
+        return self._cache_path
+
+    def _file_name(self, key, extension):
+        return os.path.join(self._path(), key + extension)
+
+    def _open_commands(self, key):
+        self._evict()
+        return open(self._file_name(key, self.COMMANDS_EXTENSION + self.TEMP_EXTENSION), 'wb')
+
+    def _discard_commands(self, key):
+        temp_file = self._file_name(key, self.COMMANDS_EXTENSION + self.TEMP_EXTENSION)
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+
+    def _store(self, key, index, command_count, errors):
+        commands_file = self._file_name(key, self.COMMANDS_EXTENSION)
+        if os.path.exists(commands_file):
+            os.remove(commands_file)
+        os.rename(commands_file + self.TEMP_EXTENSION, commands_file)
+        np.array(index, dtype=INDEX_DTYPE).tofile(self._file_name(key, self.INDEX_EXTENSION))
+        metadata = {'version': self.VERSION, 'layers': len(index), 'commands': command_count, 'errors': errors}
+        with open(self._file_name(key, self.METADATA_EXTENSION), 'w') as file_handle:
+            file_handle.write(json.dumps(metadata))
+        logger.info("Cached %s layers as %s" % (len(index), key))
+        self._evict()
+
+    def _entry_size(self, key):
+        size = 0
+        for extension in [self.METADATA_EXTENSION, self.INDEX_EXTENSION, self.COMMANDS_EXTENSION]:
+            file_name = self._file_name(key, extension)
+            if os.path.isfile(file_name):
+                size += os.path.getsize(file_name)
+        return size
+
+    def _evict(self):
+        entries = []
+        stale_before = time.time() - self.STALE_TEMP_SECONDS
+        for file_name in os.listdir(self._path()):
+            if file_name.endswith(self.TEMP_EXTENSION):
+                self._remove_stale(os.path.join(self._path(), file_name), stale_before)
+            elif file_name.endswith(self.METADATA_EXTENSION):
+                key = file_name[:-len(self.METADATA_EXTENSION)]
+                last_used = os.path.getmtime(self._file_name(key, self.METADATA_EXTENSION))
+                entries.append((last_used, key, self._entry_size(key)))
+        total_size = sum(size for (last_used, key, size) in entries)
+        for (last_used, key, size) in sorted(entries):
+            if total_size <= self._max_size_bytes:
+                break
+            logger.info("Evicting cached layers: %s" % key)
+            try:
+                for extension in [self.METADATA_EXTENSION, self.INDEX_EXTENSION, self.COMMANDS_EXTENSION]:
+                    file_name = self._file_name(key, extension)
+                    if os.path.isfile(file_name):
+                        os.remove(file_name)
+                total_size -= size
+            except OSError as ex:
+                logger.warning("Could not evict cached layers %s: %s" % (key, ex))
+
+    def _remove_stale(self, temp_file, stale_before):
+        try:
+            if os.path.getmtime(temp_file) < stale_before:
+                logger.info("Removing abandoned layer cache file: %s" % temp_file)
+                os.remove(temp_file)
+        except OSError as ex:
+            logger.warning("Could not remove abandoned layer cache file %s: %s" % (temp_file, ex))
+
+
+class CachedLayerGenerator(LayerGenerator):
+    def __init__(self, index, commands, errors):
+        self._index = index
+        self._commands = commands
+        self._current = 0
+        self.errors = errors
+
+    def next(self):
+        if self._current >= len(self._index):
+            raise StopIteration
+        z, offset, count = self._index[self._current]
+        self._current += 1
+        return ArrayLayer(float(z), self._commands[offset:offset + count])
+
+
+class CachingLayerGenerator(LayerGenerator):
+    '''Passes layers through from layer_generator and stores them in the cache once all layers have been read.
+    Layers are written to a temporary file from the first layer read, close or dropping the generator before the last
+    layer removes it'''
+
+    def __init__(self, layer_cache, key, layer_generator):
+        self._layer_cache = layer_cache
+        self._key = key
+        self._layer_generator = layer_generator
+        self._index = []
+        self._command_count = 0
+        self._file = None
+        self._recording = True
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def errors(self):
+        return self._layer_generator.errors
+
+    def next(self):
+        try:
+            layer = self._layer_generator.next()
+        except StopIteration:
+            self._complete()
+            raise
+        self._record(layer)
+        return layer
+
+    def close(self):
+        '''Stops recording, a recording that has not been stored is discarded'''
+        self._recording = False
+        if self._file:
+            self._abandon()
+
+    def _record(self, layer):
+        if not self._recording:
+            return
+        if not self._file:
+            try:
+                self._file = self._layer_cache._open_commands(self._key)
+            except Exception as ex:
+                logger.warning("Layer cache unavailable: %s" % ex)
+                self._recording = False
+                return
+        try:
+            if isinstance(layer, ArrayLayer):
+                records = layer.records
+            else:
+                records = records_from_commands(layer.commands)
+            records.tofile(self._file)
+            self._index.append((layer.z, self._command_count, len(records)))
+            self._command_count += len(records)
+        except Exception as ex:
+            logger.warning("Layer caching stopped: %s" % ex)
+            self._abandon()
+
+    def _complete(self):
+        if not self._recording:
+            return
+        self._recording = False
+        try:
+            if not self._file:
+                self._file = self._layer_cache._open_commands(self._key)
+            self._file.close()
+            self._file = None
+            self._layer_cache._store(self._key, self._index, self._command_count, self.errors)
+        except Exception as ex:
+            logger.warning("Layer caching failed: %s" % ex)
+            self._abandon()
+
+    def _abandon(self):
+        self._recording = False
+        try:
+            if self._file:
+                self._file.close()
+            self._layer_cache._discard_commands(self._key)
+        except Exception as ex:
+            logger.warning("Could not remove layer cache recording: %s" % ex)
+        finally:
+            self._file = None
@@ -1,12 +1,19 @@
 import time
+import numpy as np
 import logging
 logger = logging.getLogger('peachy')
 from peachyprinter.domain.commands import *
+from peachyprinter.domain.laser_control import LaserControl
 from peachyprinter.infrastructure.commander import NullCommander
-from threading import Lock
+from peachyprinter.infrastructure.machine import MachineState
+from peachyprinter.infrastructure.render_pool import LayerRenderPool
+from threading import Lock, Event
 
 
 class LayerWriter():
+    POINTS_PER_CHUNK = 4096
+    HOLD_BLOCK_SECONDS = 0.1
+    FINISH_TIMEOUT_SECONDS = 5.0
 
     def __init__(self,
                  disseminator,
@@ -36,6 +43,11 @@ class LayerWriter():
         self._abort_current_command = False
         self._shutting_down = False
         self._shutdown = False
+        self._prepared = None
+        self._render_pool = None
+        self._render_lock = Lock()
+        self._next_key = None
+        self._wake = Event()
         self._lock = Lock()
 
     def _almost_equal(self, a, b):
@@ -47,41 +59,289 @@ class LayerWriter():
     def process_layer(self, layer):
         if self._shutting_down or self._shutdown:
             raise Exception("LayerWriter already shutdown")
-        min_x, max_x, min_y, max_y, layer_height = None, None, None, None, None
         with self._lock:
             if self._disseminator:
                 self._disseminator.next_layer(layer.z)
-            for command in layer.commands:
-                # logger.info("Processing command: %s" % command)
-                if self._shutting_down:
-                    break
-                if self._abort_current_command:
-                    logger.info("Aborting Current Command")
-                    self._abort_current_command = False
-                    break
-                if type(command) == LateralDraw:
-                    if layer_height is None:
-                        min_x = command.start[0]
-                        max_x = command.start[0]
-                        min_y = command.start[1]
-                        max_y = command.start[1]
-                        layer_height = layer.z
-                    x, y = command.start
-                    min_x = x if x < min_x else min_x
-                    max_x = x if x > max_x else max_x
-                    min_y = y if y < min_y else min_y
-                    max_y = y if y > max_y else max_y
-                    x, y = command.end
-                    min_x = x if x < min_x else min_x
-                    max_x = x if x > max_x else max_x
-                    min_y = y if y < min_y else min_y
-                    max_y = y if y > max_y else max_y
-                    if not self._same_posisition(self._state.xy, command.start):
-                        self._move_lateral(
-                            command.start, layer.z, command.speed)
-                    self._draw_lateral(command.end, layer.z, command.speed)
+            if isinstance(layer, ArrayLayer) and getattr(self._disseminator, 'process_points', None):
+                return self._process_records(layer)
+            return self._process_commands(layer)
+
+    def prepare_layer(self, layer):
+        '''Works out and encodes the points for layer ahead of process_layer, such as while waiting for drips.
+        The work is used if nothing that affects it has changed by the time the layer is processed'''
+        if not (isinstance(layer, ArrayLayer) and getattr(self._disseminator, 'process_points', None)):
+            return
+        with self._lock:
+            if self._prepared and self._prepared[0] is layer:
+                return
+            key = self._plan_key()
+            plan = self._plan_records(layer.records, layer.z)
+            if plan:
+                plan['carry_state'] = self._path_to_points.carry_state()
+            self._path_to_points.restore_carry_state(key[-1])
+            self._encode_plan(plan)
+            self._prepared = (layer, key, plan)
+
+    def start_render_pool(self, processes=None, depth=4):
+        '''Starts worker processes that render layers passed to render_ahead, see LayerRenderPool.
+        Does nothing if the disseminator cannot encode frames ahead of time'''
+        encoder = getattr(self._disseminator, 'encoder', None)
+        if not encoder or self._disseminator.encode_points(np.empty((0, 2)), np.empty(0, dtype=bool)) is None:
+            logger.info("Disseminator cannot encode ahead, not rendering in other processes")
+            return
+        self._render_pool = LayerRenderPool.start(self.planner(), processes, depth)
+
+    def render_ahead(self, layer):
+        '''Hands layer to the render pool for the state this writer is predicted to be in when the layer is processed.
+        Layers must be passed in the order they will be processed'''
+        if not (self._render_pool and isinstance(layer, ArrayLayer)):
+            return
+        with self._render_lock:
+            key = self._next_key if self._next_key is not None else self._plan_key()
+            self._next_key = self._render_pool.submit(layer, key)
+
+    def discard_rendered(self):
+        '''Drops layers handed to render_ahead that have not been processed, such as when the generator changes'''
+        if self._render_pool:
+            with self._render_lock:
+                self._render_pool.discard()
+                self._next_key = None
+
+    def planner(self):
+        '''Returns a writer with the same settings, state and calibration that can plan and encode layers but not send them'''
+        laser_control = LaserControl(self._laser_control.laser_on_power())
+        planner = LayerWriter(
+            self._disseminator.encoder(laser_control),
+            self._path_to_points.copy(),
+            laser_control,
+            MachineState(self._state.xyz, self._state.speed),
+            move_distance_to_ignore=self._move_distance_to_ignore,
+            override_draw_speed=self._override_draw_speed,
+            override_move_speed=self._override_move_speed,
+            wait_speed=self._after_move_wait_speed,
+            post_fire_delay_speed=self._post_fire_delay_speed,
+            slew_delay_speed=self._slew_delay_speed,
+            )
+        planner.laser_off_override = self.laser_off_override
+        return planner
+
+    def render(self, records, z, key):
+        '''Plans and encodes records at z starting from the state in key, returning the plan or None if there is nothing to draw'''
+        self._apply_key(key)
+        plan = self._plan_records(records, z)
+        if plan:
+            plan['carry_state'] = self._path_to_points.carry_state()
+            self._encode_plan(plan)
+        return plan
+
+    def end_key(self, records, z, key):
+        '''Returns the plan key processing records at z from the state in key would leave, without working out any points'''
+        self._apply_key(key)
+        segments = self._plan_segments(records, z)
+        if not segments:
+            return key
+        self._path_to_points.advance_segments(segments['segment_starts'], segments['segment_ends'], segments['segment_speeds'])
+        self._state.set_state(segments['ends'][-1].tolist() + [z], self._state.speed)
+        if segments['draw_laser']:
+            self._laser_control.set_laser_on()
+        else:
+            self._laser_control.set_laser_off()
+        return self._plan_key()
+
+    def _apply_key(self, key):
+        (xyz, laser_is_on, laser_off_override, laser_on_power, carry_state) = key
+        self._state.set_state(list(xyz), self._state.speed)
+        if laser_is_on:
+            self._laser_control.set_laser_on()
+        else:
+            self._laser_control.set_laser_off()
+        self.laser_off_override = laser_off_override
+        self._path_to_points.restore_carry_state(carry_state)
+
+    def _encode_plan(self, plan):
+        if plan and getattr(self._disseminator, 'encode_points', None):
+            frames = [
+                self._disseminator.encode_points(plan['points'][start:end], plan['laser_on'][start:end])
+                for (last, start, end) in plan['chunks']
+                ]
+            if None not in frames:
+                plan['frames'] = frames
+
+    def _process_commands(self, layer):
+        min_x, max_x, min_y, max_y, layer_height = None, None, None, None, None
+        for command in layer.commands:
+            # logger.info("Processing command: %s" % command)
+            if self._shutting_down:
+                break
+            if self._abort_current_command:
+                logger.info("Aborting Current Command")
+                self._abort_current_command = False
+                break
+            if type(command) == LateralDraw:
+                if layer_height is None:
+                    min_x = command.start[0]
+                    max_x = command.start[0]
+                    min_y = command.start[1]
+                    max_y = command.start[1]
+                    layer_height = layer.z
+                x, y = command.start
+                min_x = x if x < min_x else min_x
+                max_x = x if x > max_x else max_x
+                min_y = y if y < min_y else min_y
+                max_y = y if y > max_y else max_y
+                x, y = command.end
+                min_x = x if x < min_x else min_x
+                max_x = x if x > max_x else max_x
+                min_y = y if y < min_y else min_y
+                max_y = y if y > max_y else max_y
+                if not self._same_posisition(self._state.xy, command.start):
+                    self._move_lateral(
+                        command.start, layer.z, command.speed)
+                self._draw_lateral(command.end, layer.z, command.speed)
         return [[min_x, max_x], [min_y, max_y], layer_height]
 
+    def _process_records(self, layer):
+        '''Array equivalent of _process_commands.
+        Every write _move_lateral and _draw_lateral would make for the layer is laid out as one segment table,
+        turned into a single point buffer and sent to the disseminator in chunks of whole draws so aborts still apply'''
+        prepared = self._prepared
+        self._prepared = None
+        key = self._plan_key()
+        rendered = self._render_pool.take(layer, key) if self._render_pool else None
+        if rendered:
+            prepared = (layer, key, rendered)
+        if prepared and prepared[0] is layer and prepared[1] == key:
+            plan = prepared[2]
+            if plan:
+                self._path_to_points.restore_carry_state(plan['carry_state'])
+        else:
+            plan = self._plan_records(layer.records, layer.z)
+        if not plan:
+            return [[None, None], [None, None], None]
+        processed = self._send_points(plan)
+        if processed:
+            last = processed - 1
+            self._state.set_state(plan['ends'][last].tolist() + [layer.z], float(plan['draw_speeds'][last]))
+            if plan['draw_laser']:
+                self._laser_control.set_laser_on()
+            else:
+                self._laser_control.set_laser_off()
+        bounds = np.vstack((plan['starts'][:processed], plan['ends'][:processed]))
+        if not len(bounds):
+            return [[None, None], [None, None], None]
+        (min_x, min_y), (max_x, max_y) = bounds.min(axis=0).tolist(), bounds.max(axis=0).tolist()
+        return [[min_x, max_x], [min_y, max_y], layer.z]
+
+    def _plan_key(self):
+        return (
+            tuple(self._state.xyz),
+            self._laser_control.laser_is_on(),
+            self.laser_off_override,
+            self._laser_control.laser_on_power(),
+            self._path_to_points.carry_state(),
+            )
+
+    def _plan_records(self, records, z):
+        plan = self._plan_segments(records, z)
+        if not plan:
+            return None
+        present = plan.pop('present')
+        points, counts = self._path_to_points.process_segments(
+            plan.pop('segment_starts'), plan.pop('segment_ends'), plan.pop('segment_speeds'))
+        point_ends = np.cumsum(counts)[np.cumsum(present.sum(axis=1)) - 1]
+        plan['points'] = points
+        plan['laser_on'] = np.repeat(plan.pop('segment_laser'), counts)
+        plan['chunks'] = self._chunks(point_ends)
+        plan['frames'] = None
+        return plan
+
+    def _plan_segments(self, records, z):
+        '''Lays out every write the draws in records would make as a table of segments'''
+        draws = records[records['draw']]
+        if not len(draws):
+            return None
+        starts = draws['start']
+        ends = draws['end']
+        count = len(draws)
+        draw_laser = not self.laser_off_override
+
+        previous = np.vstack((self._state.xy, ends[:-1]))
+        same = np.abs(previous - starts)
+        same = ((previous == starts) | (same <= self._move_distance_to_ignore)).all(axis=1)
+        moves = ~same
+        laser_before_move = np.empty(count, dtype=bool)
+        laser_before_move[0] = self._laser_control.laser_is_on()
+        laser_before_move[1:] = draw_laser
+        laser_before_draw = laser_before_move & same
+        current = np.where(moves[:, np.newaxis], starts, previous)
+        move_speeds = np.full(count, self._override_move_speed) if self._override_move_speed else draws['speed']
+        draw_speeds = np.full(count, self._override_draw_speed) if self._override_draw_speed else draws['speed']
+
+        # Per draw: slew dwell, move, wait dwell, post fire dwell, draw
+        present = np.column_stack((
+            moves & laser_before_move & bool(self._slew_delay_speed),
+            moves,
+            moves & bool(self._after_move_wait_speed),
+            ~laser_before_draw & bool(self._post_fire_delay_speed),
+            np.ones(count, dtype=bool),
+            ))
+        segment_starts = np.stack((previous, previous, starts, current, current), axis=1)[present]
+        segment_ends = np.stack((previous, starts, starts, current, ends), axis=1)[present]
+        segment_speeds = np.column_stack((
+            np.full(count, self._slew_delay_speed or 0.0),
+            move_speeds,
+            np.full(count, self._after_move_wait_speed or 0.0),
+            np.full(count, self._post_fire_delay_speed or 0.0),
+            draw_speeds,
+            ))[present]
+        segment_laser = np.array([True, False, False, draw_laser, draw_laser])[np.nonzero(present)[1]]
+        segments = len(segment_speeds)
+
+        end_z = np.full((segments, 1), float(z))
+        if present[0, 0] or (present[0, 3] and not present[0, 1]):
+            end_z[0] = self._state.z
+        start_z = np.vstack(([[self._state.z]], end_z[:-1]))
+        return {
+            'segment_starts': np.hstack((segment_starts, start_z)),
+            'segment_ends': np.hstack((segment_ends, end_z)),
+            'segment_speeds': segment_speeds,
+            'segment_laser': segment_laser,
+            'present': present,
+            'starts': starts,
+            'ends': ends,
+            'draw_speeds': draw_speeds,
+            'draw_laser': draw_laser,
+            }
+
+    def _chunks(self, point_ends):
+        '''Splits the points into chunks of whole draws, as (draws sent after the chunk, first point, end point)'''
+        chunks = []
+        sent = 0
+        while sent < len(point_ends):
+            start = point_ends[sent - 1] if sent else 0
+            last = max(sent + 1, np.searchsorted(point_ends, start + self.POINTS_PER_CHUNK, side='right'))
+            chunks.append((last, start, point_ends[last - 1]))
+            sent = last
+        return chunks
+
+    def _send_points(self, plan):
+        '''Sends the planned points to the disseminator a chunk at a time, pre-encoded if they were prepared.
+        Returns the number of draws sent before an abort or shutdown'''
+        sent = 0
+        for (index, (last, start, end)) in enumerate(plan['chunks']):
+            if self._shutting_down:
+                break
+            if self._abort_current_command:
+                logger.info("Aborting Current Command")
+                self._abort_current_command = False
+                break
+            if plan['frames']:
+                self._disseminator.send_encoded(plan['frames'][index], end - start)
+            else:
+                self._disseminator.process_points(plan['points'][start:end], plan['laser_on'][start:end])
+            sent = last
+        return sent
+
     def _move_lateral(self, (to_x, to_y), to_z, speed):
         if self._override_move_speed:
             speed = self._override_move_speed
@@ -90,10 +350,11 @@ class LayerWriter():
             self._write_lateral(
                 self._state.x, self._state.y, self._state.z, self._slew_delay_speed)
         self._laser_control.set_laser_off()
-        self._write_lateral(to_x, to_y, to_z, speed)
+        path = self._write_lateral(to_x, to_y, to_z, speed)
         if self._after_move_wait_speed:
-            self._write_lateral(
+            path = self._write_lateral(
                 to_x, to_y, to_z, self._after_move_wait_speed)
+        return path
 
     def _draw_lateral(self, (to_x, to_y), to_z, speed):
         if self._override_draw_speed:
@@ -114,23 +375,52 @@ class LayerWriter():
         if self._disseminator:
             self._disseminator.process(path)
         self._state.set_state(to_xyz, speed)
+        return path
 
     def abort_current_command(self):
+        '''Stops the command being written and drops samples the disseminator has not yet sent to the printer'''
         self._abort_current_command = True
+        self._wake.set()
         with self._lock:
             self._state.set_state((0.0, 0.0, self._state.z), self._state.speed)
+            discard = getattr(self._disseminator, 'discard', None)
+            if discard:
+                discard()
+
+    def finish(self):
+        '''Waits up to FINISH_TIMEOUT_SECONDS for samples written to reach the printer, for the end of a complete print'''
+        flush = getattr(self._disseminator, 'flush', None)
+        if flush and not flush(self.FINISH_TIMEOUT_SECONDS):
+            logger.warning("Unsent samples after waiting %s seconds" % self.FINISH_TIMEOUT_SECONDS)
 
     def wait_till_time(self, wait_time):
-        while time.time() <= wait_time:
-            if self._shutting_down:
+        '''Holds the mirrors at the current position with the laser off until wait_time.
+        After one move into place the disseminator is sent a dwell block covering up to HOLD_BLOCK_SECONDS at a time
+        and the writer sleeps. The sleep is cut short by an abort or shutdown'''
+        self._wake.clear()
+        if self._shutting_down or time.time() > wait_time:
+            return
+        path = self._move_lateral(self._state.xy, self._state.z, self._state.speed)
+        hold = getattr(self._disseminator, 'hold', None)
+        while not self._shutting_down:
+            remaining = wait_time - time.time()
+            if remaining <= 0:
                 return
-            self._move_lateral(
-                self._state.xy, self._state.z, self._state.speed)
+            seconds = min(remaining, self.HOLD_BLOCK_SECONDS)
+            if hold and len(path):
+                hold(path[-1], seconds)
+                if self._wake.wait(seconds):
+                    return
+            else:
+                path = self._move_lateral(self._state.xy, self._state.z, self._state.speed)
 
     def terminate(self):
         self._shutting_down = True
+        self._wake.set()
         with self._lock:
             self._shutdown = True
+            if self._render_pool:
+                self._render_pool.close()
             try:
                 if self._disseminator:
                     self._disseminator.close()
@@ -140,6 +430,8 @@ class LayerWriter():
 
 
 class LayerProcessing():
+    POLL_SECONDS = 0.1
+    MIN_WAIT_SECONDS = 0.005
 
     def __init__(self,
                  writer,
@@ -188,7 +480,7 @@ class LayerProcessing():
             self._status.set_model_height(layer.z)
             if self._zaxis:
                 self._zaxis.move_to(layer.z + self._max_lead_distance / 2.0)
-                self._wait_till(layer.z)
+                self._wait_till(layer.z, layer)
                 ahead_by = self._zaxis.current_z_location_mm() - layer.z
             if self._should_process(ahead_by):
                 self._commander.send_command(self._layer_start_command)
@@ -208,6 +500,12 @@ class LayerProcessing():
             self._state.set_state((0.0, 0.0, self._state.z), self._state.speed)
         self._abort_current_command = False
 
+    def _wait_seconds(self, height):
+        seconds = self._zaxis.seconds_until(height)
+        if seconds is None:
+            return self.POLL_SECONDS
+        return min(max(float(seconds), self.MIN_WAIT_SECONDS), self.POLL_SECONDS)
+
     def _should_process(self, ahead_by_distance):
         if not ahead_by_distance:
             return True
@@ -217,14 +515,20 @@ class LayerProcessing():
         logger.info("Ahead (Unacceptably) by: %s" % ahead_by_distance)
         return False
 
-    def _wait_till(self, height):
+    def _wait_till(self, height, layer=None):
+        '''Waits for the resin to reach height, preparing layer once the wait has started.
+        Sleeps are cut short to when the zaxis predicts the height will be reached'''
+        prepared = False
         while self._zaxis.current_z_location_mm() < height:
             if self._shutting_down or self._abort_current_command:
                 return
             if not self._status.waiting_for_drips:
                 self._commander.send_command(self._dripper_on_command)
             self._status.set_waiting_for_drips()
-            self._writer.wait_till_time(time.time() + (0.1))
+            self._writer.wait_till_time(time.time() + self._wait_seconds(height))
+            if layer is not None and not prepared:
+                prepared = True
+                self._writer.prepare_layer(layer)
         if self._status.waiting_for_drips:
             self._commander.send_command(self._dripper_off_command)
         self._status.set_not_waiting_for_drips()
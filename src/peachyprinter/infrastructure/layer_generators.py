@@ -109,7 +109,57 @@ class BlinkGenerator(TestLayerGenerator):
             yield [x, y]
 
 
-class HilbertGenerator(TestLayerGenerator):
+class PatternGenerator(TestLayerGenerator):
+    '''Base for test patterns whose segments only change with their settings.
+    _pattern gives the segment starts, ends and draw flags and is only worked out again when _pattern_key changes,
+    the records are then only rebuilt when the speed changes. Layers share the records, which are read only'''
+
+    _geometry_key = None
+    _geometry = None
+    _records = None
+
+    def _pattern_key(self):
+        return self._radius
+
+    def _pattern(self):
+        raise NotImplementedError()
+
+    def _pattern_records(self, start=None):
+        '''Returns the pattern's records at the current speed, with the first segment starting at start if given'''
+        key = self._pattern_key()
+        if self._geometry is None or key != self._geometry_key:
+            (starts, ends, draw) = self._pattern()
+            geometry = np.empty(len(ends), dtype=COMMAND_DTYPE)
+            geometry['start'] = starts
+            geometry['end'] = ends
+            geometry['speed'] = 0.0
+            geometry['draw'] = draw
+            self._geometry = geometry
+            self._geometry_key = key
+            self._records = None
+        records = self._records
+        if records is None or records['speed'][0] != self._speed or (start is not None and records['start'][0].tolist() != list(start)):
+            records = (self._geometry if records is None else records).copy()
+            records['speed'] = self._speed
+            if start is not None:
+                records['start'][0] = start
+            records.flags.writeable = False
+            self._records = records
+        return records
+
+    def _polyline(self, start, points):
+        '''Returns the segments drawing from start through points'''
+        points = np.asarray(points, dtype=float)
+        starts = np.concatenate((np.asarray([start], dtype=float), points[:-1]))
+        return (starts, points, np.ones(len(points), dtype=bool))
+
+    def _circle_points(self, radii, steps):
+        '''Returns points stepping around a circle clockwise from the top at radii'''
+        theta = (2 * math.pi / steps) * np.arange(steps)
+        return np.column_stack((np.sin(theta) * radii, np.cos(theta) * radii))
+
+
+class HilbertGenerator(PatternGenerator):
     def __init__(self, order=4, speed=150.0, radius=40.0):
         self._current_height = 0.0
         self._order = order
@@ -118,92 +168,68 @@ class HilbertGenerator(TestLayerGenerator):
         self.set_radius(radius)
 
     def next(self):
-        self._pattern = self._get_hilbert(self._order, [-self._radius, -self._radius], [self._radius, self._radius])
-        # logger.debug('Pattern: %s' % self._pattern)
-        layer = Layer(self._current_height)
-        layer.commands.append(LateralMove(self._last_xy, self._pattern[0], self._speed))
-        self._last_xy = self._pattern[0]
-        for x, y in self._pattern[1:]:
-            next_xy = [x, y]
-            layer.commands.append(LateralDraw(self._last_xy, next_xy, self._speed))
-            self._last_xy = next_xy
-        return layer
+        records = self._pattern_records(self._last_xy)
+        self._last_xy = records['end'][-1].tolist()
+        return ArrayLayer(self._current_height, records)
+
+    def _pattern_key(self):
+        return (self._radius, self._order)
+
+    def _pattern(self):
+        points = self._get_hilbert(self._order, [-self._radius, -self._radius], [self._radius, self._radius])
+        (starts, ends, draw) = self._polyline(points[0], points)
+        draw[0] = False
+        return (starts, ends, draw)
 
     def _get_hilbert(self, order, lower_bounds, upper_bounds):
+        '''Returns the curve's points between lower and upper bounds, each order is four turned copies of the one below'''
         [x0, y0] = lower_bounds
         [x1, y1] = upper_bounds
-        [xi, yj] = [abs(x1-x0), abs(y1-y0)]
-        self._points = []
-        self._hilbert(x0, y0, xi, 0.0, 0.0, yj, order)
-        return self._points
-
-    def _hilbert(self, x0, y0, xi, xj, yi, yj, n, points=[]):
-        if n <= 0:
-            X = x0 + (xi + yi)/2
-            Y = y0 + (xj + yj)/2
-            self._points.append([X, Y])
-        else:
-            self._hilbert(x0, y0, yi/2, yj/2, xi/2, xj/2, n - 1)
-            self._hilbert(x0 + xi/2, y0 + xj/2, xi/2, xj/2, yi/2, yj/2, n - 1)
-            self._hilbert(x0 + xi/2 + yi/2, y0 + xj/2 + yj/2, xi/2, xj/2, yi/2, yj/2, n - 1)
-            self._hilbert(x0 + xi/2 + yi,  y0 + xj/2 + yj, -yi/2, -yj/2, -xi/2, -xj/2, n - 1)
-
-
-class SquareGenerator(TestLayerGenerator):
+        points = np.array([[0.5, 0.5]])
+        for n in range(order):
+            (u, v) = (points[:, 0] / 2, points[:, 1] / 2)
+            points = np.concatenate((
+                np.column_stack((v, u)),
+                np.column_stack((0.5 + u, v)),
+                np.column_stack((0.5 + u, 0.5 + v)),
+                np.column_stack((0.5 - v, 1.0 - u)),
+                ))
+        return np.column_stack((x0 + points[:, 0] * abs(x1 - x0), y0 + points[:, 1] * abs(y1 - y0)))
+
+
+class SquareGenerator(PatternGenerator):
     def __init__(self, speed=100.0, radius=20.0):
         self._current_height = 0.0
         self.set_speed(speed)
         self.set_radius(radius)
 
     def next(self):
-        layer = Layer(self._current_height)
-        last = [-self._radius, self._radius]
-
-        for X_point in np.linspace(-self._radius, self._radius, 101)[:-1]:
-            layer.commands.append(LateralDraw(last, [X_point, self._radius], self._speed))
-            last = [X_point, self._radius]
+        return ArrayLayer(self._current_height, self._pattern_records())
 
-        for y_point in np.linspace(self._radius, -self._radius, 101)[:-1]:
-            layer.commands.append(LateralDraw(last, [self._radius, y_point], self._speed))
-            last = [self._radius, y_point]
+    def _pattern(self):
+        return self._polyline([self._lower(), self._radius], self._outline(self._lower(), self._radius))
 
-        for x_point in np.linspace(self._radius, -self._radius, 101)[:-1]:
-            layer.commands.append(LateralDraw(last, [x_point, -self._radius], self._speed))
-            last = [x_point, -self._radius]
+    def _lower(self):
+        return -self._radius
 
-        for y_point in np.linspace(-self._radius, self._radius, 101)[:-1]:
-            layer.commands.append(LateralDraw(last, [-self._radius, y_point], self._speed))
-            last = [-self._radius, y_point]
+    def _outline(self, lower, upper):
+        '''Returns 100 points along each side of a square clockwise from the top left corner'''
+        rising = np.linspace(lower, upper, 101)[:-1]
+        falling = np.linspace(upper, lower, 101)[:-1]
+        return np.concatenate((
+            np.column_stack((rising, np.repeat(upper, 100))),
+            np.column_stack((np.repeat(upper, 100), falling)),
+            np.column_stack((falling, np.repeat(lower, 100))),
+            np.column_stack((np.repeat(lower, 100), rising)),
+            ))
 
-        return layer
 
-class ScaleGenerator(TestLayerGenerator):
+class ScaleGenerator(SquareGenerator):
     def __init__(self, speed=1.0, radius=1.0):
-        self._current_height = 0.0
-        self.set_speed(speed)
-        self.set_radius(radius)
-
-    def next(self):
-        layer = Layer(self._current_height)
-        last = [0, self._radius]
-
-        for X_point in np.linspace(0, self._radius, 101)[:-1]:
-            layer.commands.append(LateralDraw(last, [X_point, self._radius], self._speed))
-            last = [X_point, self._radius]
-
-        for y_point in np.linspace(self._radius, 0, 101)[:-1]:
-            layer.commands.append(LateralDraw(last, [self._radius, y_point], self._speed))
-            last = [self._radius, y_point]
+        super(ScaleGenerator, self).__init__(speed, radius)
 
-        for x_point in np.linspace(self._radius, 0, 101)[:-1]:
-            layer.commands.append(LateralDraw(last, [x_point, 0], self._speed))
-            last = [x_point, 0]
-
-        for y_point in np.linspace(0, self._radius, 101)[:-1]:
-            layer.commands.append(LateralDraw(last, [0, y_point], self._speed))
-            last = [0, y_point]
-
-        return layer
+    def _lower(self):
+        return 0.0
 
 
 class DampingTestGenerator(TestLayerGenerator):
@@ -223,36 +249,27 @@ class DampingTestGenerator(TestLayerGenerator):
         return layer
 
 
-class CircleGenerator(TestLayerGenerator):
+class CircleGenerator(PatternGenerator):
     def __init__(self, speed=100.0, radius=20.0, steps=180):
         self._current_height = 0.0
         self.set_speed(speed)
         self.set_radius(radius)
         self._steps = steps
         self.last_xy = [0.0, 0.0]
-        self._last_radius = None
-        self.active_points = list(self.points())
 
     def next(self):
-        if self._last_radius != self._radius:
-            self._last_radius == self._radius
-            self.active_points = list(self.points())
-        layer = Layer(self._current_height)
-        for point in self.active_points:
-            layer.commands.append(LateralDraw(self.last_xy, point, self._speed))
-            self.last_xy = point
-        return layer
+        records = self._pattern_records(self.last_xy)
+        self.last_xy = records['end'][-1].tolist()
+        return ArrayLayer(self._current_height, records)
 
-    def points(self):
-        angle_step = (2 * math.pi / self._steps)
-        for i in range(0, self._steps):
-            theta = angle_step * i
-            x = math.sin(theta) * self._radius
-            y = math.cos(theta) * self._radius
-            yield [x, y]
+    def _pattern_key(self):
+        return (self._radius, self._steps)
 
+    def _pattern(self):
+        return self._polyline(self.last_xy, self._circle_points(self._radius, self._steps))
 
-class SpiralGenerator(TestLayerGenerator):
+
+class SpiralGenerator(PatternGenerator):
     def __init__(self, speed=100.0, radius=20.0, steps=50, overlaps=6):
         self._current_height = 0.0
         self.set_speed(speed)
@@ -262,24 +279,23 @@ class SpiralGenerator(TestLayerGenerator):
         self.last_xy = [0.0, 0.0]
 
     def next(self):
-        layer = Layer(self._current_height)
-        layer.commands.append(LateralMove(self.last_xy, [0.0, 0.0], self._speed))
-        self.last_xy = [0.0, 0.0]
-        for point in self.points():
-            layer.commands.append(LateralDraw(self.last_xy, point, self._speed))
-            self.last_xy = point
-        return layer
+        records = self._pattern_records(self.last_xy)
+        self.last_xy = records['end'][-1].tolist()
+        return ArrayLayer(self._current_height, records)
 
-    def points(self):
-        inc = self._radius / (self._steps * self._overlaps)
-        angle_step = (2 * math.pi / self._steps)
-        radius = 0.0
-        for i in range(0, self._steps * self._overlaps):
-            theta = angle_step * i
-            x = math.sin(theta) * radius
-            y = math.cos(theta) * radius
-            radius += inc
-            yield [x, y]
+    def _pattern_key(self):
+        return (self._radius, self._steps, self._overlaps)
+
+    def _pattern(self):
+        '''A move to the centre then draws spiralling out, the radius growing by the same amount each step'''
+        count = self._steps * self._overlaps
+        inc = self._radius / count
+        radii = np.add.accumulate(np.concatenate(([0.0], np.repeat(inc, count - 1))))
+        angles = (2 * math.pi / self._steps) * np.arange(count)
+        points = np.column_stack((np.sin(angles) * radii, np.cos(angles) * radii))
+        (starts, ends, draw) = self._polyline([0.0, 0.0], np.concatenate(([[0.0, 0.0]], points)))
+        draw[0] = False
+        return (starts, ends, draw)
 
 
 class MemoryHourglassGenerator(TestLayerGenerator):
@@ -512,13 +528,11 @@ class SubLayerGenerator(LayerGenerator):
 
     def next(self):
         if self._running:
-            if self._current_layer:
+            if self._current_layer is not None:
                 distance_to_next_layer = self._next.z - self._current_layer.z
                 # logger.debug('%f8' % distance_to_next_layer)
                 if distance_to_next_layer / 2.0 >= self._sub_layer_height - self._tollerance:
-                    current_z = self._current_layer.z
-                    self._current_layer.z = current_z + self._sub_layer_height
-                    self._current_layer = self._current_layer
+                    self._current_layer = self._sub_layer(self._current_layer, self._current_layer.z + self._sub_layer_height)
                 else:
                     self._current_layer = self._next
                     self._load_layer()
@@ -529,6 +543,11 @@ class SubLayerGenerator(LayerGenerator):
         else:
             raise StopIteration
 
+    def _sub_layer(self, layer, z):
+        if isinstance(layer, ArrayLayer):
+            return ArrayLayer(z, layer.records)
+        return Layer(z, commands=layer.commands)
+
     def _load_layer(self):
         try:
             self._next = self._layer_generator.next()
@@ -552,8 +571,13 @@ class ShuffleGenerator(LayerGenerator):
         return self._shuffle(self._layer_generator.next())
 
     def _shuffle(self, layer):
-        shuffle_amount = int(self._shuffle_point) % len(layer.commands)
-        layer.commands = layer.commands[shuffle_amount:] + layer.commands[:shuffle_amount]
+        if isinstance(layer, ArrayLayer):
+            records = layer.records
+            shuffle_amount = int(self._shuffle_point) % len(records)
+            layer = ArrayLayer(layer.z, np.concatenate((records[shuffle_amount:], records[:shuffle_amount])))
+        else:
+            shuffle_amount = int(self._shuffle_point) % len(layer.commands)
+            layer.commands = layer.commands[shuffle_amount:] + layer.commands[:shuffle_amount]
         self._shuffle_point += self._amount
         return layer
 
@@ -607,6 +631,21 @@ class OverLapGenerator(LayerGenerator):
         commands = layer.commands + new_commands
         return Layer(layer.z, commands=commands)
 
+    def _overlap_records(self, layer, threshold=0.001):
+        records = layer.records
+        moves = np.flatnonzero(~records['draw'])
+        draws = records[:moves[0]] if len(moves) else records
+        vectors = draws['end'] - draws['start']
+        magnatudes = np.sqrt((vectors ** 2).sum(axis=1))
+        remainders = self.overlap_mm - (np.cumsum(magnatudes) - magnatudes)
+        used = (remainders > threshold) & (magnatudes > 0.0)
+        used &= np.cumsum(magnatudes >= remainders) - (magnatudes >= remainders) == 0
+        new_records = draws[used].copy()
+        partial = magnatudes[used] >= remainders[used]
+        scale = remainders[used][partial] / magnatudes[used][partial]
+        new_records['end'][partial] = new_records['start'][partial] + vectors[used][partial] * scale[:, np.newaxis]
+        return ArrayLayer(layer.z, np.concatenate((records, new_records)))
+
     def _should_overlap(self, layer):
         first_command = layer.commands[0]
         last_command = layer.commands[-1]
@@ -616,8 +655,20 @@ class OverLapGenerator(LayerGenerator):
             type(last_command) == LateralDraw
             )
 
+    def _should_overlap_records(self, records):
+        return (
+            len(records) > 0 and
+            self._same_spot(records['end'][-1], records['start'][0]) and
+            records['draw'][0] and
+            records['draw'][-1]
+            )
+
     def next(self):
         next_layer = self._layer_generator.next()
+        if isinstance(next_layer, ArrayLayer):
+            if self._should_overlap_records(next_layer.records):
+                return self._overlap_records(next_layer)
+            return next_layer
         if self._should_overlap(next_layer):
             return self._overlap_layer(next_layer)
         else:
@@ -0,0 +1,113 @@
+import os
+import hashlib
+import logging
+logger = logging.getLogger('peachy')
+import numpy as np
+
+import peachyprinter.config as config
+
+INDEX_DTYPE = np.dtype([
+    ('z', '<f8'),
+    ('offset', '<i8'),
+    ('line_number', '<i8'),
+    ('xy', '<f8', (2,)),
+    ('mm_per_s', '<f8'),
+    ('z_pos', '<f8'),
+    ('layer_height', '<f8'),
+    ('inches', '?'),
+    ])
+
+
+class LayerIndex(object):
+    '''Maps layer heights to the byte offset of the gcode line that starts them along with the reader state at that line.
+    Recorded while a file is read from the start, such as when it is printed, and kept on disk so later resumes can seek
+    straight to a layer. Only the max_entries most recently used files are kept'''
+
+    VERSION = 1
+    INDEX_FOLDER = 'layer_index'
+    INDEX_EXTENSION = '.index'
+    TEMP_EXTENSION = '.tmp'
+
+    def __init__(self, path=None, max_entries=32):
+        self._index_path = path if path else os.path.join(config.PEACHY_PATH, self.INDEX_FOLDER)
+        self._max_entries = max_entries
+
+    def key(self, content_hash, scale):
+        '''Returns the key for a file with content_hash, from layer_cache.file_hash, read at scale'''
+        digest = hashlib.sha1(content_hash)
+        digest.update('scale=%r;version=%d' % (float(scale), self.VERSION))
+        return digest.hexdigest()
+
+    def find(self, key, start_height):
+        '''Returns the resume point for the first layer at or above start_height or None if reading should start at the beginning'''
+        index = self.get(key)
+        if index is None:
+            return None
+        position = np.searchsorted(index['z'], start_height, side='right') - 1
+        if position < 0:
+            return None
+        position = np.searchsorted(index['z'], index['z'][position], side='left')
+        entry = index[position]
+        logger.info("Resuming at line %s for height %s" % (entry['line_number'] + 1, start_height))
+        return {
+            'offset': int(entry['offset']),
+            'line_number': int(entry['line_number']),
+            'state': {
+                'xy': entry['xy'].tolist(),
+                'mm_per_s': float(entry['mm_per_s']),
+                'z_pos': float(entry['z_pos']),
+                'layer_height': None if np.isnan(entry['layer_height']) else float(entry['layer_height']),
+                'units': 'inches' if entry['inches'] else 'mm',
+                },
+            }
+
+    def get(self, key):
+        '''Returns the stored index for key or None if it has not been recorded'''
+        index_file = self._file_name(key)
+        if not os.path.isfile(index_file):
+            return None
+        try:
+            index = np.fromfile(index_file, dtype=INDEX_DTYPE)
+            os.utime(index_file, None)
+            return index
+        except Exception as ex:
+            logger.warning("Layer index %s could not be read: %s" % (key, ex))
+            return None
+
+    def record(self, key, layer_starts):
+        '''Stores the index for key from layer_starts, the (z, offset, line_number, reader state) of the line starting each
+        layer in file order as recorded by GCodeToLayerGenerator. An index already stored for key is kept'''
+        if os.path.isfile(self._file_name(key)):
+            return
+        entries = [
+            (z, offset, line_number, state['xy'], state['mm_per_s'], state['z_pos'], np.nan if state['layer_height'] is None else state['layer_height'], state['units'] == 'inches')
+            for (z, offset, line_number, state) in layer_starts
+            ]
+        logger.info("Recorded layer index of %s layers" % len(entries))
+        self._store(key, np.array(entries, dtype=INDEX_DTYPE))
+
+    def _path(self):
+        if not os.path.exists(self._index_path):
+            os.makedirs(self._index_path)
+        return self._index_path
+
+    def _file_name(self, key):
+        return os.path.join(self._path(), key + self.INDEX_EXTENSION)
+
+    def _store(self, key, index):
+        try:
+            index_file = self._file_name(key)
+            index.tofile(index_file + self.TEMP_EXTENSION)
+            if os.path.exists(index_file):
+                os.remove(index_file)
+            os.rename(index_file + self.TEMP_EXTENSION, index_file)
+            self._evict()
+        except Exception as ex:
+            logger.warning("Layer index could not be saved: %s" % ex)
+
+    def _evict(self):
+        index_files = [os.path.join(self._path(), name) for name in os.listdir(self._path()) if name.endswith(self.INDEX_EXTENSION)]
+        index_files.sort(key=os.path.getmtime, reverse=True)
+        for index_file in index_files[self._max_entries:]:
+            logger.info("Evicting layer index: %s" % index_file)
+            os.remove(index_file)
@@ -0,0 +1,93 @@
+import time
+import json
+import logging
+from collections import deque
+from threading import Lock
+import numpy as np
+logger = logging.getLogger('peachy')
+
+
+class LinkMetrics(object):
+    '''Rolling window of USB link activity.
+    Writes, send buffer fill and detach events are kept for window_seconds. A write_busy_fraction near 1.0 means
+    the link is the bottleneck, throughput below the data rate with a low busy fraction means we are CPU bound'''
+
+    LATENCY_EDGES_US = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000]
+
+    def __init__(self, window_seconds=5.0, clock=time.time):
+        self._window_seconds = window_seconds
+        self._clock = clock
+        self._started = clock()
+        self._lock = Lock()
+        self._writes = deque()
+        self._queue = deque()
+        self._detaches = deque()
+        self.total_packets = 0
+        self.total_bytes = 0
+        self.total_detach_events = 0
+
+    def record_write(self, packets, byte_count, latency):
+        '''Records a write of packets totalling byte_count bytes that took latency seconds'''
+        with self._lock:
+            now = self._clock()
+            self._writes.append((now, packets, byte_count, latency))
+            self.total_packets += packets
+            self.total_bytes += byte_count
+            self._prune(now)
+
+    def record_queue(self, depth, size):
+        with self._lock:
+            now = self._clock()
+            self._queue.append((now, float(depth) / size))
+            self._prune(now)
+
+    def record_detach(self, reason):
+        with self._lock:
+            now = self._clock()
+            self._detaches.append((now, str(reason)))
+            self.total_detach_events += 1
+            self._prune(now)
+
+    def snapshot(self):
+        '''Returns the metrics for the current window as a dictionary'''
+        with self._lock:
+            now = self._clock()
+            self._prune(now)
+            elapsed = max(min(self._window_seconds, now - self._started), 1e-6)
+            writes = np.array([write[1:] for write in self._writes], dtype=float).reshape(-1, 3)
+            latencies_us = writes[:, 2] * 1000000.0
+            edges = [0.0] + self.LATENCY_EDGES_US + [float('inf')]
+            queue_fill = [fill for (at, fill) in self._queue]
+            return {
+                'time': now,
+                'window_seconds': elapsed,
+                'writes_per_second': len(writes) / elapsed,
+                'packets_per_second': writes[:, 0].sum() / elapsed,
+                'bytes_per_second': writes[:, 1].sum() / elapsed,
+                'write_busy_fraction': min(1.0, writes[:, 2].sum() / elapsed),
+                'write_latency_us': {
+                    'edges': self.LATENCY_EDGES_US,
+                    'counts': np.histogram(latencies_us, bins=edges)[0].tolist(),
+                    'mean': float(latencies_us.mean()) if len(latencies_us) else None,
+                    'max': float(latencies_us.max()) if len(latencies_us) else None,
+                    },
+                'queue_fill': queue_fill[-1] if queue_fill else None,
+                'queue_fill_max': max(queue_fill) if queue_fill else None,
+                'detach_events': [reason for (at, reason) in self._detaches],
+                'total_packets': self.total_packets,
+                'total_bytes': self.total_bytes,
+                'total_detach_events': self.total_detach_events,
+                }
+
+    def json_line(self):
+        return json.dumps(self.snapshot(), sort_keys=True) + '\n'
+
+    def export(self, file_object):
+        '''Appends the current snapshot to file_object as a JSON line'''
+        file_object.write(self.json_line())
+
+    def _prune(self, now):
+        oldest = now - self._window_seconds
+        for events in (self._writes, self._queue, self._detaches):
+            while events and events[0][0] < oldest:
+                events.popleft()
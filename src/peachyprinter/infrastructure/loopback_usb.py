@@ -0,0 +1,202 @@
+import os
+import time
+import ctypes
+import logging
+from collections import deque
+from threading import Condition, Thread, current_thread
+
+from peachyprinter.infrastructure.messages import MoveMessage, DripRecordedMessage, SetDripCountMessage, MoveToDripCountMessage, IdentifyMessage, IAmMessage, GetAdcValMessage, ReturnAdcValMessage, PrinterStatusMessage
+
+logger = logging.getLogger('peachy')
+
+
+class LoopbackDevice(object):
+    '''Pure python stand in for a printer on the end of libPeachyUSB.
+    Holds at most capacity packets, writes block while it is full as they do with the native library.
+    Move packets are consumed at samples_per_second (0 consumes as fast as they arrive), drips are reported at drips_per_second
+    and a PrinterStatusMessage is sent every status_interval seconds. Identify and GetAdcVal are answered.'''
+
+    TICK_SECONDS = 0.001
+
+    def __init__(self, capacity, samples_per_second=2000, drips_per_second=0.0, status_interval=0.5, data_rate=2000, serial_number='LOOPBACK'):
+        self._capacity = max(1, capacity)
+        self._samples_per_second = samples_per_second
+        self._drips_per_second = drips_per_second
+        self._status_interval = status_interval
+        self._identity = IAmMessage('loopback', 'loopback', serial_number, data_rate)
+        self._read_callback = None
+        self._packets = deque()
+        self._condition = Condition()
+        self._running = True
+        self._last_move = None
+        self._drip_offset = 0.0
+        self._drips_reported = 0
+        self.target_drips = None
+        self.samples = 0
+        self.packets = 0
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_read_callback(self, callback):
+        self._read_callback = callback
+
+    def write(self, data):
+        with self._condition:
+            while self._running and len(self._packets) >= self._capacity:
+                self._condition.wait()
+            if self._running:
+                self._packets.append(data)
+                self._condition.notify_all()
+
+    def depth(self):
+        return len(self._packets)
+
+    def drain(self, timeout=None):
+        '''Waits until every packet written has been consumed, returns False if timeout seconds pass first'''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._running and self._packets:
+                if deadline is not None and time.time() >= deadline:
+                    return False
+                self._condition.wait(self.TICK_SECONDS)
+            return not self._packets
+
+    def shutdown(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not current_thread():
+            self._thread.join(1.0)
+
+    def _run(self):
+        started = time.time()
+        last_tick = started
+        next_status = started
+        allowance = 0.0
+        while self._running:
+            now = time.time()
+            if self._samples_per_second:
+                allowance = min(allowance + (now - last_tick) * self._samples_per_second, self._capacity)
+            last_tick = now
+            for packet in self._take(allowance):
+                if ord(packet[1]) == MoveMessage.TYPE_ID:
+                    allowance -= 1
+                    self.samples += 1
+                    self._last_move = packet
+                else:
+                    self._handle(packet)
+            self._report_drips(now - started)
+            if self._status_interval and now >= next_status:
+                next_status = now + self._status_interval
+                self._status()
+            time.sleep(self.TICK_SECONDS)
+
+    def _take(self, allowance):
+        with self._condition:
+            taken = []
+            moves = 0
+            while self._packets and (not self._samples_per_second or moves < int(allowance)):
+                packet = self._packets.popleft()
+                if ord(packet[1]) == MoveMessage.TYPE_ID:
+                    moves += 1
+                taken.append(packet)
+            if taken:
+                self.packets += len(taken)
+                self._condition.notify_all()
+            return taken
+
+    def _handle(self, packet):
+        type_id = ord(packet[1])
+        payload = packet[2:ord(packet[0]) + 1]
+        if type_id == SetDripCountMessage.TYPE_ID:
+            self._drip_offset = self._drips_reported - SetDripCountMessage.from_bytes(payload).drips
+        elif type_id == MoveToDripCountMessage.TYPE_ID:
+            self.target_drips = MoveToDripCountMessage.from_bytes(payload).drips
+        elif type_id == IdentifyMessage.TYPE_ID:
+            self._reply(self._identity)
+        elif type_id == GetAdcValMessage.TYPE_ID:
+            self._reply(ReturnAdcValMessage(0))
+        else:
+            logger.info("Loopback device ignored message type %s" % type_id)
+
+    def _report_drips(self, elapsed):
+        if not self._drips_per_second:
+            return
+        drips = int(elapsed * self._drips_per_second)
+        if drips > self._drips_reported:
+            self._drips_reported = drips
+            self._reply(DripRecordedMessage(int(drips - self._drip_offset)))
+
+    def _status(self):
+        laser_on = False
+        if self._last_move:
+            laser_on = MoveMessage.from_bytes(self._last_move[2:]).laser_power > 0
+        self._reply(PrinterStatusMessage(True, False, True, laser_on, 0))
+
+    def _reply(self, message):
+        callback = self._read_callback
+        if callback:
+            data = chr(message.TYPE_ID) + message.get_bytes()
+            callback(data, len(data))
+
+
+class _LoopbackFunction(object):
+    '''Stands in for a function exported by a ctypes library, argtypes and restype are accepted and ignored'''
+
+    def __init__(self, function):
+        self._function = function
+        self.argtypes = None
+        self.restype = None
+
+    def __call__(self, *args):
+        return self._function(*args)
+
+
+class LoopbackLibrary(object):
+    '''Provides the libPeachyUSB functions backed by a LoopbackDevice. load_library returns one of these when
+    PEACHY_API_DLL_PATH is set to loopback, the PEACHY_LOOPBACK_* environment variables configure the device.
+    The most recently opened device is kept as device'''
+
+    VERSION = 'loopback'
+
+    def __init__(self, attached=True, **device_options):
+        self.attached = attached
+        self.device_options = device_options
+        self.device = None
+        self.peachyusb_init = _LoopbackFunction(self._init)
+        self.peachyusb_shutdown = _LoopbackFunction(self._shutdown)
+        self.peachyusb_set_read_callback = _LoopbackFunction(self._set_read_callback)
+        self.peachyusb_write = _LoopbackFunction(self._write)
+        self.peachyusb_version = _LoopbackFunction(lambda: self.VERSION)
+
+    @classmethod
+    def from_environment(cls, environment=os.environ):
+        options = {}
+        for (option, variable, convert) in [
+                ('samples_per_second', 'PEACHY_LOOPBACK_SAMPLES_PER_SECOND', int),
+                ('drips_per_second', 'PEACHY_LOOPBACK_DRIPS_PER_SECOND', float),
+                ('data_rate', 'PEACHY_LOOPBACK_DATA_RATE', int),
+                ]:
+            if environment.get(variable):
+                options[option] = convert(environment[variable])
+        return cls(**options)
+
+    def _init(self, capacity):
+        if not self.attached:
+            return None
+        self.device = LoopbackDevice(capacity, **self.device_options)
+        return self.device
+
+    def _shutdown(self, device):
+        if device:
+            device.shutdown()
+
+    def _set_read_callback(self, device, callback):
+        device.set_read_callback(callback)
+
+    def _write(self, device, data, length):
+        if isinstance(data, (int, long)):
+            device.write(ctypes.string_at(data, length))
+        else:
+            device.write(str(data[:length]))
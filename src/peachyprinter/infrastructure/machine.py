@@ -44,6 +44,7 @@ class MachineStatus(object):
         self._drip_history = []
         self._axis = []
         self._skipped_layers = 0
+        self._layer_queue_depth = 0
 
     def drip_call_back(self, drips, height, drips_per_second, drip_history=[]):
         self._height = height
@@ -51,6 +52,9 @@ class MachineStatus(object):
         self._drips_per_second = drips_per_second
         self._drip_history = drip_history
 
+    def layer_queue_call_back(self, depth):
+        self._layer_queue_depth = depth
+
     def add_layer(self):
         self._current_layer += 1
 
@@ -116,6 +120,7 @@ class MachineStatus(object):
             'drips_per_second': self._drips_per_second,
             'model_height': self._model_height,
             'skipped_layers': self._skipped_layers,
-            'drip_history': self._drip_history,
+            'layer_queue_depth': self._layer_queue_depth,
+            'drip_history': list(self._drip_history),
             'axis': self._axis
         }
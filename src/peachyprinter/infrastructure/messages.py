@@ -1,4 +1,5 @@
 import logging
+import numpy as np
 
 logger = logging.getLogger('peachy')
 
@@ -70,6 +71,37 @@ class MoveMessage(ProtoBuffableMessage):
     def __repr__(self):
         return "x:y={}:{}, laser_power={}".format(self._x_pos, self._y_pos, self._laser_power)
 
+    @classmethod
+    def frames(cls, x_pos, y_pos, laser_power):
+        '''Encodes arrays of positions and powers as one buffer of length prefixed Move frames.
+        Gives the same bytes as framing get_bytes for each point in turn without building any messages'''
+        fields = [np.asarray(values).astype(np.int64).reshape(-1) for values in (x_pos, y_pos, laser_power)]
+        count = len(fields[0])
+        lengths = np.ones(count, dtype=np.int64)
+        columns = [None, np.full(count, cls.TYPE_ID, dtype=np.uint8)]
+        present = [np.ones(count, dtype=bool), np.ones(count, dtype=bool)]
+        for (tag, values) in zip(MOVE_FIELD_TAGS, fields):
+            varints, varint_lengths = _varints(values)
+            columns.extend([np.full(count, tag, dtype=np.uint8), varints])
+            present.extend([np.ones(count, dtype=bool), _VARINT_POSITIONS < varint_lengths[:, np.newaxis]])
+            lengths += varint_lengths + 1
+        columns[0] = lengths.astype(np.uint8)
+        return np.column_stack(columns)[np.column_stack(present)].tobytes()
+
+
+MOVE_FIELD_TAGS = (0x08, 0x10, 0x18)
+_VARINT_POSITIONS = np.arange(10)
+_VARINT_SHIFTS = (_VARINT_POSITIONS * 7).astype(np.uint64)
+
+
+def _varints(values):
+    '''Protobuf varints for an array of int64, returned as an Nx10 array of bytes and the number used by each'''
+    groups = values.view(np.uint64)[:, np.newaxis] >> _VARINT_SHIFTS
+    lengths = np.maximum(1, np.count_nonzero(groups, axis=1))
+    varints = (groups & 0x7f).astype(np.uint8)
+    varints[_VARINT_POSITIONS < (lengths - 1)[:, np.newaxis]] |= 0x80
+    return (varints, lengths)
+
 
 class DripRecordedMessage(ProtoBuffableMessage):
     TYPE_ID = 3
@@ -1,6 +1,7 @@
 import logging
 logger = logging.getLogger('peachy')
 import sys
+import numpy as np
 from peachyprinter.domain.disseminator import Disseminator
 from peachyprinter.infrastructure.messages import MoveMessage
 
@@ -13,14 +14,88 @@ class MicroDisseminator(Disseminator):
         self._communication = comunication
         self.LASER_MAX = pow(2, 8) - 1
         self.DEFLECTION_MAX = pow(2, self.BIT_DEPTH) - 1
+        self._position = (0, 0)
 
     def process(self, data):
         laser_power = int(self._laser_control.laser_power() * self.LASER_MAX)
+        if getattr(self._communication, 'send_frames', None):
+            self._send_frames(data, np.full(len(data), laser_power, dtype=int))
+            return
         for (x, y) in data:
             x_scaled = int(x * self.DEFLECTION_MAX)
             y_scaled = int(y * self.DEFLECTION_MAX)
             data = MoveMessage(x_scaled, y_scaled, laser_power)
             self._communication.send(data)
+            self._position = (x_scaled, y_scaled)
+
+    def process_points(self, data, laser_on):
+        '''As process but with the laser switched per point, laser_on holds a bool for each point in data'''
+        on_power = int(self._laser_control.laser_on_power() * self.LASER_MAX)
+        powers = np.where(laser_on, on_power, 0)
+        if getattr(self._communication, 'send_frames', None):
+            self._send_frames(data, powers)
+            return
+        scaled = (np.asarray(data) * self.DEFLECTION_MAX).astype(int).tolist()
+        for ((x_scaled, y_scaled), laser_power) in zip(scaled, powers.tolist()):
+            self._communication.send(MoveMessage(x_scaled, y_scaled, laser_power))
+            self._position = (x_scaled, y_scaled)
+
+    def encode_points(self, data, laser_on):
+        '''Returns the frames process_points would send for data, or None when the communicator does not take frames'''
+        if not getattr(self._communication, 'send_frames', None):
+            return None
+        on_power = int(self._laser_control.laser_on_power() * self.LASER_MAX)
+        return self._frames(data, np.where(laser_on, on_power, 0))
+
+    def encoder(self, laser_control):
+        '''Returns a disseminator using laser_control that can encode points but not send them,
+        for working out frames away from the printer'''
+        return MicroDisseminator(laser_control, _EncodeOnly(), self._data_rate)
+
+    def send_encoded(self, frames, points=None):
+        '''Sends frames from encode_points, points is the number of points they were encoded from when known'''
+        if frames:
+            self._communication.send_frames(frames, points)
+
+    def discard(self):
+        '''Drops samples waiting to go to the printer, leaving a laser off as the next sample, at the last position sent other than by send_encoded'''
+        discard = getattr(self._communication, 'discard', None)
+        if discard:
+            (x_scaled, y_scaled) = self._position
+            discard(MoveMessage.frames([x_scaled], [y_scaled], [0]), 1)
+
+    def flush(self, timeout=None):
+        '''Waits for samples sent to reach the printer, returns False if timeout seconds pass first'''
+        flush = getattr(self._communication, 'flush', None)
+        if flush:
+            return flush(timeout)
+        return True
+
+    def hold(self, point, seconds):
+        '''Sends seconds worth of samples at point with the laser off, as one block of identical frames when supported'''
+        samples = int(seconds * self._data_rate)
+        if samples <= 0:
+            return
+        (x_scaled, y_scaled) = (np.asarray(point, dtype=float)[:2] * self.DEFLECTION_MAX).astype(int).tolist()
+        self._position = (x_scaled, y_scaled)
+        if getattr(self._communication, 'send_frames', None):
+            self._communication.send_frames(MoveMessage.frames([x_scaled], [y_scaled], [0]) * samples, samples)
+            return
+        message = MoveMessage(x_scaled, y_scaled, 0)
+        for sample in range(samples):
+            self._communication.send(message)
+
+    def _send_frames(self, data, powers):
+        frames = self._frames(data, powers)
+        if frames:
+            self._communication.send_frames(frames, len(data))
+            self._position = tuple((np.asarray(data[-1], dtype=float)[:2] * self.DEFLECTION_MAX).astype(int).tolist())
+
+    def _frames(self, data, powers):
+        scaled = (np.asarray(data, dtype=float).reshape(-1, 2) * self.DEFLECTION_MAX).astype(int)
+        if len(scaled):
+            return MoveMessage.frames(scaled[:, 0], scaled[:, 1], powers)
+        return ''
 
     def next_layer(self, height):
         pass
@@ -31,3 +106,16 @@ class MicroDisseminator(Disseminator):
 
     def close(self):
         self._communication.close()
+
+
+class _EncodeOnly(object):
+    '''Stands in for a frame taking communicator where frames are only encoded'''
+
+    def send(self, message):
+        raise Exception('Encode only disseminator cannot send')
+
+    def send_frames(self, frames, packets=None):
+        raise Exception('Encode only disseminator cannot send')
+
+    def close(self):
+        pass
@@ -58,6 +58,128 @@ class PathToPoints(object):
                 else:
                     return self._get_points(start, end, samples)
 
+    def carry_state(self):
+        '''Returns what is carried from one call to the next so work done ahead of time can be undone with restore_carry_state'''
+        left_over_start = None if self._left_over_start is None else list(self._left_over_start)
+        return (self._left_over_samples, left_over_start, self._last_z, self._reported_small_warning)
+
+    def restore_carry_state(self, state):
+        (self._left_over_samples, self._left_over_start, self._last_z, self._reported_small_warning) = state
+
+    def copy(self):
+        '''Returns a PathToPoints with the same settings, transformer and carry state'''
+        path_to_points = PathToPoints(self.samples_per_second, self._transformer, self.laser_size)
+        path_to_points.restore_carry_state(self.carry_state())
+        return path_to_points
+
+    def process_segments(self, starts, ends, speeds):
+        '''Processes a run of segments giving the same points as calling process on each in turn.
+        Sample counts, including the left over samples carried across short segments, are worked out for the
+        whole run and the points written into a single array. Returns the points and the number of points that
+        came from each segment. Does not take the lock so calls must not overlap with process'''
+        starts = numpy.asarray(starts, dtype=float).reshape(-1, 3)
+        ends = numpy.asarray(ends, dtype=float).reshape(-1, 3)
+        transformer = self._transformer
+        (counts, from_points) = self._count_segments(starts, ends, speeds)
+        if not len(counts):
+            return (numpy.empty((0, 2)), counts)
+
+        drawn = counts > 0
+        total = counts.sum()
+        points = numpy.empty((total, 2))
+        if total:
+            segment_counts = counts[drawn]
+            segment_ends = numpy.cumsum(segment_counts)
+            segment_starts = segment_ends - segment_counts
+            first, last = self._transform_ends(transformer, from_points[drawn], ends[drawn])
+            step = (last - first) / (segment_counts - 1)[:, numpy.newaxis]
+            position = numpy.arange(total, dtype=float) - numpy.repeat(segment_starts, segment_counts)
+            numpy.multiply(position[:, numpy.newaxis], numpy.repeat(step, segment_counts, axis=0), out=points)
+            points += numpy.repeat(first, segment_counts, axis=0)
+            points[segment_ends - 1] = last
+        return (points, counts)
+
+    def advance_segments(self, starts, ends, speeds):
+        '''Updates the carry state as process_segments would without working out any points'''
+        self._count_segments(numpy.asarray(starts, dtype=float).reshape(-1, 3), numpy.asarray(ends, dtype=float).reshape(-1, 3), speeds)
+
+    def _count_segments(self, starts, ends, speeds):
+        '''Returns the number of points each segment gives and the point each starts from, carrying left over samples'''
+        speeds = numpy.asarray(speeds, dtype=float).reshape(-1)
+        if not len(speeds):
+            return (numpy.zeros(0, dtype=int), starts)
+        heights = numpy.maximum.accumulate(numpy.concatenate(([self._last_z], starts[:, 2])))
+        resets = starts[:, 2] > heights[:-1]
+        delta = ends[:, :2] - starts[:, :2]
+        distances = numpy.sqrt(delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1])
+        distances[distances == 0] = self.laser_size
+        samples = self.samples_per_second * (distances / speeds)
+        counts = samples.astype(int)
+        from_points = starts.copy()
+        self._carry_left_over(samples, counts, from_points, starts, resets)
+        self._last_z = float(heights[-1])
+        return (counts, from_points)
+
+    def _carry_left_over(self, samples, counts, from_points, starts, resets):
+        '''Walks the segments that are short or follow a short segment as process would, updating counts and
+        from_points in place. All other segments start and end with nothing left over'''
+        short = samples < 2.0
+        affected = short.copy()
+        affected[1:] |= short[:-1]
+        left_over_start = None if not self._left_over_start else numpy.array(self._left_over_start, dtype=float)
+        if left_over_start is not None or self._left_over_samples:
+            affected[0] = True
+        reset_count = numpy.cumsum(resets)
+        if not affected.any():
+            self._left_over_samples = 0.0
+            self._left_over_start = None
+            self._reported_small_warning = bool(self._reported_small_warning and not reset_count[-1])
+            return
+        left_over_samples = self._left_over_samples
+        reported = self._reported_small_warning
+        last_reset_count = 0
+        previous = -1
+        for index in numpy.flatnonzero(affected).tolist():
+            if index != previous + 1:
+                left_over_samples = 0.0
+                left_over_start = None
+            if reset_count[index] != last_reset_count:
+                reported = False
+                last_reset_count = reset_count[index]
+            if resets[index]:
+                left_over_samples = 0.0
+                left_over_start = None
+            current = samples[index] + left_over_samples
+            if current < 2.0:
+                if not reported:
+                    logger.info("The data in the model is too complex skipping vertex(s) at height %s mm" % starts[index, 2])
+                    reported = True
+                if left_over_start is None:
+                    left_over_start = starts[index]
+                left_over_samples = current
+                counts[index] = 0
+            else:
+                left_over_samples = 0.0
+                if left_over_start is not None:
+                    from_points[index] = left_over_start
+                    left_over_start = None
+                counts[index] = int(current)
+            previous = index
+        if previous != len(samples) - 1:
+            left_over_samples = 0.0
+            left_over_start = None
+        self._left_over_samples = left_over_samples
+        self._left_over_start = None if left_over_start is None else left_over_start.tolist()
+        self._reported_small_warning = bool(reported and reset_count[-1] == last_reset_count)
+
+    def _transform_ends(self, transformer, starts, ends):
+        both = numpy.concatenate((starts, ends))
+        if getattr(transformer, 'transform_many', None):
+            transformed = transformer.transform_many(both)
+        else:
+            transformed = numpy.array([transformer.transform(point)[:2] for point in both.tolist()], dtype=float)
+        return (transformed[:len(starts)], transformed[len(starts):])
+
     def set_transformer(self, transformer):
         with self._lock:
             self._transformer = transformer
@@ -1,5 +1,7 @@
 from peachyprinter.libraries import load_library
 import ctypes
+import numpy as np
+from threading import Lock
 
 class peachyusb_t(ctypes.Structure):
     pass
@@ -23,28 +25,78 @@ def _load_library():
     dll.peachyusb_version.restype = ctypes.c_char_p
     return dll
 
-lib = _load_library()
+def _address_writer(dll):
+    if isinstance(dll, ctypes.CDLL):
+        return ctypes.CFUNCTYPE(None, peachyusb_t_p, ctypes.c_void_p, ctypes.c_uint)(('peachyusb_write', dll))
+    return dll.peachyusb_write
 
-lib_version = lib.peachyusb_version()
+lib = None
+_write_address = None
+_load_error = None
+_load_lock = Lock()
 
 class PeachyUSBException(Exception):
-    pass
+    def __init__(self, message, value=None):
+        super(PeachyUSBException, self).__init__(message)
+        self.value = value
+
+def _library():
+    '''Loads libPeachyUSB the first time it is needed, the library or the failure to load it is kept for later calls'''
+    global lib, _write_address, _load_error
+    with _load_lock:
+        if lib is None and _load_error is None:
+            try:
+                dll = _load_library()
+                _write_address = _address_writer(dll)
+                lib = dll
+            except Exception as ex:
+                _load_error = ex
+        if lib is None:
+            raise PeachyUSBException("USB library could not be loaded: %s" % _load_error)
+        return lib
+
+def library_version():
+    return _library().peachyusb_version()
 
 class PeachyUSB(object):
+    MAX_PACKET_SIZE = 64
+    MALFORMED_PACKET = -2
+
     def __init__(self, capacity):
-        self.context = lib.peachyusb_init(capacity)
+        self.context = None
+        self.context = _library().peachyusb_init(capacity)
         if not self.context:
             raise PeachyUSBException("No printer found")
 
     def __del__(self):
-        lib.peachyusb_shutdown(self.context)
+        if self.context:
+            lib.peachyusb_shutdown(self.context)
         self.context = None
 
     def write(self, buf):
         if not self.context:
             raise PeachyUSBException("No printer found")
         lib.peachyusb_write(self.context, buf, len(buf))
-        
+
+    def write_many(self, frames):
+        '''Writes a buffer of length prefixed packets returning the number written. Each packet is queued straight from the buffer without slicing or copying it.
+        libPeachyUSB takes one packet of at most MAX_PACKET_SIZE bytes per write so packets are still submitted one at a time'''
+        if not self.context:
+            raise PeachyUSBException("No printer found")
+        data = np.asarray(frames) if isinstance(frames, memoryview) else np.frombuffer(frames, dtype=np.uint8)
+        address = data.ctypes.data
+        offset = 0
+        packets = 0
+        total = len(data)
+        while offset < total:
+            size = data.item(offset) + 1
+            if size > self.MAX_PACKET_SIZE or offset + size > total:
+                raise PeachyUSBException("Malformed packet at byte %s" % offset, self.MALFORMED_PACKET)
+            _write_address(self.context, address + offset, size)
+            offset += size
+            packets += 1
+        return packets
+
     def set_read_callback(self, func):
         if not self.context:
             raise PeachyUSBException("No printer found")
@@ -22,6 +22,13 @@ class SquareTransform(object):
         [kx, ky, k] = [ deflections.item(i, 0) for i in range(3) ]
         return [kx/k, ky/k]
 
+    def fit_many(self, xy):
+        '''Fits an Nx2 array of actual coordanates returning an Nx2 array'''
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        actual_coordanates = np.column_stack((xy, np.ones(len(xy))))
+        deflections = np.dot(actual_coordanates, np.asarray(self.transformation_matrix).T)
+        return deflections[:, :2] / deflections[:, 2:]
+
     def _generate_transformation_matrix(self,points):
         base_matrix = self._build_forward_matrix(points)
         solutions_vector = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1]
@@ -51,31 +58,33 @@ class SquareTransform(object):
         return augment
 
 class PointTransformer(Transformer):
+    '''Fits a cubic in bent, squared coordanates to the calibration points.
+    The bends are found by a grid search refined around the best candidate, every candidate at a level is fitted in
+    one batch of least squares solves with both deflection axes solved together'''
+
+    # Powers of x and y for x**3, x**2*y, x*y**2, y**3, x**2, x*y, y**2, x, y, 1
+    MONOMIAL_POWERS = np.array([
+        [3, 0], [2, 1], [1, 2], [0, 3],
+        [2, 0], [1, 1], [0, 2],
+        [1, 0], [0, 1],
+        [0, 0],
+    ])
+
     def __init__(self, calibration_points):
         if len(calibration_points) < 12:
             logger.error("Not Enough Calibration Points")
             raise Exception("Not Enough Calibration Points")
 
         self.squarer = SquareTransform(calibration_points[:4])
-        self.monomials = [
-            lambda x,y : x**3,
-            lambda x,y : x**2*y,
-            lambda x,y : x*y**2,
-            lambda x,y : y**3,
-            lambda x,y : x**2,
-            lambda x,y : x*y,
-            lambda x,y : y**2,
-            lambda x,y : x,
-            lambda x,y : y,
-            lambda x,y : 1
-        ]
-
-        self.calibrated_bend_x, self.calibrated_bend_y, self.coeffecient_vector_x, self.coeffecient_vector_y, self.calibrated_scale = self._get_best_bends(calibration_points,self.monomials)
-
-    def _get_best_bends(self,points,monomials):
+        self.calibrated_bend_x, self.calibrated_bend_y, self.coeffecient_vector_x, self.coeffecient_vector_y, self.calibrated_scale = self._get_best_bends(calibration_points)
+        self._coeffecients = np.column_stack((self.coeffecient_vector_x, self.coeffecient_vector_y))
+
+    def _get_best_bends(self,points):
+        deflections = np.array([deflection for (deflection, actual) in points], dtype=float)
+        fit = self.squarer.fit_many([actual for (deflection, actual) in points])
         best_bend = self._find_best_bends(
-            points,
-            monomials,
+            fit,
+            deflections,
             range(1,2001, 500),
             range(1, 2001, 500),
             range(1, 2001, 500),
@@ -86,56 +95,61 @@ class PointTransformer(Transformer):
         return best_bend[:5]
 
     factor = 1000.0
-    def _find_best_bends(self,points,monomials, scale_range, x_range, y_range, step, best_bend):
-        for s in scale_range:
-            for y in y_range:
-                for x in x_range:
-                    xbend = x / self.factor
-                    ybend = y / self.factor
-                    scale = s / self.factor
-                    (coeffecient_vector_d1, error_d1), (coeffecient_vector_d2 , error_d2)= self._get_coeffecient_vectors(points, monomials,xbend,ybend,scale )
-                    error = error_d1[0] + error_d2[0]
-                    if best_bend[5] > error:
-                        logger.info('New Best: %s %s : %s -> %s' % (xbend, ybend, scale, error ))
-                        best_bend = (xbend, ybend, coeffecient_vector_d1,coeffecient_vector_d2, scale, error)
+    def _find_best_bends(self, fit, deflections, scale_range, x_range, y_range, step, best_bend):
+        scales, ybends, xbends = [grid.ravel() / self.factor for grid in np.meshgrid(scale_range, y_range, x_range, indexing='ij')]
+        coeffecients, errors = self._get_coeffecient_vectors(fit, deflections, xbends, ybends, scales)
+        best = int(np.argmin(errors))
+        if best_bend[5] > errors[best]:
+            logger.info('New Best: %s %s : %s -> %s' % (xbends[best], ybends[best], scales[best], errors[best]))
+            best_bend = (xbends[best], ybends[best], coeffecients[best, :, 0], coeffecients[best, :, 1], scales[best], errors[best])
         new_step = int(step - math.ceil(step / 2.0))
         if new_step > 0:
             x_range = range(int(best_bend[0] * self.factor) - step, int(best_bend[0] * self.factor) + step, new_step)
             y_range = range(int(best_bend[1] * self.factor) - step, int(best_bend[1] * self.factor) + step, new_step)
             s_range = range(int(best_bend[4] * self.factor) - step, int(best_bend[4] * self.factor) + step, new_step)
-            return self._find_best_bends(points,monomials,s_range,x_range,y_range,new_step, best_bend)
+            return self._find_best_bends(fit, deflections, s_range, x_range, y_range, new_step, best_bend)
         else:
             return best_bend
 
-    def _get_coeffecient_vectors(self, points, monomials,xbend,ybend,scale):
-        target_deflection_1 = []
-        target_deflection_2 = []
-        rows = []
-        for ((deflection_1,deflection_2),(actual_x,actual_y)) in points:
-            target_deflection_1.append(deflection_1)
-            target_deflection_2.append(deflection_2)
-            fit_x, fit_y = self.squarer.fit(actual_x,actual_y)
-            bend_x,bend_y = self._bend(fit_x, fit_y,xbend,ybend,scale)
-            rows.append([ f(bend_x,bend_y) for f in monomials ])
-
-        coeffecient_matrix = np.matrix(rows)
-        target_vector_d1 = np.array(target_deflection_1)
-        target_vector_d2 = np.array(target_deflection_2)
-
-        results_d1 = np.linalg.lstsq(coeffecient_matrix, target_vector_d1)[:2]
-        results_d2 = np.linalg.lstsq(coeffecient_matrix, target_vector_d2)[:2]
-        return (results_d1, results_d2)
+    def _get_coeffecient_vectors(self, fit, deflections, xbends, ybends, scales):
+        '''Returns Cx10x2 coeffecients and C squared errors for C candidate bends.
+        Candidates with a scale of 0 cannot be bent and get an infinite error'''
+        with np.errstate(all='ignore'):
+            bent = self._bend_many(fit, xbends, ybends, scales)
+            matrices = self._monomials(bent)
+            u, s, vt = np.linalg.svd(matrices, full_matrices=False)
+            cutoff = 1e-15 * s.max(axis=1, keepdims=True)
+            inverse_s = np.where(s > cutoff, 1.0 / s, 0.0)
+            projected = np.einsum('cnk,nd->ckd', u, deflections) * inverse_s[:, :, np.newaxis]
+            coeffecients = np.einsum('ckm,ckd->cmd', vt, projected)
+            residuals = np.einsum('cnm,cmd->cnd', matrices, coeffecients) - deflections
+            errors = (residuals ** 2).sum(axis=(1, 2))
+        errors[~np.isfinite(errors) | (scales == 0)] = np.inf
+        return coeffecients, errors
 
     def _bend(self,x,y,xbend,ybend,scale):
         bent_x = xbend * (scale * math.atan(x / scale)) + (1.0-xbend)  * x
         bent_y = ybend * (scale * math.atan(y / scale)) + (1.0-ybend)  * y
         return (bent_x, bent_y)
 
+    def _bend_many(self, fit, xbends, ybends, scales):
+        '''Bends Nx2 fit points by C candidate bends returning a CxNx2 array'''
+        bends = np.column_stack((xbends, ybends))[:, np.newaxis, :]
+        scales = np.asarray(scales, dtype=float)[:, np.newaxis, np.newaxis]
+        return bends * (scales * np.arctan(fit / scales)) + (1.0 - bends) * fit
+
+    def _monomials(self, bent):
+        '''Evaluates the monomials for ...xNx2 points returning ...xNx10'''
+        return np.prod(bent[..., np.newaxis, :] ** self.MONOMIAL_POWERS, axis=-1)
+
     def transform(self,xyz):
         x,y,z = xyz
-        fit_x, fit_y = self.squarer.fit(x,y)
-        bend_x,bend_y = self._bend(fit_x, fit_y,self.calibrated_bend_x,self.calibrated_bend_y, self.calibrated_scale)
-
-        transform_x = sum( [ m * a(bend_x,bend_y) for (m,a) in zip(self.coeffecient_vector_x, self.monomials)] )
-        transform_y = sum( [ m * a(bend_x,bend_y) for (m,a) in zip(self.coeffecient_vector_y, self.monomials)] )
+        transform_x, transform_y = self.transform_many([xyz])[0].tolist()
         return [ transform_x,transform_y, z ]
+
+    def transform_many(self, xyz):
+        '''Transforms an Nx3 array of points returning an Nx2 array of deflections'''
+        xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        fit = self.squarer.fit_many(xyz[:, :2])
+        bent = self._bend_many(fit, [self.calibrated_bend_x], [self.calibrated_bend_y], [self.calibrated_scale])[0]
+        return np.dot(self._monomials(bent), self._coeffecients)
@@ -1,26 +1,32 @@
 import logging
 logger = logging.getLogger('peachy')
+import numpy as np
+from collections import OrderedDict
+from threading import Lock
 from peachyprinter.domain.layer_generator import LayerGenerator
-from peachyprinter.domain.commands import LateralDraw, Layer, LateralMove
-from math import pi, sin, cos, sqrt
+from peachyprinter.domain.commands import ArrayLayer, COMMAND_DTYPE
+from math import pi
 
 
-class HalfVaseTestGenerator(LayerGenerator):
-    name = "Half Vase With A Twist"
+class CompiledTestGenerator(LayerGenerator):
+    '''Base for test prints that work out the records of every layer at once as arrays.
+    Subclasses return the segment starts, ends and draw flags of all layers from an array of layer heights, a single
+    layer of segments is used for every height. Compiled prints are kept for the last CACHE_SIZE settings so repeating a
+    test print does not compile it again, layers share the compiled records which are read only'''
+
+    CACHE_SIZE = 4
+    _compiled = OrderedDict()
+    _compiled_lock = Lock()
 
     def __init__(self, height, width, layer_height, speed=100):
         self._height = float(height)
-        self._max_radius = float(width) / 2.0
+        self._width = float(width)
+        self._max_radius = self._width / 2.0
         self._layer_height = float(layer_height)
         self._speed = speed
-        self._current_height = 0.0
-        self._steps_in_half = 100
-        self._rad_per_step = pi / float(self._steps_in_half)
         self._layers = self._height / self._layer_height
-        logger.info("Half vase height: %s" % self._height)
-        logger.info("Half vase radius: %s" % self._max_radius)
-        logger.info("Half vase layer height: %s" % self._layer_height)
-        logger.info("Half vase speed: %s" % self._speed)
+        self._index = 0
+        self._compiled_layers = None
 
     def __iter__(self):
         return self
@@ -28,213 +34,143 @@ class HalfVaseTestGenerator(LayerGenerator):
     def __next__(self):
         return self.next()
 
-    def _points(self, radius, start_angle):
-        points = [[0, 0]]
-        for step in range(0, self._steps_in_half):
-            angle = start_angle + (step * self._rad_per_step)
-            x = sin(angle) * radius
-            y = cos(angle) * radius
-            points.append([x, y])
-        points.append([0, 0])
-        return points
-
-    def _start_angle(self):
-        percent_complete = self._current_height / self._height
-        angle = pi * percent_complete
-        return angle
-
-    def _radius(self):
-        percent_complete = self._current_height / self._height
-        factor = (sin(percent_complete * 2.0 * pi * 2.0) + 1) / 2.0
-        out = (self._max_radius * 0.75) + (factor * (self._max_radius * 0.25))
-        return out
-
     def next(self):
-        logger.info("Half vase height: %s" % self._height)
-        logger.info("Half vase current height: %s" % self._current_height)
-        if self._current_height >= self._height:
+        (heights, records) = self._compile()
+        if self._index >= len(heights):
             raise StopIteration
-        points = self._points(self._radius(), self._start_angle())
-        commands = [LateralDraw(points[index - 1], points[index], self._speed) for index in range(1, len(points))]
-        layer = Layer(self._current_height, commands=commands)
-        self._current_height = self._current_height + self._layer_height
+        layer = ArrayLayer(float(heights[self._index]), records[min(self._index, len(records) - 1)])
+        self._index += 1
         return layer
 
+    def _compile(self):
+        if self._compiled_layers is None:
+            key = (type(self), self._height, self._width, self._layer_height, self._speed)
+            with self._compiled_lock:
+                compiled = self._compiled.pop(key, None)
+                if compiled is None:
+                    compiled = self._compile_layers()
+                    if len(self._compiled) >= self.CACHE_SIZE:
+                        self._compiled.popitem(last=False)
+                self._compiled[key] = compiled
+            self._compiled_layers = compiled
+        return self._compiled_layers
+
+    def _compile_layers(self):
+        heights = self._heights()
+        (starts, ends, draw) = self._segments(heights)
+        records = np.empty(starts.shape[:2], dtype=COMMAND_DTYPE)
+        records['start'] = starts
+        records['end'] = ends
+        records['speed'] = self._speed
+        records['draw'] = draw
+        records.flags.writeable = False
+        logger.info("Compiled %s layers of %s" % (len(heights), self.name))
+        return (heights, records)
+
+    def _heights(self):
+        '''Returns the layer heights, added up one layer at a time as the generators always have'''
+        count = int(np.ceil(self._height / self._layer_height)) + 1
+        heights = np.add.accumulate(np.concatenate(([0.0], np.repeat(self._layer_height, count))))
+        return heights[heights < self._height]
+
+    def _arcs(self, radii, start_angles, steps, rad_per_step):
+        '''Returns steps points around an arc for each radius and start angle as an array of layers by points by xy'''
+        angles = np.asarray(start_angles, dtype=float)[:, np.newaxis] + (np.arange(steps) * rad_per_step)
+        radii = np.asarray(radii, dtype=float)[:, np.newaxis]
+        return np.dstack((np.sin(angles) * radii, np.cos(angles) * radii))
+
+    def _through_centre(self, points):
+        centre = np.zeros((len(points), 1, 2))
+        return np.concatenate((centre, points, centre), axis=1)
+
+    def _polylines(self, points):
+        '''Returns the segments drawing through each layer of points'''
+        return (points[:, :-1], points[:, 1:], np.ones(points.shape[1] - 1, dtype=bool))
+
+    def _segments(self, heights):
+        raise NotImplementedError()
+
+
+class HalfVaseTestGenerator(CompiledTestGenerator):
+    name = "Half Vase With A Twist"
 
-class SolidObjectTestGenerator(LayerGenerator):
+    def __init__(self, height, width, layer_height, speed=100):
+        super(HalfVaseTestGenerator, self).__init__(height, width, layer_height, speed)
+        self._steps_in_half = 100
+        self._twists = pi
+        self._rad_per_step = pi / float(self._steps_in_half)
+        logger.info("Half vase height: %s" % self._height)
+        logger.info("Half vase radius: %s" % self._max_radius)
+        logger.info("Half vase layer height: %s" % self._layer_height)
+        logger.info("Half vase speed: %s" % self._speed)
+
+    def _radii(self, percent_complete):
+        factor = (np.sin(percent_complete * 2.0 * pi * 2.0) + 1) / 2.0
+        return (self._max_radius * 0.75) + (factor * (self._max_radius * 0.25))
+
+    def _segments(self, heights):
+        percent_complete = heights / self._height
+        points = self._arcs(self._radii(percent_complete), self._twists * percent_complete, self._steps_in_half, self._rad_per_step)
+        return self._polylines(self._through_centre(points))
+
+
+class SolidObjectTestGenerator(CompiledTestGenerator):
     name = "Solidified Object of Opressive Beauty"
 
     def __init__(self, height, width, layer_height, speed=100):
-        self._height = float(height)
-        self._max_radius = float(width) / 2.0
-        self._layer_height = float(layer_height)
-        self._speed = speed
-        self._current_height = 0.0
+        super(SolidObjectTestGenerator, self).__init__(height, width, layer_height, speed)
         self._steps_in_circle = 180
         self._steps_circle_section = 155
         self._rad_per_step = (2.0*pi) / float(self._steps_in_circle)
-        self._layers = self._height / self._layer_height
         logger.info("Solidified Object height: %s" % self._height)
         logger.info("Solidified Object radius: %s" % self._max_radius)
         logger.info("Solidified Object layer height: %s" % self._layer_height)
         logger.info("Solidified Object speed: %s" % self._speed)
 
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return self.next()
-
-    def _points(self, radius, start_angle):
-        points = [[0, 0]]
-        for step in range(0, self._steps_circle_section):
-            angle = start_angle + (step * self._rad_per_step)
-            x = sin(angle) * radius
-            y = cos(angle) * radius
-            points.append([x, y])
-        points.append([0, 0])
-        return points
-
-    def _start_angle(self):
-        percent_complete = self._current_height / self._height
-        angle = pi * percent_complete
-        return angle
-
-    def _radius(self):
-        percent_complete = self._current_height / self._height
-        factor = ((cos(sqrt(percent_complete) * pi * 3.0) / 4.0) + 0.75 - (percent_complete * 0.5)) * self._max_radius
-        return factor
+    def _radii(self, percent_complete):
+        return ((np.cos(np.sqrt(percent_complete) * pi * 3.0) / 4.0) + 0.75 - (percent_complete * 0.5)) * self._max_radius
 
-    def next(self):
-        if self._current_height >= self._height:
-            raise StopIteration
-        points = self._points(self._radius(), self._start_angle())
-        commands = [LateralDraw(points[index - 1], points[index], self._speed) for index in range(1, len(points))]
-        layer = Layer(self._current_height, commands=commands)
-        self._current_height = self._current_height + self._layer_height
-        return layer
+    def _segments(self, heights):
+        percent_complete = heights / self._height
+        points = self._arcs(self._radii(percent_complete), pi * percent_complete, self._steps_circle_section, self._rad_per_step)
+        return self._polylines(self._through_centre(points))
 
 
-class TwistVaseTestGenerator(LayerGenerator):
+class TwistVaseTestGenerator(HalfVaseTestGenerator):
     name = "Half Vase With A Bunch of Twists"
 
     def __init__(self, height, width, layer_height, speed=100):
-        self._height = float(height)
-        self._max_radius = float(width) / 2.0
-        self._layer_height = float(layer_height)
-        self._speed = speed
-        self._current_height = 0.0
-        self._steps_in_half = 100
+        super(TwistVaseTestGenerator, self).__init__(height, width, layer_height, speed)
         self._twists = 3 * pi
-        self._rad_per_step = pi / float(self._steps_in_half)
-        self._layers = self._height / self._layer_height
-
-        logger.info("Half vase height: %s" % self._height)
-        logger.info("Half vase radius: %s" % self._max_radius)
-        logger.info("Half vase layer height: %s" % self._layer_height)
-        logger.info("Half vase speed: %s" % self._speed)
 
-    def __iter__(self):
-        return self
 
-    def __next__(self):
-        return self.next()
-
-    def _points(self, radius, start_angle):
-        points = [[0, 0]]
-        for step in range(0, self._steps_in_half):
-            angle = start_angle + (step * self._rad_per_step)
-            x = sin(angle) * radius
-            y = cos(angle) * radius
-            points.append([x, y])
-        points.append([0, 0])
-        return points
-
-    def _start_angle(self):
-        percent_complete = self._current_height / self._height
-        angle = self._twists * percent_complete
-        return angle
-
-    def _radius(self):
-        percent_complete = self._current_height / self._height
-        factor = (sin(percent_complete * 2.0 * pi * 2.0) + 1) / 2.0
-        out = (self._max_radius * 0.75) + (factor * (self._max_radius * 0.25))
-        return out
-
-    def next(self):
-        logger.info("Half vase height: %s" % self._height)
-        logger.info("Half vase current height: %s" % self._current_height)
-        if self._current_height >= self._height:
-            raise StopIteration
-        points = self._points(self._radius(), self._start_angle())
-        commands = [LateralDraw(points[index - 1], points[index], self._speed) for index in range(1, len(points))]
-        layer = Layer(self._current_height, commands=commands)
-        self._current_height = self._current_height + self._layer_height
-        return layer
-
-
-class SimpleVaseTestGenerator(LayerGenerator):
+class SimpleVaseTestGenerator(CompiledTestGenerator):
     name = "Simple 5 Sided 180 Twist Vase"
 
     def __init__(self, height, width, layer_height, speed=100):
-        self._height = float(height)
-        self._max_radius = float(width) / 2.0
-        self._layer_height = float(layer_height)
-        self._speed = speed
-        self._current_height = 0.0
+        super(SimpleVaseTestGenerator, self).__init__(height, width, layer_height, speed)
         self._steps = 5
         self._rad_per_step = 2 * pi / float(self._steps)
-        self._layers = self._height / self._layer_height
         self._angle_varience = pi / self._layers
-        self._last_point = [0, self._max_radius]
-        self._last_angle = 0
 
         logger.info("Vase height: %s" % self._height)
         logger.info("Vase radius: %s" % self._max_radius)
         logger.info("Vase layer height: %s" % self._layer_height)
         logger.info("Vase speed: %s" % self._speed)
 
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return self.next()
-
-    def _points(self, start_angle):
-        points = []
-        for step in range(0, self._steps + 1):
-            angle = start_angle + (step * self._rad_per_step)
-            x = sin(angle) * self._max_radius
-            y = cos(angle) * self._max_radius
-            points.append([x, y])
-        return points
-
-    def next(self):
-        if self._current_height >= self._height:
-            raise StopIteration
-        points = self._points(self._last_angle)
-        commands = [LateralDraw(points[index - 1], points[index], self._speed) for index in range(1, len(points))]
-        layer = Layer(self._current_height, commands=commands)
-        self._current_height = self._current_height + self._layer_height
-        self._last_angle = self._last_angle + self._angle_varience
-        return layer
+    def _segments(self, heights):
+        start_angles = np.add.accumulate(np.concatenate(([0.0], np.repeat(self._angle_varience, max(len(heights) - 1, 0)))))[:len(heights)]
+        points = self._arcs(np.repeat(self._max_radius, len(heights)), start_angles, self._steps + 1, self._rad_per_step)
+        return self._polylines(points)
 
 
-class ConcentricCircleTestGenerator(LayerGenerator):
+class ConcentricCircleTestGenerator(CompiledTestGenerator):
     name = "Concentric Circles"
 
     def __init__(self, height, width, layer_height, speed=100):
-        self._height = float(height)
-        self._max_radius = float(width) / 2.0
-        self._layer_height = float(layer_height)
-        self._speed = speed
-        self._current_height = 0.0
+        super(ConcentricCircleTestGenerator, self).__init__(height, width, layer_height, speed)
         self._steps = 90
         self._rad_per_step = 2 * pi / float(self._steps)
-        self._layers = self._height / self._layer_height
-        self._angle_varience = pi / self._layers
-        self._last_point = [0, self._max_radius]
-        self._last_angle = 0
         self._rings = 3
 
         logger.info("Circles height: %s" % self._height)
@@ -242,52 +178,27 @@ class ConcentricCircleTestGenerator(LayerGenerator):
         logger.info("Circles layer height: %s" % self._layer_height)
         logger.info("Circles speed: %s" % self._speed)
 
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return self.next()
-
-    def _points(self, start_angle, radius):
-        points = []
-        for step in range(0, self._steps + 10):
-            angle = start_angle + (step * self._rad_per_step)
-            x = sin(angle) * radius
-            y = cos(angle) * radius
-            points.append([x, y])
-        return points
-
-    def next(self):
-        if self._current_height >= self._height:
-            raise StopIteration
-        commands = []
-        for i in range(1, self._rings + 1):
-            radius = self._max_radius / self._rings * i
-            points = self._points(0, radius)
-            commands += [LateralMove(points[0], points[0], self._speed)]
-            commands += [LateralDraw(points[index - 1], points[index], self._speed) for index in range(1, len(points))]
-
-        layer = Layer(self._current_height, commands=commands)
-        self._current_height = self._current_height + self._layer_height
-        self._last_angle = self._last_angle + self._angle_varience
-        return layer
+    def _segments(self, heights):
+        '''Every layer is the same rings, each a move to its first point then draws around it'''
+        radii = [self._max_radius / self._rings * ring for ring in range(1, self._rings + 1)]
+        rings = self._arcs(radii, np.zeros(self._rings), self._steps + 10, self._rad_per_step)
+        starts = np.concatenate((rings[:, :1], rings[:, :-1]), axis=1).reshape(1, -1, 2)
+        ends = rings.reshape(1, -1, 2)
+        draw = np.tile(np.arange(rings.shape[1]) > 0, self._rings)
+        return (starts, ends, draw)
 
 
-class LollipopTestGenerator(LayerGenerator):
+class LollipopTestGenerator(CompiledTestGenerator):
     name = "Lollipop"
 
     def __init__(self, height, width, layer_height, speed=100):
-        self._height = height
-        self._current_height = 0
-        self._layer_height = layer_height
-        self._speed = speed
-        self._base_height = float(height) / 3.0
-        self._stick_radius = float(width) / 10.0
-        remaining_height = height - self._base_height
-        self._pop_radius = min(remaining_height / 2.0, float(width) / 2.0)
-        self._pop_center_height = height - self._pop_radius
-        self._stick_complexity = 100
-        self._pop_complexity = 100
+        super(LollipopTestGenerator, self).__init__(height, width, layer_height, speed)
+        self._base_height = self._height / 3.0
+        self._stick_radius = self._width / 10.0
+        remaining_height = self._height - self._base_height
+        self._pop_radius = min(remaining_height / 2.0, self._width / 2.0)
+        self._pop_center_height = self._height - self._pop_radius
+        self._complexity = 100
 
         logger.info("Pop height: %s" % self._height)
         logger.info("Stick radius: %s" % str(width / 10.0))
@@ -295,44 +206,13 @@ class LollipopTestGenerator(LayerGenerator):
         logger.info("Pop layer height: %s" % self._layer_height)
         logger.info("Pop speed: %s" % self._speed)
 
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        return self.next()
-
-    def _get_stick(self):
-        points = []
-        rad_per_step = (2 * pi) / self._stick_complexity
-        for step in range(0, self._stick_complexity + 1):
-            angle = step * rad_per_step
-            x = sin(angle) * self._stick_radius
-            y = cos(angle) * self._stick_radius
-            points.append([x, y])
-        return points
-
-    def _layer_from_points(self, points):
-        commands = [LateralDraw(points[index - 1], points[index], self._speed) for index in range(1, len(points))]
-        return Layer(self._current_height, commands=commands)
-
-    def _get_pop(self, current_height):
-        rad_per_step = (2 * pi) / self._pop_complexity
-        distance_to_centre = abs(self._pop_center_height - current_height)
-        radius = sqrt((self._pop_radius * self._pop_radius) - (distance_to_centre * distance_to_centre))
-        points = []
-        for step in range(0, self._pop_complexity + 1):
-            angle = step * rad_per_step
-            x = sin(angle) * radius
-            y = cos(angle) * radius
-            points.append([x, y])
-        return points
+    def _radii(self, heights):
+        '''Stick radius up to the base height then the radius of the pop's slice at each height'''
+        distance_to_centre = np.abs(self._pop_center_height - heights)
+        pop_radii = np.sqrt(np.maximum((self._pop_radius * self._pop_radius) - (distance_to_centre * distance_to_centre), 0.0))
+        return np.where(heights <= self._base_height, self._stick_radius, pop_radii)
 
-    def next(self):
-        if self._current_height >= self._height:
-            raise StopIteration
-        if self._current_height <= self._base_height:
-            layer = self._layer_from_points(self._get_stick())
-        else:
-            layer = self._layer_from_points(self._get_pop(self._current_height))
-        self._current_height += self._layer_height
-        return layer
+    def _segments(self, heights):
+        rad_per_step = (2 * pi) / self._complexity
+        points = self._arcs(self._radii(heights), np.zeros(len(heights)), self._complexity + 1, rad_per_step)
+        return self._polylines(points)
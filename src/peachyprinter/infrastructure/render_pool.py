@@ -0,0 +1,168 @@
+import ctypes
+import logging
+import multiprocessing
+import time
+from collections import deque
+from threading import Lock
+from multiprocessing.sharedctypes import RawArray
+logger = logging.getLogger('peachy')
+
+_planner = None
+_slots = None
+
+
+def _initialize(planner, slots):
+    '''Runs in each worker process as it starts. Logging is turned off as the process is forked from one that may have
+    other threads, a logging lock held by one of them at the fork would never be released in the worker'''
+    global _planner, _slots
+    logging.disable(logging.CRITICAL)
+    _planner = planner
+    _slots = slots
+
+
+def _render(slot, records, z, key):
+    '''Runs in a worker process. Renders records into the shared memory slot and returns the plan without its points,
+    or None if the layer has nothing to draw or its frames do not fit the slot'''
+    plan = _planner.render(records, z, key)
+    if not plan or not plan['frames']:
+        return None
+    frames = plan.pop('frames')
+    del plan['points'], plan['laser_on']
+    offsets = [0]
+    for frame in frames:
+        offsets.append(offsets[-1] + len(frame))
+    if offsets[-1] > len(_slots[slot]):
+        return None
+    ctypes.memmove(_slots[slot], ''.join(frames), offsets[-1])
+    plan['offsets'] = offsets
+    return plan
+
+
+class LayerRenderPool(object):
+    '''Renders layers in worker processes ahead of them being printed.
+    Each layer is planned, transformed and encoded to Move frames by planner, a LayerWriter that sends nothing, for the state
+    the printing writer is predicted to be in when the layer starts. Frames are written into one of a set of shared memory
+    slots so only a small plan summary comes back through the pool. take hands the plan back only if the prediction came
+    true and the worker has finished, otherwise the writer renders the layer itself, so a wrong guess or a slow worker
+    costs time but never changes what is printed. Workers still rendering a dropped layer after STUCK_SECONDS are replaced'''
+
+    SLOT_BYTES = 8 * 1024 * 1024
+    RESULT_WAIT_SECONDS = 0.005
+    STUCK_SECONDS = 30.0
+
+    def __init__(self, planner, processes, slots):
+        self._planner = planner
+        self._processes = processes
+        self._slots = slots
+        self._pool = self._start_workers()
+        self._free = range(len(slots))
+        self._pending = deque()
+        self._retired = []
+        self._start_laser = None
+        self._lock = Lock()
+        self.rendered = 0
+        self.missed = 0
+
+    @classmethod
+    def start(cls, planner, processes=None, depth=4, slot_bytes=SLOT_BYTES):
+        '''Returns a pool of processes workers, by default one per spare cpu, holding up to depth rendered layers.
+        Returns None if there are no spare cpus or the workers cannot be started'''
+        if processes is None:
+            processes = multiprocessing.cpu_count() - 1
+        if processes < 1:
+            logger.info("No spare cpus, not rendering in other processes")
+            return None
+        try:
+            render_pool = cls(planner, processes, [RawArray(ctypes.c_char, slot_bytes) for slot in range(depth + 2)])
+        except Exception as ex:
+            logger.warning("Could not start render processes: %s" % ex)
+            return None
+        logger.info("Rendering layers in %s processes" % processes)
+        return render_pool
+
+    def submit(self, layer, key):
+        '''Starts rendering layer from the state in key and returns the key the layer is predicted to leave.
+        The laser state seen at the start of the last layer taken is assumed, as waiting for drips turns the laser off'''
+        records = layer.records
+        with self._lock:
+            self._reclaim()
+            if self._start_laser is not None:
+                key = (key[0], self._start_laser) + tuple(key[2:])
+            if self._free:
+                slot = self._free.pop()
+                result = self._pool.apply_async(_render, (slot, records, layer.z, key))
+                self._pending.append((layer, key, result, slot))
+            return self._planner.end_key(records, layer.z, key)
+
+    def take(self, layer, key):
+        '''Returns the rendered plan for layer if it was rendered from the state in key, otherwise None.
+        Layers submitted before layer are dropped'''
+        with self._lock:
+            self._start_laser = key[1]
+            layers = [entry[0] for entry in self._pending]
+            if not any(pending is layer for pending in layers):
+                return None
+            while self._pending[0][0] is not layer:
+                self._retire(self._pending.popleft())
+            (layer, predicted, result, slot) = self._pending.popleft()
+        plan = None
+        if predicted == key:
+            result.wait(self.RESULT_WAIT_SECONDS)
+            if result.ready():
+                try:
+                    plan = result.get()
+                except Exception as ex:
+                    logger.warning("Rendering layer at %s failed: %s" % (layer.z, ex))
+        with self._lock:
+            if plan:
+                address = ctypes.addressof(self._slots[slot])
+                offsets = plan.pop('offsets')
+                plan['frames'] = [ctypes.string_at(address + start, end - start) for (start, end) in zip(offsets, offsets[1:])]
+                self.rendered += 1
+            else:
+                self.missed += 1
+            self._retire((layer, predicted, result, slot))
+        return plan
+
+    def discard(self):
+        '''Drops every layer submitted and not yet taken'''
+        with self._lock:
+            while self._pending:
+                self._retire(self._pending.popleft())
+
+    def close(self):
+        self.discard()
+        self._pool.terminate()
+        self._pool.join()
+
+    def _start_workers(self):
+        return multiprocessing.Pool(self._processes, _initialize, (self._planner, self._slots))
+
+    def _retire(self, entry):
+        (layer, key, result, slot) = entry
+        self._retired.append((result, slot, time.time()))
+        self._reclaim()
+
+    def _reclaim(self):
+        '''Frees the slots of dropped layers once their workers are done with them'''
+        busy = []
+        stuck_before = time.time() - self.STUCK_SECONDS
+        for (result, slot, retired) in self._retired:
+            if result.ready():
+                self._free.append(slot)
+            elif retired < stuck_before:
+                self._recycle()
+                return
+            else:
+                busy.append((result, slot, retired))
+        self._retired = busy
+
+    def _recycle(self):
+        '''Replaces the workers, dropping every layer submitted as its slot may still be written by the old workers'''
+        logger.warning("Rendering a layer took more than %s seconds, restarting render processes" % self.STUCK_SECONDS)
+        self._pool.terminate()
+        self._pool.join()
+        self._pending.clear()
+        self._retired = []
+        self._free = range(len(self._slots))
+        self._pool = self._start_workers()
@@ -0,0 +1,89 @@
+import time
+import heapq
+import itertools
+import logging
+from threading import Condition, Thread, Lock
+logger = logging.getLogger('peachy')
+
+
+class Scheduler(object):
+    '''Runs callbacks at given times on one daemon thread.
+    The thread sleeps on a condition until the earliest callback is due, so any number of timers cost one thread.
+    Callbacks run on that thread one after another and should return quickly'''
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._condition = Condition()
+        self._queue = []
+        self._cancelled = set()
+        self._ids = itertools.count()
+        self._thread = None
+        self._running = True
+
+    def schedule(self, at, callback, *args):
+        '''Calls callback(*args) at time at, returns a handle for cancel'''
+        with self._condition:
+            if not self._running:
+                raise Exception('Scheduler has been shutdown')
+            handle = next(self._ids)
+            heapq.heappush(self._queue, (at, handle, callback, args))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='Scheduler')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+            return handle
+
+    def cancel(self, handle):
+        with self._condition:
+            if any(entry[1] == handle for entry in self._queue):
+                self._cancelled.add(handle)
+
+    def pending(self):
+        with self._condition:
+            return len(self._queue) - len(self._cancelled)
+
+    def shutdown(self):
+        with self._condition:
+            self._running = False
+            self._queue = []
+            self._cancelled.clear()
+            self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while self._running:
+                while self._queue and self._queue[0][1] in self._cancelled:
+                    self._cancelled.discard(heapq.heappop(self._queue)[1])
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+                delay = self._queue[0][0] - self._clock()
+                if delay <= 0:
+                    return heapq.heappop(self._queue)
+                self._condition.wait(delay)
+            return None
+
+    def _run(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            (at, handle, callback, args) = entry
+            try:
+                callback(*args)
+            except Exception as ex:
+                logger.error('Scheduled callback failed: %s' % ex)
+
+
+_shared = None
+_shared_lock = Lock()
+
+
+def shared_scheduler():
+    '''Returns the process wide scheduler, emulated printers share it so a simulation farm runs on one thread'''
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Scheduler()
+        return _shared
@@ -1,44 +1,57 @@
-import threading
 import time
 import math
+from threading import Lock
+import numpy as np
 from peachyprinter.domain.zaxis import ZAxis
+from peachyprinter.infrastructure.scheduler import shared_scheduler
 import logging
 logger = logging.getLogger('peachy')
 
 
-class TimedDripZAxis(ZAxis, threading.Thread):
+class TimedDripZAxis(ZAxis):
+    '''Emulated dripper that drips at drips_per_second.
+    Drips and height are worked out from the time since the rate last changed rather than counted by a polling thread.
+    The call back is run on a Scheduler, by default the one shared by all emulated drippers, when each drip lands
+    but no more than calls_back_per_second times a second. Drip history is built from the rate changes when asked for'''
+
+    HISTORY_LENGTH = 500
+
     def __init__(self,
                  drips_per_mm,
                  starting_height,
                  call_back=None,
                  calls_back_per_second=15,
-                 drips_per_second=1.0
+                 drips_per_second=1.0,
+                 scheduler=None
                  ):
         ZAxis.__init__(self, starting_height)
-        threading.Thread.__init__(self)
-
         self._drips_per_mm = drips_per_mm
         self._drips_per_second = drips_per_second
-        self.shutdown = False
-        self.running = False
-        self.start_time = 0
+        self._scheduler = scheduler if scheduler else shared_scheduler()
         self._call_back = call_back
         self._time_to_wait = 1.0 / (calls_back_per_second * 1.0)
+        self._lock = Lock()
         self._last_drip = 0.0
-        self._height_history = self._starting_height
-        self._drip_history = [time.time()]
-        self._drip_history_length = 500
+        self._segments = []
+        self._pending = None
+        self.shutdown = False
+        self.running = False
+        self.start_time = 0
 
     def set_call_back(self, call_back):
         self._call_back = call_back
+        self._reschedule(time.time())
 
     def set_drips_per_second(self, dps):
-        current_time = time.time() - self.start_time
-        drips = current_time * self._drips_per_second
-        self._last_drip = self._last_drip + drips
-        self._height_history = self._height_history + (drips / self._drips_per_mm)
-        self.start_time = time.time()
-        self._drips_per_second = dps
+        with self._lock:
+            now = time.time()
+            if self.running:
+                self._last_drip = self._drips_at(now)
+                self.start_time = now
+                self._segments.append((now, self._last_drip, dps))
+                self._prune()
+            self._drips_per_second = dps
+        self._reschedule(now)
 
     def get_drips_per_second(self):
         return self._drips_per_second
@@ -47,49 +60,87 @@ class TimedDripZAxis(ZAxis, threading.Thread):
         self._drips_per_mm = drips_per_mm
 
     def current_z_location_mm(self):
-        if self.running:
-            current_time = time.time() - self.start_time
-            height = (current_time * self._drips_per_second) / self._drips_per_mm
-            return self._height_history + height
-        else:
-            return self._height_history
-
-    def update_data(self):
-        if len(self._drip_history) > self._drip_history_length:
-            self._drip_history = self._drip_history[-self._drip_history_length:]
-        if self._call_back:
-            tme = time.time()
-            current_time = tme - self.start_time
-            drips = current_time * self._drips_per_second
-            height = drips / self._drips_per_mm
-            new_drips = int(math.floor((tme - self._drip_history[-1]) * self._drips_per_second))
-            for i in range(0, new_drips):
-                self._drip_history.append(tme)
-            self._call_back(math.ceil(self._last_drip + drips), self._height_history + height, self._drips_per_second, self._drip_history)
+        return self._starting_height + self._drips_at(time.time()) / self._drips_per_mm
+
+    def seconds_until(self, height_mm):
+        if not self.running or not self._drips_per_second:
+            return None
+        return max(0.0, (height_mm - self.current_z_location_mm()) * self._drips_per_mm / self._drips_per_second)
+
+    @property
+    def drip_history(self):
+        '''Returns the times of the last HISTORY_LENGTH drips oldest first'''
+        with self._lock:
+            drips = int(math.floor(self._drips_at(time.time())))
+            if not drips:
+                return np.empty(0)
+            segments = np.array(self._segments, dtype=float)
+        numbers = np.arange(max(1, drips - self.HISTORY_LENGTH + 1), drips + 1)
+        index = np.searchsorted(segments[:, 1], numbers, side='left') - 1
+        (starts, start_drips, rates) = segments[index].T
+        return starts + (numbers - start_drips) / rates
 
     def start(self):
-        threading.Thread.start(self)
-        while self.start_time == 0:
-            time.sleep(0.1)
-
-    def run(self):
-        self.running = True
-        self.start_time = time.time()
-        while self.running:
-            start = time.time()
-            self.update_data()
-            delta = time.time() - start
-            time.sleep(max(0, self._time_to_wait - delta))
-        self.shutdown = True
+        with self._lock:
+            now = time.time()
+            self.start_time = now
+            self._segments = [(now, self._last_drip, self._drips_per_second)]
+            self.running = True
+            self.shutdown = False
+        self._reschedule(now, immediately=True)
+
+    def is_alive(self):
+        return self.running
 
     def move_to(self, height_mm):
         logger.info('Ignoring move to %s' % height_mm)
 
     def close(self):
+        with self._lock:
+            if self.running:
+                self._last_drip = self._drips_at(time.time())
+                self.running = False
+            self.shutdown = True
+        self._reschedule(time.time())
+
+    def _drips_at(self, at):
         if self.running:
-            self.running = False
-            while not self.shutdown:
-                time.sleep(0.1)
+            return self._last_drip + (at - self.start_time) * self._drips_per_second
+        return self._last_drip
+
+    def _prune(self):
+        oldest = self._last_drip - self.HISTORY_LENGTH
+        while len(self._segments) > 1 and self._segments[1][1] <= oldest:
+            self._segments.pop(0)
+
+    def _reschedule(self, now, immediately=False):
+        with self._lock:
+            if self._pending is not None:
+                self._scheduler.cancel(self._pending)
+                self._pending = None
+            if not self.running or not self._call_back:
+                return
+            if immediately:
+                at = now
+            elif self._drips_per_second:
+                next_drip = math.floor(self._drips_at(now)) + 1
+                at = self.start_time + (next_drip - self._last_drip) / self._drips_per_second + 1e-6
+                at = max(at, now + self._time_to_wait)
+            else:
+                return
+            self._pending = self._scheduler.schedule(at, self._notify)
+
+    def _notify(self):
+        with self._lock:
+            if not self.running:
+                return
+            now = time.time()
+            drips = self._drips_at(now)
+            drips_per_second = self._drips_per_second
+        call_back = self._call_back
+        if call_back:
+            call_back(int(math.floor(drips)), self._starting_height + drips / self._drips_per_mm, drips_per_second, self.drip_history)
+        self._reschedule(now)
 
 
 class PhotoZAxis(ZAxis):
@@ -120,6 +171,13 @@ class PhotoZAxis(ZAxis):
     def set_call_back(self, call_back):
         self._call_back = call_back
 
+    def seconds_until(self, height_mm):
+        if self._current_height >= height_mm:
+            return 0.0
+        if self._next_height is not None and self._next_height >= height_mm:
+            return max(0.0, self._time_of_change - time.time())
+        return None
+
     def callback(self):
         if self._call_back:
             self._call_back(0, self._current_height, 0)
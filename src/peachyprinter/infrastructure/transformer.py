@@ -3,6 +3,7 @@ import logging
 logger = logging.getLogger('peachy')
 from peachyprinter.domain.transformer import Transformer
 import threading
+from collections import OrderedDict
 
 
 class OneToOneTransformer(Transformer):
@@ -45,10 +46,20 @@ class TuningTransformer(Transformer):
 
 
 class HomogenousTransformer(Transformer):
-    def __init__(self, scale, upper_height, lower_points, upper_points):
+    '''Maps real world x, y at height z to deflections between 0 and 1.
+    The transform for each height is interpolated between the lower and upper calibrations. The cache_size most
+    recently used heights are kept, keyed on height rounded to HEIGHT_PRECISION decimal places'''
+
+    HEIGHT_PRECISION = 6
+
+    def __init__(self, scale, upper_height, lower_points, upper_points, cache_size=64):
         self._lock = threading.Lock()
         self._scale = scale
         self._upper_height = upper_height
+        self._cache_size = max(1, cache_size)
+        self._cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
         lower_points = self._sort_points(lower_points)
         upper_points = self._sort_points(upper_points)
@@ -62,7 +73,7 @@ class HomogenousTransformer(Transformer):
         self._upper_points = [(self._scale_point(deflection, deflection_scale), distance) for (deflection, distance) in lower_points]
 
         self._get_transforms()
-        self._cache = {}
+        self.points_out_of_bounds = 0
 
     def _scale_point(self, point, scale):
         x, y = point
@@ -89,6 +100,7 @@ class HomogenousTransformer(Transformer):
         try:
             self._lower_transform = self._get_transformation_matrix(self._lower_points)
             self._upper_transform = self._get_transformation_matrix(self._upper_points)
+            self._cache.clear()
         finally:
             self._lock.release()
 
@@ -126,12 +138,31 @@ class HomogenousTransformer(Transformer):
             return self._lower_transform
         elif height == self._upper_height:
             return self._upper_transform
-        elif height in self._cache.keys():
-            return self._cache[height]
+        key = round(height, self.HEIGHT_PRECISION)
+        current = self._cache.pop(key, None)
+        if current is None:
+            self.cache_misses += 1
+            current = self._positional_transform(key)
+            if len(self._cache) >= self._cache_size:
+                self._cache.popitem(last=False)
         else:
-            current = self._positional_transform(height)
-            self._cache = {height: current}
-            return current
+            self.cache_hits += 1
+        self._cache[key] = current
+        return current
+
+    def prewarm(self, heights):
+        '''Computes the transforms for heights ahead of printing, for example every layer height of a job.
+        Only the last cache_size heights will be kept'''
+        self._lock.acquire()
+        try:
+            for height in heights:
+                self._transforms_for_height(height)
+        finally:
+            self._lock.release()
+
+    def cache_info(self):
+        '''Returns hits, misses, size and max_size of the height cache'''
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self._cache), 'max_size': self._cache_size}
 
     def _positional_transform(self, height):
         adjusted_height = height / self._upper_height
@@ -154,6 +185,121 @@ class HomogenousTransformer(Transformer):
             adjusted_y = min(1.0, max(0.0, y1))
             return(adjusted_x, adjusted_y)
 
+    def transform_many(self, xyz):
+        '''Transforms an Nx3 array of points returning an Nx2 array.
+        Points outside the printer are clamped and counted in points_out_of_bounds with a single warning per call'''
+        xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        self._lock.acquire()
+        try:
+            heights, height_index = np.unique(xyz[:, 2], return_inverse=True)
+            transforms = np.array([self._transforms_for_height(height) for height in heights.tolist()]).reshape(-1, 3, 3)
+        finally:
+            self._lock.release()
+        realworld = np.column_stack((xyz[:, :2], np.ones(len(xyz))))
+        computerland = np.einsum('nij,nj->ni', transforms[height_index], realworld)
+        points = computerland[:, :2] / computerland[:, 2:]
+        out_of_bounds = np.count_nonzero(((points < 0.0) | (points > 1.0)).any(axis=1))
+        if out_of_bounds:
+            self.points_out_of_bounds += out_of_bounds
+            logger.warning("Bounds of printer exceeded by %s of %s points" % (out_of_bounds, len(points)))
+            np.clip(points, 0.0, 1.0, out=points)
+        return points
+
     def set_scale(self, new_scale):
         self._scale = new_scale
         self._get_transforms()
+
+
+class GridTransformer(Transformer):
+    '''Bakes another transformer into a lookup grid of deflections.
+    The grid covers x_range and y_range, given as (minimum, maximum), with steps points along each. When z_range spans
+    heights z_steps slices are baked and interpolated trilinearly, otherwise z is ignored and lookups are bilinear.
+    Points outside the grid are clamped to its edge and counted in points_out_of_bounds.
+    max_error and mean_error hold the distance between the grid and the exact transform measured at every cell centre.
+    Given a tolerance the grid is refined, up to max_steps, until max_error is within it'''
+
+    def __init__(self, transformer, x_range, y_range, z_range=(0.0, 0.0), steps=65, z_steps=2, tolerance=None, max_steps=1025):
+        if steps < 2 or z_steps < 2:
+            logger.error('Grid requires at least 2 steps was %s, %s' % (steps, z_steps))
+            raise Exception('Grid requires at least 2 steps was %s, %s' % (steps, z_steps))
+        self._transformer = transformer
+        self._lower = np.array([x_range[0], y_range[0], z_range[0]], dtype=float)
+        self._upper = np.array([x_range[1], y_range[1], z_range[1]], dtype=float)
+        self._z_steps = z_steps if z_range[0] != z_range[1] else 1
+        self.points_out_of_bounds = 0
+
+        self._bake(steps)
+        while tolerance is not None and self.max_error > tolerance and self._steps < max_steps:
+            self._bake(min(self._steps * 2 - 1, max_steps))
+        logger.info('Grid of %sx%sx%s has max error %s, mean error %s' % (self._steps, self._steps, self._z_steps, self.max_error, self.mean_error))
+
+    def transform(self, xyz):
+        return self.transform_many([xyz])[0].tolist()
+
+    def transform_many(self, xyz):
+        '''Transforms an Nx3 array of points returning an Nx2 array'''
+        xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        out_of_bounds = np.count_nonzero(((xyz[:, :2] < self._lower[:2]) | (xyz[:, :2] > self._upper[:2])).any(axis=1))
+        if out_of_bounds:
+            self.points_out_of_bounds += out_of_bounds
+            logger.warning("Bounds of grid exceeded by %s of %s points" % (out_of_bounds, len(xyz)))
+        return self._interpolate(xyz)
+
+    def _bake(self, steps):
+        self._steps = steps
+        self._shape = np.array([steps, steps, self._z_steps])
+        self._spacing = (self._upper - self._lower) / np.maximum(self._shape - 1, 1)
+        self._inverse_spacing = 1.0 / np.where(self._spacing > 0, self._spacing, 1.0)
+        self._last_cell = np.maximum(self._shape - 2, 0)
+        self._strides = np.array([1, steps, steps * steps])
+        self._flat_grid = self._exact(self._points(*self._axes(self._lower, self._shape)))
+
+        centres = self._points(*self._axes(self._lower + self._spacing / 2.0, np.maximum(self._shape - 1, 1)))
+        errors = np.sqrt(((self._interpolate(centres) - self._exact(centres)) ** 2).sum(axis=1))
+        self.max_error = float(errors.max())
+        self.mean_error = float(errors.mean())
+
+    def _axes(self, start, counts):
+        return [start[axis] + np.arange(counts[axis]) * self._spacing[axis] for axis in range(3)]
+
+    def _points(self, xs, ys, zs):
+        return np.array(np.meshgrid(zs, ys, xs, indexing='ij')).reshape(3, -1).T[:, ::-1]
+
+    def _exact(self, points):
+        out_of_bounds = getattr(self._transformer, 'points_out_of_bounds', None)
+        if getattr(self._transformer, 'transform_many', None):
+            deflections = self._transformer.transform_many(points)
+        else:
+            deflections = [self._transformer.transform(point)[:2] for point in points.tolist()]
+        if out_of_bounds is not None:
+            self._transformer.points_out_of_bounds = out_of_bounds
+        return np.asarray(deflections, dtype=float)[:, :2]
+
+    def _interpolate(self, xyz):
+        position = (xyz - self._lower) * self._inverse_spacing
+        np.clip(position, 0, self._shape - 1, out=position)
+        index = np.minimum(position.astype(np.intp), self._last_cell)
+        position -= index
+        base = np.dot(index, self._strides)
+        result = None
+        for (z_offset, weight_z) in self._sides(position[:, 2], self._strides[2], self._shape[2] > 1):
+            plane = None
+            for (y_offset, weight_y) in self._sides(position[:, 1], self._strides[1], True):
+                row = self._lerp(base + (z_offset + y_offset), position[:, :1])
+                plane = row * weight_y if plane is None else plane + row * weight_y
+            result = plane * weight_z if result is None else result + plane * weight_z
+        return result
+
+    def _sides(self, fraction, stride, interpolate):
+        if not interpolate:
+            return [(0, 1.0)]
+        fraction = fraction[:, np.newaxis]
+        return [(0, 1.0 - fraction), (stride, fraction)]
+
+    def _lerp(self, index, fraction):
+        lower = np.take(self._flat_grid, index, axis=0)
+        upper = np.take(self._flat_grid, index + 1, axis=0)
+        upper -= lower
+        upper *= fraction
+        upper += lower
+        return upper
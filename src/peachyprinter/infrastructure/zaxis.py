@@ -4,6 +4,7 @@ logger = logging.getLogger('peachy')
 from math import ceil
 from peachyprinter.domain.zaxis import ZAxis
 from peachyprinter.infrastructure.messages import DripRecordedMessage, SetDripCountMessage, MoveToDripCountMessage
+from peachyprinter.infrastructure.drip_history import DripHistory
 
 
 class SerialDripZAxis(ZAxis):
@@ -13,36 +14,42 @@ class SerialDripZAxis(ZAxis):
         self._drips_per_mm = drips_per_mm
         self._drips = 0
         self._drip_call_back = drip_call_back
-        self.reset()
-        self._communicator.register_handler(DripRecordedMessage, self.drip_reported_handler)
-        self._drip_history = []
         self._drips_in_average = 10
         self._drip_history_length = 500
+        self._drip_history = DripHistory(self._drip_history_length)
+        self.reset()
+        self._communicator.register_handler(DripRecordedMessage, self.drip_reported_handler)
 
     def drip_reported_handler(self, drip_reported):
         drips_added = drip_reported.drips - self._drips
         self._drips = drip_reported.drips
-        self._append_drip(drips_added)
+        self._drip_history.append(time.time(), drips_added)
         if self._drip_call_back:
             self._drip_call_back(self._drips, self.current_z_location_mm(), self.average_drips, self.drip_history)
 
-    def _append_drip(self, drips_count):
-        for i in range(0, drips_count):
-            self._drip_history.append(time.time())
-        if len(self._drip_history) > self._drip_history_length:
-            self._drip_history = self._drip_history[-self._drip_history_length:]
-
     @property
     def average_drips(self):
-        if len(self._drip_history) >= self._drips_in_average:
-            seconds = (self._drip_history[-1] - self._drip_history[-10])
-            if seconds > 0:
-                return 10.0 / seconds
-        return 0.0
+        return self._drip_history.average(self._drips_in_average)
+
+    def drips_per_second(self, seconds):
+        '''Returns the drip rate over the last seconds seconds'''
+        return self._drip_history.drips_per_second(seconds)
+
+    def seconds_until(self, height_mm):
+        '''Predicts when height_mm will be reached from the time of the last drip and the recent drip rate'''
+        drips_needed = (height_mm - self.current_z_location_mm()) * self._drips_per_mm
+        if drips_needed <= 0:
+            return 0.0
+        drips_per_second = self.average_drips
+        if not drips_per_second:
+            return None
+        history = self._drip_history.view()
+        return max(0.0, history[-1] + drips_needed / drips_per_second - time.time())
 
     @property
     def drip_history(self):
-        return list(self._drip_history)
+        '''Read only view of recent drip times, see DripHistory.view'''
+        return self._drip_history.view()
 
     def set_call_back(self, call_back):
         self._drip_call_back = call_back
@@ -52,7 +59,7 @@ class SerialDripZAxis(ZAxis):
         self._communicator.send(SetDripCountMessage(0))
         time.sleep(0.2)
         self._drips = 0
-        self._drip_history = []
+        self._drip_history.clear()
 
     def current_z_location_mm(self):
         return self._starting_height + (self._drips * 1.0 / self._drips_per_mm)
@@ -1,11 +1,18 @@
 import ctypes
-import pkg_resources
-from pkg_resources import DistributionNotFound
 import os
 import sys
 import logging
 
+LOOPBACK = 'loopback'
+LOOPBACK_LIBRARIES = ['libPeachyUSB']
+
+
 def load_library(name):
+    if os.environ.get('PEACHY_API_DLL_PATH') == LOOPBACK and name in LOOPBACK_LIBRARIES:
+        from peachyprinter.infrastructure.loopback_usb import LoopbackLibrary
+        logging.info("Loading loopback usb device via PEACHY_API_DLL_PATH")
+        return LoopbackLibrary.from_environment()
+
     suffix = ''
     python_64 = sys.maxsize > 2**32
     if sys.platform == 'linux2':
@@ -23,6 +30,7 @@ def load_library(name):
         logging.info("Loading usb dll via PEACHY_API_DLL_PATH")
     else:
         try:
+            import pkg_resources
             dist = pkg_resources.get_distribution('PeachyPrinterToolsAPI')
             if python_64:
                 dll_path = os.path.join(dist, 'peachyprinter', 'dependancies', dependency_platform, 'amd64')
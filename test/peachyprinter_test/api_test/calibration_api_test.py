@@ -518,6 +518,15 @@ class CalibrationAPITests(unittest.TestCase, test_helpers.TestHelpers):
 
         self.mock_UsbPacketCommunicator.return_value.register_handler.assert_called_with(PrinterStatusMessage, mock_call_back)
 
+    def test_get_link_metrics_returns_communicator_metrics(self, *args):
+        self.setup_mocks(args)
+        self.mock_configuration_manager.load.return_value = self.default_config
+        calibration_api = CalibrationAPI(self.mock_configuration_manager)
+        expected = {'packets_per_second': 1000.0}
+        self.mock_UsbPacketCommunicator.return_value.metrics.snapshot.return_value = expected
+
+        self.assertEquals(expected, calibration_api.get_link_metrics())
+
 
 
 if __name__ == '__main__':
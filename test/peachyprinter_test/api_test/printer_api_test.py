@@ -153,6 +153,8 @@ class PrintQueueAPITests(unittest.TestCase, test_helpers.TestHelpers):
             end = time.time()
             self.assertTrue(expected_delay <= end-start + 0.01, "%s was not <= %s" % (expected_delay, (end - start + 0.01)))
 
+@patch('peachyprinter.api.print_api.LayerIndex')
+@patch('peachyprinter.api.print_api.LayerCache')
 @patch('peachyprinter.api.print_api.SerialDripZAxis')
 @patch('peachyprinter.api.print_api.MicroDisseminator')
 @patch('peachyprinter.api.print_api.UsbPacketCommunicator')
@@ -178,6 +180,8 @@ class PrintQueueAPITests(unittest.TestCase, test_helpers.TestHelpers):
 class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
 
     def setup_mocks(self, args):
+        self.mock_LayerIndex =                    args[23]
+        self.mock_LayerCache =                    args[22]
         self.mock_SerialDripZAxis =               args[21]
         self.mock_MicroDisseminator =             args[20]
         self.mock_UsbPacketCommunicator =         args[19]
@@ -201,6 +205,8 @@ class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
         self.mock_LayerWriter =                   args[1]
         self.mock_LayerProcessing =               args[0]
 
+        self.mock_layer_index =                     self.mock_LayerIndex.return_value
+        self.mock_layer_cache =                     self.mock_LayerCache.return_value
         self.mock_serial_drip_zaxis =               self.mock_SerialDripZAxis.return_value
         self.mock_micro_disseminator =              self.mock_MicroDisseminator.return_value
         self.mock_usb_packet_communicator =             self.mock_UsbPacketCommunicator.return_value
@@ -250,14 +256,17 @@ class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
             self.mock_GCodeReader.assert_called_with(
                 mocked_open.return_value,
                 scale=config.options.scaling_factor,
-                start_height=0.0
+                start_height=0.0,
+                batch_size=PrintAPI.GCODE_BATCH_SIZE,
+                layer_cache=self.mock_layer_cache,
+                layer_index=self.mock_layer_index
                 )
 
         self.mock_LaserControl.assert_called_with(
             config.cure_rate.override_laser_power_amount
             )
 
-        self.mock_UsbPacketCommunicator.assert_called_with(config.circut.print_queue_length)
+        self.mock_UsbPacketCommunicator.assert_called_with(config.circut.print_queue_length, send_buffer_size=max(1, int(config.circut.data_rate * PrintAPI.SEND_BUFFER_SECONDS)), handler_queue_size=PrintAPI.HANDLER_QUEUE_SIZE)
         
         self.mock_usb_packet_communicator.start.assert_called_with()
 
@@ -335,7 +344,10 @@ class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
             self.mock_GCodeReader.assert_called_with(
                 mocked_open.return_value,
                 scale=config.options.scaling_factor,
-                start_height=expected_start_height
+                start_height=expected_start_height,
+                batch_size=PrintAPI.GCODE_BATCH_SIZE,
+                layer_cache=self.mock_layer_cache,
+                layer_index=self.mock_layer_index
                 )
 
         self.mock_SerialDripZAxis.assert_called_with(
@@ -469,6 +481,7 @@ class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
             self.mock_sub_layer_generator,
             self.mock_machine_status,
             abort_on_error=True,
+            prefetch_layers=PrintAPI.PREFETCH_LAYERS,
             )
 
     def test_print_gcode_should_print_overlap_layers_if_requested(self, *args):
@@ -489,6 +502,7 @@ class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
             self.mock_over_lap_generator,
             self.mock_machine_status,
             abort_on_error=True,
+            prefetch_layers=PrintAPI.PREFETCH_LAYERS,
             )
 
     def test_print_gcode_should_print_shuffle_layers_if_requested(self, *args):
@@ -509,6 +523,7 @@ class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
             self.mock_shuffle_generator,
             self.mock_machine_status,
             abort_on_error=True,
+            prefetch_layers=PrintAPI.PREFETCH_LAYERS,
             )
 
     def test_print_gcode_should_print_shuffle_overlap_and_sublayer_if_requested(self, *args):
@@ -534,6 +549,7 @@ class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
             self.mock_over_lap_generator,
             self.mock_machine_status,
             abort_on_error=True,
+            prefetch_layers=PrintAPI.PREFETCH_LAYERS,
             )
 
     def test_print_can_be_stopped_before_started(self, *args):
@@ -577,6 +593,17 @@ class PrintAPITests(unittest.TestCase, test_helpers.TestHelpers):
 
         self.mock_controller.get_status.assert_called_with()
 
+    def test_get_status_includes_link_metrics(self, *args):
+        self.setup_mocks(args)
+        self.mock_controller.get_status.return_value = {'status': 'Running'}
+        self.mock_usb_packet_communicator.metrics.snapshot.return_value = {'packets_per_second': 11000.0}
+        api = PrintAPI(self.default_config)
+        with patch('__builtin__.open', mock_open(read_data='bibble'), create=True):
+            api.print_gcode("Spam")
+            status = api.get_status()
+
+        self.assertEquals({'status': 'Running', 'link': {'packets_per_second': 11000.0}}, status)
+
     def test_print_gcode_should_use_emulated_dripper_if_specified_in_config(self, * args):
         self.setup_mocks(args)
         gcode_path = "FakeFile"
@@ -0,0 +1,67 @@
+import unittest
+import sys
+import os
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import test_helpers
+from peachyprinter.domain.commands import *
+
+
+class ArrayLayerTests(unittest.TestCase, test_helpers.TestHelpers):
+    def setUp(self):
+        self.commands = [
+            LateralDraw([0.0, 0.0], [1.0, 1.0], 100.0),
+            LateralMove([1.0, 1.0], [2.0, 1.0], 50.0),
+            LateralDraw([2.0, 1.0], [0.5, 0.5], 25.0),
+            ]
+
+    def test_records_round_trip_to_commands(self):
+        layer = ArrayLayer.from_commands(0.1, self.commands)
+
+        self.assertEquals(3, len(layer))
+        self.assertEquals([True, False, True], layer.records['draw'].tolist())
+        self.assertEquals([100.0, 50.0, 25.0], layer.records['speed'].tolist())
+        self.assertLayerEquals(Layer(0.1, self.commands), layer)
+
+    def test_empty_layer_has_no_commands(self):
+        layer = ArrayLayer(0.2)
+
+        self.assertEquals(0, len(layer))
+        self.assertEquals([], layer.commands)
+        self.assertEquals(COMMAND_DTYPE, layer.records.dtype)
+
+    def test_changes_to_commands_are_reflected_in_records(self):
+        layer = ArrayLayer.from_commands(0.1, self.commands)
+
+        layer.commands.append(LateralMove([0.5, 0.5], [3.0, 3.0], 10.0))
+
+        self.assertEquals(4, len(layer))
+        self.assertEquals([3.0, 3.0], layer.records['end'][-1].tolist())
+
+    def test_setting_records_replaces_commands(self):
+        layer = ArrayLayer.from_commands(0.1, self.commands)
+        layer.commands
+
+        layer.records = layer.records[:1]
+
+        self.assertCommandsEqual(self.commands[:1], layer.commands)
+
+    def test_records_from_commands_accepts_arrays_and_commands(self):
+        records = records_from_commands(self.commands[:1])
+
+        actual = records_from_commands([records, self.commands[1], self.commands[2], records])
+
+        self.assertCommandsEqual(self.commands + self.commands[:1], commands_from_records(actual))
+
+    def test_records_from_commands_with_no_commands_is_empty(self):
+        actual = records_from_commands([])
+
+        self.assertEquals(0, len(actual))
+        self.assertEquals(COMMAND_DTYPE, actual.dtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -48,5 +48,10 @@ class LaserControlTest(unittest.TestCase):
         with self.assertRaises(Exception):
             LaserControl(-0.001)
 
+    def test_laser_on_power_is_default_power_when_laser_off(self):
+        l = LaserControl(0.6)
+        l.set_laser_off()
+        self.assertEquals(0.6, l.laser_on_power())
+
 if __name__ == '__main__':
     unittest.main()
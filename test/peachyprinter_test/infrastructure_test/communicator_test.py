@@ -1,13 +1,17 @@
 import unittest
 import sys
 import os
-from mock import patch
+from mock import patch, call, MagicMock
 import logging
+import threading
+import time
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
 
-from peachyprinter.infrastructure.communicator import UsbPacketCommunicator
+from peachyprinter.infrastructure.communicator import UsbPacketCommunicator, MissingPrinterException, FrameSender, SendTimeoutException
+from peachyprinter.infrastructure.messages import MoveMessage, DripRecordedMessage
+from peachyprinter.infrastructure.peachyusb import PeachyUSB, PeachyUSBException
 
 
 #TODO this really needs to be actually tested
@@ -19,6 +23,413 @@ class UsbPacketCommunicatorTest(unittest.TestCase):
     def test_init_doesnt_raise_exception(self, mock_PeachyUSB):
         UsbPacketCommunicator(50)
 
+    def test_send_frames_writes_buffer_once(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+        frames = MoveMessage.frames([1, 2], [3, 4], [255, 0])
+
+        communicator.send_frames(frames)
+
+        mock_PeachyUSB.return_value.write_many.assert_called_once_with(frames)
+        self.assertFalse(mock_PeachyUSB.return_value.write.called)
+
+    def test_writes_are_recorded_in_metrics(self, mock_PeachyUSB):
+        mock_PeachyUSB.return_value.write_many.return_value = 2
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+        frames = MoveMessage.frames([1, 2], [3, 4], [255, 0])
+
+        communicator.send_frames(frames)
+        communicator.send(MoveMessage(1, 3, 255))
+
+        self.assertEquals(3, communicator.metrics.total_packets)
+        self.assertEquals(len(frames) + len(MoveMessage.frames([1], [3], [255])), communicator.metrics.total_bytes)
+
+    def test_detach_is_recorded_in_metrics(self, mock_PeachyUSB):
+        error = PeachyUSBException("Gone", -4)
+        mock_PeachyUSB.return_value.write.side_effect = error
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+
+        with self.assertRaises(MissingPrinterException):
+            communicator.send(MoveMessage(1, 3, 255))
+
+        self.assertEquals(1, communicator.metrics.total_detach_events)
+
+    def test_malformed_frames_are_logged_not_treated_as_detach(self, mock_PeachyUSB):
+        mock_PeachyUSB.return_value.write_many.side_effect = PeachyUSBException("Malformed packet at byte 0", PeachyUSB.MALFORMED_PACKET)
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+
+        communicator.send_frames(chr(200))
+
+        self.assertEquals(0, communicator.metrics.total_detach_events)
+        communicator.send(MoveMessage(1, 3, 255))
+
+    def test_send_many_frames_messages_into_one_bulk_write(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+
+        communicator.send_many([MoveMessage(1, 3, 255), MoveMessage(2, 4, 0)])
+
+        mock_PeachyUSB.return_value.write_many.assert_called_once_with(bytearray(MoveMessage.frames([1, 2], [3, 4], [255, 0])))
+
+    def test_send_many_writes_around_sleep_messages(self, mock_PeachyUSB):
+        mock_PeachyUSB.return_value.write_many.return_value = 1
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+        sleep_message = MagicMock()
+        sleep_message.TYPE_ID = 99
+
+        with patch('peachyprinter.infrastructure.communicator.time.sleep') as mock_sleep:
+            communicator.send_many([MoveMessage(1, 3, 255), sleep_message, MoveMessage(2, 4, 0)])
+
+        self.assertEquals(1, mock_sleep.call_count)
+        mock_PeachyUSB.return_value.write_many.assert_has_calls([
+            call(bytearray(MoveMessage.frames([1], [3], [255]))),
+            call(bytearray(MoveMessage.frames([2], [4], [0]))),
+            ])
+
+    def test_send_frames_raises_when_detached(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+        communicator._detached = True
+
+        with self.assertRaises(MissingPrinterException):
+            communicator.send_frames(MoveMessage.frames([1], [3], [255]))
+
+
+    def test_send_buffer_writes_on_sender_thread(self, mock_PeachyUSB):
+        mock_PeachyUSB.return_value.write_many.return_value = 1
+        communicator = UsbPacketCommunicator(50, send_buffer_size=4)
+        communicator.start()
+        frames = MoveMessage.frames([1, 2], [3, 4], [255, 0])
+
+        communicator.send(MoveMessage(1, 3, 255))
+        communicator.send_frames(frames)
+        self.assertTrue(communicator.flush(5.0))
+
+        mock_PeachyUSB.return_value.write_many.assert_has_calls([
+            call(MoveMessage.frames([1], [3], [255])),
+            call(frames),
+            ])
+        communicator.close()
+
+    def test_discard_drops_queued_frames_and_sends_final_frames(self, mock_PeachyUSB):
+        writing = threading.Event()
+        release = threading.Event()
+        def write_many(frames):
+            writing.set()
+            release.wait()
+            return 1
+        mock_PeachyUSB.return_value.write_many.side_effect = write_many
+        communicator = UsbPacketCommunicator(50, send_buffer_size=8)
+        communicator.start()
+        first = MoveMessage.frames([1, 2], [3, 4], [255, 255])
+        laser_off = MoveMessage.frames([2], [4], [0])
+        communicator.send_frames(first)
+        writing.wait(5.0)
+        communicator.send_frames(MoveMessage.frames([5, 6, 7], [8, 9, 10], [255, 255, 255]))
+
+        communicator.discard(laser_off)
+        release.set()
+
+        self.assertTrue(communicator.flush(5.0))
+        self.assertEquals([call(first), call(laser_off)], mock_PeachyUSB.return_value.write_many.call_args_list)
+        communicator.close()
+
+    def test_close_discards_queued_frames_and_writes_unsent_final_frames(self, mock_PeachyUSB):
+        writing = threading.Event()
+        release = threading.Event()
+        def write_many(frames):
+            writing.set()
+            release.wait()
+            return 1
+        mock_PeachyUSB.return_value.write_many.side_effect = write_many
+        communicator = UsbPacketCommunicator(50, send_buffer_size=8)
+        communicator.start()
+        first = MoveMessage.frames([1], [3], [255])
+        laser_off = MoveMessage.frames([1], [3], [0])
+        communicator.send_frames(first)
+        writing.wait(5.0)
+        communicator.send_frames(MoveMessage.frames([5], [8], [255]))
+        communicator.discard(laser_off)
+        closer = threading.Thread(target=communicator.close)
+        closer.start()
+
+        release.set()
+        closer.join(5.0)
+
+        self.assertFalse(closer.is_alive())
+        self.assertEquals([call(first), call(laser_off)], mock_PeachyUSB.return_value.write_many.call_args_list)
+
+    def test_send_buffer_is_sized_in_packets(self, mock_PeachyUSB):
+        mock_PeachyUSB.return_value.write_many.return_value = 1
+        communicator = UsbPacketCommunicator(50, send_buffer_size=4)
+        communicator.start()
+        communicator._sender.close()
+        communicator._sender = FrameSender(lambda frames: None, 4)
+
+        communicator.send_frames(MoveMessage.frames([1, 2, 3], [3, 4, 5], [255, 0, 255]))
+        communicator.send_many([MoveMessage(1, 3, 255)])
+
+        self.assertEquals(4, communicator._sender.depth())
+        communicator._sender.close()
+
+    def test_send_buffer_counts_packets_of_bytearrays_and_memoryviews(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50, send_buffer_size=8)
+        communicator.start()
+        communicator._sender.close()
+        communicator._sender = FrameSender(lambda frames: None, 8)
+        frames = MoveMessage.frames([1, 2, 3], [3, 4, 5], [255, 0, 255])
+
+        communicator.send_frames(bytearray(frames))
+        communicator.send_frames(memoryview(frames))
+
+        self.assertEquals(6, communicator._sender.depth())
+        communicator._sender.close()
+
+    def test_send_buffer_uses_packet_count_given(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50, send_buffer_size=8)
+        communicator.start()
+        communicator._sender.close()
+        communicator._sender = FrameSender(lambda frames: None, 8)
+
+        communicator.send_frames(MoveMessage.frames([1, 2, 3], [3, 4, 5], [255, 0, 255]), 3)
+        communicator.discard(MoveMessage.frames([3], [5], [0]), 1)
+
+        self.assertEquals(1, communicator._sender.depth())
+        communicator._sender.close()
+
+    def packet(self, message):
+        data = chr(message.TYPE_ID) + message.get_bytes()
+        return (data + 'padding', len(data))
+
+    def test_received_messages_go_to_handlers_for_their_type(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+        drips = []
+        moves = []
+        communicator.register_handler(DripRecordedMessage, drips.append)
+        communicator.register_handler(DripRecordedMessage, drips.append)
+        communicator.register_handler(MoveMessage, moves.append)
+
+        communicator._process(*self.packet(DripRecordedMessage(7)))
+
+        self.assertEquals([DripRecordedMessage(7), DripRecordedMessage(7)], drips)
+        self.assertEquals([], moves)
+
+    def test_received_messages_without_handlers_are_ignored(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50)
+        communicator.start()
+
+        communicator._process(*self.packet(DripRecordedMessage(7)))
+
+    def test_register_handler_requires_protobuffable_message(self, mock_PeachyUSB):
+        with self.assertRaises(Exception):
+            UsbPacketCommunicator(50).register_handler(object, MagicMock())
+
+    def test_handler_queue_runs_handlers_off_the_read_thread(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50, handler_queue_size=10)
+        communicator.start()
+        handled = threading.Event()
+        threads = []
+
+        def handler(message):
+            threads.append(threading.current_thread())
+            handled.set()
+        communicator.register_handler(DripRecordedMessage, handler)
+
+        communicator._process(*self.packet(DripRecordedMessage(7)))
+
+        self.assertTrue(handled.wait(5.0))
+        self.assertNotEquals(threading.current_thread(), threads[0])
+        communicator.close()
+
+    def test_handler_queue_keeps_order_and_survives_failing_handlers(self, mock_PeachyUSB):
+        communicator = UsbPacketCommunicator(50, handler_queue_size=2)
+        communicator.start()
+        drips = []
+        done = threading.Event()
+
+        def handler(message):
+            drips.append(message.drips)
+            if message.drips == 1:
+                raise Exception("Handler Broke")
+            if message.drips == 9:
+                done.set()
+        communicator.register_handler(DripRecordedMessage, handler)
+
+        for drip in range(10):
+            communicator._process(*self.packet(DripRecordedMessage(drip)))
+
+        self.assertTrue(done.wait(5.0))
+        self.assertEquals(range(10), drips)
+        communicator.close()
+
+
+class FrameSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        self.release = threading.Event()
+        self.release.set()
+        self.senders = []
+
+    def tearDown(self):
+        self.release.set()
+        for sender in self.senders:
+            sender.close()
+
+    def write(self, frames):
+        self.release.wait()
+        self.written.append(frames)
+
+    def get_sender(self, size, **kwargs):
+        sender = FrameSender(self.write, size, **kwargs)
+        self.senders.append(sender)
+        sender.start()
+        return sender
+
+    def fill(self, sender, count):
+        self.release.clear()
+        sender.put('first')
+        while sender.depth():
+            time.sleep(0.001)
+        for index in range(count):
+            sender.put(str(index))
+
+    def test_writes_buffers_in_order(self):
+        sender = self.get_sender(2)
+
+        for index in range(10):
+            sender.put(str(index))
+
+        self.assertTrue(sender.flush(5.0))
+        self.assertEquals([str(index) for index in range(10)], self.written)
+
+    def test_flush_times_out_while_writing(self):
+        sender = self.get_sender(2)
+        self.fill(sender, 1)
+
+        self.assertFalse(sender.flush(0.01))
+
+    def test_block_waits_for_space(self):
+        sender = self.get_sender(2)
+        self.fill(sender, 2)
+        putter = threading.Thread(target=sender.put, args=('last',))
+        putter.start()
+        time.sleep(0.05)
+        self.assertTrue(putter.is_alive())
+
+        self.release.set()
+        putter.join(5.0)
+
+        self.assertTrue(sender.flush(5.0))
+        self.assertEquals(['first', '0', '1', 'last'], self.written)
+
+    def test_timeout_raises_when_full(self):
+        sender = self.get_sender(2, backpressure=FrameSender.TIMEOUT, timeout=0.01)
+        self.fill(sender, 2)
+
+        with self.assertRaises(SendTimeoutException):
+            sender.put('last')
+
+    def test_drop_oldest_discards_and_counts(self):
+        sender = self.get_sender(2, backpressure=FrameSender.DROP_OLDEST)
+        self.fill(sender, 4)
+        self.release.set()
+
+        self.assertTrue(sender.flush(5.0))
+        self.assertEquals(['first', '2', '3'], self.written)
+        self.assertEquals(2, sender.dropped)
+
+    def test_watermark_call_backs(self):
+        watermarks = []
+        sender = self.get_sender(4, high_watermark=3, low_watermark=1, watermark_call_back=lambda high, depth: watermarks.append((high, depth)))
+        self.fill(sender, 3)
+        self.release.set()
+
+        self.assertTrue(sender.flush(5.0))
+        self.assertEquals([(True, 3), (False, 1)], watermarks)
+
+    def test_depth_and_size_are_in_packets(self):
+        sender = self.get_sender(4)
+        self.fill(sender, 0)
+        sender.put('three', 3)
+        putter = threading.Thread(target=sender.put, args=('two', 2))
+        putter.start()
+        time.sleep(0.05)
+        self.assertTrue(putter.is_alive())
+        self.assertEquals(3, sender.depth())
+
+        self.release.set()
+        putter.join(5.0)
+
+        self.assertTrue(sender.flush(5.0))
+        self.assertEquals(['first', 'three', 'two'], self.written)
+
+    def test_buffer_larger_than_size_is_taken_when_nothing_is_waiting(self):
+        sender = self.get_sender(2)
+
+        sender.put('large', 10)
+
+        self.assertTrue(sender.flush(5.0))
+        self.assertEquals(['large'], self.written)
+
+    def test_discard_leaves_only_final_waiting(self):
+        sender = self.get_sender(4)
+        self.fill(sender, 3)
+
+        sender.discard('laser off')
+        self.assertEquals(1, sender.depth())
+        self.release.set()
+
+        self.assertTrue(sender.flush(5.0))
+        self.assertEquals(['first', 'laser off'], self.written)
+
+    def test_close_discards_waiting_buffers_after_the_write_in_progress(self):
+        sender = self.get_sender(4)
+        self.fill(sender, 2)
+        closer = threading.Thread(target=lambda: self.written.append(('closed', sender.close())))
+        closer.start()
+        time.sleep(0.05)
+        self.assertTrue(closer.is_alive())
+
+        self.release.set()
+        closer.join(5.0)
+
+        self.assertEquals(['first', ('closed', None)], self.written)
+
+    def test_close_returns_final_not_yet_written(self):
+        sender = self.get_sender(4)
+        self.fill(sender, 2)
+        sender.discard('laser off')
+        closer = threading.Thread(target=lambda: self.written.append(('closed', sender.close())))
+        closer.start()
+        time.sleep(0.05)
+        self.assertTrue(closer.is_alive())
+
+        self.release.set()
+        closer.join(5.0)
+
+        self.assertEquals(['first', ('closed', 'laser off')], self.written)
+
+    def test_write_errors_stop_sender_and_raise_on_put(self):
+        sender = FrameSender(MagicMock(side_effect=MissingPrinterException("Gone")), 2)
+        self.senders.append(sender)
+        sender.start()
+
+        sender.put('first')
+        sender.flush(5.0)
+
+        with self.assertRaises(MissingPrinterException):
+            sender.put('second')
+
+    def test_invalid_backpressure_raises(self):
+        with self.assertRaises(Exception):
+            FrameSender(self.write, 2, backpressure='sometimes')
+        with self.assertRaises(Exception):
+            FrameSender(self.write, 2, backpressure=FrameSender.TIMEOUT)
 
 
 if __name__ == '__main__':
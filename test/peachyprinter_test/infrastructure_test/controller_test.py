@@ -3,7 +3,7 @@ import os
 import sys
 import time
 import logging
-from mock import patch
+from mock import patch, call
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
@@ -58,6 +58,7 @@ class ControllerTests(unittest.TestCase):
         self.wait_for_controller()
 
         self.assertEquals("Complete", self.controller.get_status()['status'])
+        mock_layer_writer.finish.assert_called_with()
 
     def test_run_should_record_errors_and_abort(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
         mock_layer_writer = mock_LayerWriter.return_value
@@ -76,6 +77,7 @@ class ControllerTests(unittest.TestCase):
         mock_layer_writer.terminate.assert_called_with()
         mock_layer_processing.terminate.assert_called_with()
         self.assertEquals("Cancelled", self.controller.get_status()['status'])
+        self.assertFalse(mock_layer_writer.finish.called)
 
     def test_run_should_record_errors_and_fail(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
         mock_layer_writer = mock_LayerWriter.return_value
@@ -170,6 +172,122 @@ class ControllerTests(unittest.TestCase):
 
         mock_layer_processing.abort_current_command.assert_called_with()
 
+    def test_run_with_prefetch_should_process_all_layers_and_complete(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
+        mock_layer_writer = mock_LayerWriter.return_value
+        mock_layer_processing = mock_LayerProcessing.return_value
+        test_layers = [Layer(z / 10.0, [LateralDraw([0.0, 0.0], [2.0, 2.0], 2.0)]) for z in range(0, 10)]
+        stub_layer_generator = StubLayerGenerator(list(test_layers))
+
+        self.controller = Controller(mock_layer_writer, mock_layer_processing, stub_layer_generator, MachineStatus(), True, prefetch_layers=3)
+        self.controller.start()
+
+        self.wait_for_controller()
+
+        self.assertEquals(test_layers, [call[0][0] for call in mock_layer_processing.process.call_args_list])
+        self.assertEquals("Complete", self.controller.get_status()['status'])
+
+    def test_run_with_prefetch_should_record_generator_errors_and_continue(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
+        mock_layer_writer = mock_LayerWriter.return_value
+        mock_layer_processing = mock_LayerProcessing.return_value
+        mock_layer_generator = mock_LayerGenerator.return_value
+        test_layer = Layer(0.1, [LateralDraw([0.0, 0.0], [2.0, 2.0], 2.0)])
+        mock_layer_generator.next.side_effect = [Exception("Something Broke"), test_layer, StopIteration]
+
+        self.controller = Controller(mock_layer_writer, mock_layer_processing, mock_layer_generator, MachineStatus(), False, prefetch_layers=2)
+        self.controller.start()
+
+        self.wait_for_controller()
+
+        self.assertEquals("Something Broke", self.controller.get_status()['errors'][0]['message'])
+        mock_layer_processing.process.assert_called_once_with(test_layer)
+        self.assertEquals("Complete", self.controller.get_status()['status'])
+
+    def test_prefetch_should_report_queue_depth_in_status(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
+        mock_layer_writer = mock_LayerWriter.return_value
+        mock_layer_processing = mock_LayerProcessing.return_value
+        test_layer = Layer(0.0, [LateralDraw([0.0, 0.0], [2.0, 2.0], 2.0)])
+        stub_layer_generator = StubLayerGenerator([test_layer], repeat=True)
+        mock_layer_processing.process.side_effect = lambda layer: time.sleep(0.05)
+
+        self.controller = Controller(mock_layer_writer, mock_layer_processing, stub_layer_generator, MachineStatus(), False, prefetch_layers=3)
+        self.controller.start()
+        time.sleep(0.2)
+
+        self.assertEquals(3, self.controller.get_status()['layer_queue_depth'])
+
+    def test_change_generator_with_prefetch_should_discard_prefetched_layers(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
+        mock_layer_writer = mock_LayerWriter.return_value
+        mock_layer_processing = mock_LayerProcessing.return_value
+        test_layer1 = Layer(0.0, [LateralDraw([0.0, 0.0], [2.0, 2.0], 100.0)])
+        test_layer2 = Layer(0.1, [LateralDraw([0.0, 0.0], [2.0, 2.0], 100.0)])
+        stub_layer_generator1 = StubLayerGenerator([test_layer1], repeat=True)
+        stub_layer_generator2 = StubLayerGenerator([test_layer2], repeat=True)
+        processed = []
+
+        def process(layer):
+            processed.append(layer)
+            time.sleep(0.02)
+        mock_layer_processing.process.side_effect = process
+
+        self.controller = Controller(mock_layer_writer, mock_layer_processing, stub_layer_generator1, MachineStatus(), False, prefetch_layers=5)
+        self.controller.start()
+        time.sleep(0.1)
+        self.controller.change_generator(stub_layer_generator2)
+        switched_at = len(processed)
+        time.sleep(0.1)
+        self.controller.close()
+        self.wait_for_controller()
+
+        self.assertTrue(test_layer1 in processed[:switched_at])
+        self.assertTrue(all(layer == test_layer2 for layer in processed[switched_at + 1:]), processed[switched_at:])
+        mock_layer_processing.abort_current_command.assert_called_with()
+
+    def test_prefetch_should_hand_layers_to_writer_to_render_ahead_in_order(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
+        mock_layer_writer = mock_LayerWriter.return_value
+        mock_layer_processing = mock_LayerProcessing.return_value
+        test_layers = [Layer(0.1 * index, [LateralDraw([0.0, 0.0], [2.0, 2.0], 100.0)]) for index in range(5)]
+        stub_layer_generator = StubLayerGenerator(test_layers)
+        processed = []
+        mock_layer_processing.process.side_effect = processed.append
+
+        self.controller = Controller(mock_layer_writer, mock_layer_processing, stub_layer_generator, MachineStatus(), True, prefetch_layers=2)
+        self.controller.start()
+        self.wait_for_controller()
+
+        self.assertEquals(test_layers, processed)
+        self.assertEquals([call(layer) for layer in test_layers], mock_layer_writer.render_ahead.call_args_list)
+
+    def test_change_generator_with_prefetch_should_discard_layers_rendered_ahead(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
+        mock_layer_writer = mock_LayerWriter.return_value
+        mock_layer_processing = mock_LayerProcessing.return_value
+        stub_layer_generator1 = StubLayerGenerator([Layer(0.0, [LateralDraw([0.0, 0.0], [2.0, 2.0], 100.0)])], repeat=True)
+        stub_layer_generator2 = StubLayerGenerator([Layer(0.1, [LateralDraw([0.0, 0.0], [2.0, 2.0], 100.0)])], repeat=True)
+        mock_layer_processing.process.side_effect = lambda layer: time.sleep(0.02)
+
+        self.controller = Controller(mock_layer_writer, mock_layer_processing, stub_layer_generator1, MachineStatus(), False, prefetch_layers=3)
+        self.controller.start()
+        time.sleep(0.05)
+        self.controller.change_generator(stub_layer_generator2)
+        self.controller.close()
+        self.wait_for_controller()
+
+        mock_layer_writer.discard_rendered.assert_called_with()
+
+    def test_close_with_prefetch_should_not_wait_for_slow_generator(self, mock_LayerGenerator, mock_LayerWriter, mock_LayerProcessing):
+        mock_layer_writer = mock_LayerWriter.return_value
+        mock_layer_processing = mock_LayerProcessing.return_value
+        mock_layer_generator = mock_LayerGenerator.return_value
+        mock_layer_generator.next.side_effect = lambda: time.sleep(10)
+
+        self.controller = Controller(mock_layer_writer, mock_layer_processing, mock_layer_generator, MachineStatus(), True, prefetch_layers=2)
+        self.controller.start()
+        time.sleep(0.1)
+        self.controller.close()
+        self.wait_for_controller()
+
+        self.assertEquals("Cancelled", self.controller.get_status()['status'])
+        mock_layer_writer.terminate.assert_called_with()
+
 
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
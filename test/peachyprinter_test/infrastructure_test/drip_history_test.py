@@ -0,0 +1,88 @@
+import unittest
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+from peachyprinter.infrastructure.drip_history import DripHistory
+
+
+class DripHistoryTests(unittest.TestCase):
+
+    def test_view_is_empty_initially(self):
+        self.assertEquals([], DripHistory(5).view().tolist())
+
+    def test_view_returns_drips_oldest_first(self):
+        history = DripHistory(5)
+        for drip_time in [1.0, 2.0, 3.0]:
+            history.append(drip_time)
+
+        self.assertEquals([1.0, 2.0, 3.0], history.view().tolist())
+
+    def test_view_keeps_most_recent_drips_when_wrapped(self):
+        history = DripHistory(5)
+        for drip_time in range(12):
+            history.append(float(drip_time))
+
+        self.assertEquals(5, len(history))
+        self.assertEquals([7.0, 8.0, 9.0, 10.0, 11.0], history.view().tolist())
+
+    def test_append_records_many_drips_at_one_time(self):
+        history = DripHistory(5)
+        history.append(1.0)
+        history.append(2.0, 3)
+        history.append(3.0, 7)
+
+        self.assertEquals([3.0] * 5, history.view().tolist())
+        history.append(4.0, 2)
+        self.assertEquals([3.0, 3.0, 3.0, 4.0, 4.0], history.view().tolist())
+
+    def test_append_ignores_no_drips(self):
+        history = DripHistory(5)
+        history.append(1.0, 0)
+        history.append(1.0, -2)
+
+        self.assertEquals(0, len(history))
+
+    def test_view_is_read_only_and_shares_memory(self):
+        history = DripHistory(5)
+        history.append(1.0)
+        view = history.view()
+
+        with self.assertRaises(ValueError):
+            view[0] = 2.0
+        self.assertFalse(view.flags.owndata)
+
+    def test_clear_removes_drips(self):
+        history = DripHistory(5)
+        history.append(1.0, 3)
+
+        history.clear()
+
+        self.assertEquals([], history.view().tolist())
+
+    def test_average_uses_last_drips(self):
+        history = DripHistory(20)
+        for drip_time in range(15):
+            history.append(drip_time * 0.5)
+
+        self.assertEquals(0.0, DripHistory(20).average(10))
+        self.assertAlmostEquals(10.0 / 4.5, history.average(10))
+
+    def test_drips_per_second_counts_drips_in_window(self):
+        history = DripHistory(100)
+        for drip_time in range(10):
+            history.append(float(drip_time))
+        for drip_time in range(20):
+            history.append(10.0 + drip_time * 0.25)
+
+        self.assertEquals(4.0, history.drips_per_second(2.0, now=14.75))
+        self.assertEquals(2.5, history.drips_per_second(10.0, now=14.75))
+        self.assertEquals(0.0, history.drips_per_second(5.0, now=20.0))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
@@ -1,4 +1,6 @@
 import unittest
+import gc
+import numpy as np
 import StringIO
 import os
 import sys
@@ -35,7 +37,7 @@ class GCodeReaderTests(unittest.TestCase, test_helpers.TestHelpers):
 
         gcode_reader = GCodeReader(test_gcode, scale=0.1)
         gcode_reader.get_layers()
-        mock_GCodeToLayerGenerator.assert_called_with(test_gcode, scale=0.1, start_height=None)
+        mock_GCodeToLayerGenerator.assert_called_with(test_gcode, scale=0.1, start_height=None, batch_size=None, resume=None, layer_starts_call_back=None)
 
     @patch('peachyprinter.infrastructure.gcode_layer_generator.GCodeToLayerGenerator')
     def test_check_should_use_scale(self, mock_GCodeToLayerGenerator):
@@ -44,7 +46,7 @@ class GCodeReaderTests(unittest.TestCase, test_helpers.TestHelpers):
 
         gcode_reader = GCodeReader(test_gcode, scale=0.1)
         gcode_reader.check()
-        mock_GCodeToLayerGenerator.assert_called_with(test_gcode, scale=0.1, start_height=None)
+        mock_GCodeToLayerGenerator.assert_called_with(test_gcode, scale=0.1, start_height=None, batch_size=None, resume=None, layer_starts_call_back=None)
 
     @patch('peachyprinter.infrastructure.gcode_layer_generator.GCodeToLayerGenerator')
     def test_check_should_use_start_height(self, mock_GCodeToLayerGenerator):
@@ -54,7 +56,7 @@ class GCodeReaderTests(unittest.TestCase, test_helpers.TestHelpers):
 
         gcode_reader = GCodeReader(test_gcode, start_height=expected_start_height)
         gcode_reader.check()
-        mock_GCodeToLayerGenerator.assert_called_with(test_gcode, scale=1.0, start_height=expected_start_height)
+        mock_GCodeToLayerGenerator.assert_called_with(test_gcode, scale=1.0, start_height=expected_start_height, batch_size=None, resume=None, layer_starts_call_back=None)
 
 
 class GCodeToLayerGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
@@ -210,6 +212,41 @@ class GCodeToLayerGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
 
         self.assertLayersEquals(expected, actual)
 
+    def test_batch_mode_produces_the_same_layers_as_line_mode(self):
+        gcode = "G21\nG1 F6000\nG1 X1.0 Y1.0 E1\nG1 X2.0 Y1.0 E0\n;Comment\nG1 Z0.1\nG1 X0.0 Y0.0 E2 F3000\nG1 X1.0 Y0.5 E3\nG1 Z0.2\nG1 X2.0 Y2.0 E4\n"
+        expected = list(GCodeToLayerGenerator(StringIO.StringIO(gcode)))
+
+        actual = list(GCodeToLayerGenerator(StringIO.StringIO(gcode), batch_size=3))
+
+        self.assertLayersEquals(expected, actual)
+
+    def test_batch_mode_reports_errors_with_line_numbers(self):
+        gcode = "G1 X1.0 Y1.0 E1 F6000\nG1 X2.0 Y1.0 E1\nFake Gcode\nG1 X2.0 Y2.0 E1\n"
+        layer_generator = GCodeToLayerGenerator(StringIO.StringIO(gcode), batch_size=2)
+
+        actual = list(layer_generator)
+
+        self.assertEquals(["Error 3: Unsupported Command: Fake Gcode"], layer_generator.errors)
+        self.assertEquals(3, len(actual[0].commands))
+
+    def test_layers_are_array_layers(self):
+        gcode = "G1 F6000\nG1 Z0.1\nG1 X1.0 Y1.0 E1\nG1 X2.0 Y1.0\nG1 Z0.2\nG1 X2.0 Y2.0 E2\n"
+        for batch_size in [None, 2]:
+            actual = list(GCodeToLayerGenerator(StringIO.StringIO(gcode), batch_size=batch_size))
+
+            self.assertEquals([ArrayLayer, ArrayLayer], [type(layer) for layer in actual])
+            self.assertEquals([[0.0, 0.0]], actual[0].records['start'].tolist())
+            self.assertEquals([[1.0, 1.0]], actual[0].records['end'].tolist())
+            self.assertEquals([True, True], [actual[0].records['draw'][0], actual[1].records['draw'][0]])
+
+    def test_empty_layers_are_returned(self):
+        gcode = "G1 F6000\nG1 Z0.1\nG1 Z0.2\nG1 X2.0 Y2.0 E2\n"
+
+        actual = list(GCodeToLayerGenerator(StringIO.StringIO(gcode)))
+
+        self.assertEquals([0.1, 0.2], [layer.z for layer in actual])
+        self.assertEquals([0, 1], [len(layer) for layer in actual])
+
 
 class GCodeCommandReaderTest(unittest.TestCase, test_helpers.TestHelpers):
     def test_to_command_returns_empty_list_for_comments(self):
@@ -440,6 +477,88 @@ class GCodeCommandReaderTest(unittest.TestCase, test_helpers.TestHelpers):
 
         self.assertCommandsEqual(expected, command_reader.to_command(gcode_test))
 
+    def test_to_commands_matches_to_command_for_lateral_moves(self):
+        gcode_lines = ["G1 X1.0 Y1.0 F6000 E12", "G1 X2.0", "G1 F1200", "G0 X-1.5 Y.5", "G1 X3 Y4 E0.0", "G1 X3.25 Y4.5 E1"]
+        line_reader = GCodeCommandReader(scale=0.5)
+        expected = [command for line in gcode_lines for command in line_reader.to_command(line)]
+        command_reader = GCodeCommandReader(scale=0.5)
+
+        actual = command_reader.to_commands(gcode_lines)
+
+        self.assertCommandsEqual(expected, actual)
+
+    def test_to_commands_keeps_state_between_batch_and_single_lines(self):
+        gcode_lines = ["G20", "G1 X1.0 Y1.0 F60 E1", "G0 Z1.0 F60", "G1 X2.0 Y2.0 E1", "G21", "G1 X1.0 Y1.0 E1"]
+        line_reader = GCodeCommandReader()
+        expected = [command for line in gcode_lines for command in line_reader.to_command(line)]
+        command_reader = GCodeCommandReader()
+
+        actual = command_reader.to_commands(gcode_lines)
+
+        self.assertCommandsEqual(expected, actual)
+
+    def test_to_commands_leaves_garbage_collection_as_it_was(self):
+        gcode_lines = ["G1 X1.0 Y1.0 F6000 E12", "G1 X2.0 Y1.0"]
+        try:
+            GCodeCommandReader().to_commands(gcode_lines)
+            self.assertTrue(gc.isenabled())
+            gc.disable()
+            GCodeCommandReader().to_commands(gcode_lines)
+            self.assertFalse(gc.isenabled())
+        finally:
+            gc.enable()
+
+    def test_to_commands_returns_records_for_lateral_runs_when_requested(self):
+        gcode_lines = ["G1 X1.0 Y1.0 F6000 E12", "G1 X2.0 Y1.0", "G0 Z1.0", "G1 X3.0 Y4.0 E1"]
+        line_reader = GCodeCommandReader()
+        expected = [command for line in gcode_lines for command in line_reader.to_command(line)]
+        command_reader = GCodeCommandReader()
+
+        actual = command_reader.to_commands(gcode_lines, records=True)
+
+        self.assertEquals([np.ndarray, VerticalMove, np.ndarray], [type(item) for item in actual])
+        self.assertCommandsEqual(expected[:2], commands_from_records(actual[0]))
+        self.assertCommandsEqual(expected[3:], commands_from_records(actual[2]))
+
+    def test_to_commands_raises_on_error_when_no_error_list_provided(self):
+        command_reader = GCodeCommandReader()
+        with self.assertRaises(Exception):
+            command_reader.to_commands(["G1 X1.0 Y1.0 E1", "P01 X123.0 C7"])
+
+    def test_to_commands_records_errors_when_error_list_provided(self):
+        command_reader = GCodeCommandReader()
+        errors = []
+        expected = [LateralDraw([0.0, 0.0], [1.0, 1.0], 100.0), LateralDraw([1.0, 1.0], [2.0, 2.0], 100.0)]
+
+        actual = command_reader.to_commands(["G1 X1.0 Y1.0 E1", "P01 X123.0 C7", "G1 X2.0 Y2.0 E1"], errors=errors)
+
+        self.assertCommandsEqual(expected, actual)
+        self.assertEquals(1, len(errors))
+        self.assertEquals(1, errors[0][0])
+
+    def test_to_commands_raises_when_feed_rate_is_zero(self):
+        command_reader = GCodeCommandReader()
+        with self.assertRaises(Exception):
+            command_reader.to_commands(["G1 X1.0 Y1.0 E1 F0"])
+
+    def test_to_commands_raises_for_moves_without_feed_rate_after_feed_rate_of_zero(self):
+        gcode_lines = ["G1 X1.0 Y1.0 E1 F0", "G1 Z1.0", "G1 X2.0 Y2.0 E1", "G1 X3.0 Y3.0 E1 F600", "G1 X4.0 Y4.0 E1"]
+        expected = []
+        expected_errors = []
+        line_reader = GCodeCommandReader()
+        for (index, line) in enumerate(gcode_lines):
+            try:
+                expected.extend(line_reader.to_command(line))
+            except Exception as ex:
+                expected_errors.append(index)
+        errors = []
+
+        actual = GCodeCommandReader().to_commands(gcode_lines, errors=errors)
+
+        self.assertEquals([0, 1, 2], expected_errors)
+        self.assertEquals(expected_errors, [index for (index, error) in errors])
+        self.assertCommandsEqual(expected, actual)
+
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
     unittest.main()
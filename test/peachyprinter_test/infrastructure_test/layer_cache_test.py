@@ -0,0 +1,183 @@
+import unittest
+import StringIO
+import os
+import sys
+import shutil
+import tempfile
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import test_helpers
+from mock import MagicMock
+
+from peachyprinter.infrastructure.layer_cache import LayerCache, CachedLayerGenerator, CachingLayerGenerator, file_hash
+from peachyprinter.infrastructure.gcode_layer_generator import GCodeReader
+from peachyprinter.infrastructure.layer_generators import StubLayerGenerator
+from peachyprinter.domain.commands import *
+
+
+class LayerCacheTests(unittest.TestCase, test_helpers.TestHelpers):
+    gcode = "G1 F6000\nG1 Z0.1\nG1 X1.0 Y1.0 E1\nG1 X2.0 Y1.0\nG1 X2.0 Y2.0 E2\nG1 Z0.2\nG1 X0.0 Y0.0 E3\n"
+
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_path)
+
+    def record(self, layer_cache, key, layers, errors=[]):
+        generator = StubLayerGenerator(layers)
+        generator.errors = errors
+        return list(layer_cache.recorder(key, generator))
+
+    def test_key_depends_on_content_scale_and_start_height(self):
+        layer_cache = LayerCache(self.cache_path)
+        content_hash = file_hash(StringIO.StringIO(self.gcode))
+        key = layer_cache.key(content_hash, 1.0, None)
+
+        self.assertEquals(key, layer_cache.key(file_hash(StringIO.StringIO(self.gcode)), 1.0, None))
+        self.assertNotEquals(key, layer_cache.key(file_hash(StringIO.StringIO(self.gcode + "G1 X1.0 Y1.0\n")), 1.0, None))
+        self.assertNotEquals(key, layer_cache.key(content_hash, 0.5, None))
+        self.assertNotEquals(key, layer_cache.key(content_hash, 1.0, 2.0))
+
+    def test_file_hash_leaves_file_at_start(self):
+        test_gcode = StringIO.StringIO(self.gcode)
+        test_gcode.readline()
+
+        file_hash(test_gcode)
+
+        self.assertEquals(0, test_gcode.tell())
+
+    def test_get_returns_none_when_not_cached(self):
+        self.assertEquals(None, LayerCache(self.cache_path).get('missing'))
+
+    def test_get_returns_recorded_layers(self):
+        layer_cache = LayerCache(self.cache_path)
+        layers = [
+            Layer(0.1, [LateralDraw([0.0, 0.0], [1.0, 1.0], 100.0), LateralMove([1.0, 1.0], [2.0, 1.0], 50.0)]),
+            Layer(0.2),
+            Layer(0.3, [LateralDraw([2.0, 1.0], [0.5, 0.5], 25.0)]),
+            ]
+        self.record(layer_cache, 'key', layers, ['Error 7: Bad'])
+
+        cached = layer_cache.get('key')
+
+        self.assertEquals(CachedLayerGenerator, type(cached))
+        self.assertLayersEquals(layers, list(cached))
+        self.assertEquals(['Error 7: Bad'], cached.errors)
+
+    def test_incomplete_recording_is_not_cached(self):
+        layer_cache = LayerCache(self.cache_path)
+        recorder = layer_cache.recorder('key', StubLayerGenerator([Layer(0.1), Layer(0.2)]))
+
+        recorder.next()
+
+        self.assertEquals(None, layer_cache.get('key'))
+
+    def test_recording_file_is_not_created_until_first_layer(self):
+        layer_cache = LayerCache(self.cache_path)
+        layer_cache.recorder('key', StubLayerGenerator([Layer(0.1)]))
+
+        self.assertFalse(os.path.exists(layer_cache._file_name('key', '.commands.tmp')))
+
+    def test_close_removes_incomplete_recording(self):
+        layer_cache = LayerCache(self.cache_path)
+        recorder = layer_cache.recorder('key', StubLayerGenerator([Layer(0.1), Layer(0.2)]))
+        recorder.next()
+        self.assertTrue(os.path.exists(layer_cache._file_name('key', '.commands.tmp')))
+
+        recorder.close()
+
+        self.assertFalse(os.path.exists(layer_cache._file_name('key', '.commands.tmp')))
+        self.assertEquals(None, layer_cache.get('key'))
+
+    def test_dropping_recorder_removes_incomplete_recording(self):
+        layer_cache = LayerCache(self.cache_path)
+        recorder = layer_cache.recorder('key', StubLayerGenerator([Layer(0.1), Layer(0.2)]))
+        recorder.next()
+
+        del recorder
+
+        self.assertFalse(os.path.exists(layer_cache._file_name('key', '.commands.tmp')))
+
+    def test_close_after_last_layer_keeps_recording(self):
+        layer_cache = LayerCache(self.cache_path)
+        generator = StubLayerGenerator([Layer(0.1)])
+        generator.errors = []
+        recorder = layer_cache.recorder('key', generator)
+        list(recorder)
+
+        recorder.close()
+
+        self.assertNotEquals(None, layer_cache.get('key'))
+
+    def test_stale_recording_files_are_removed(self):
+        layer_cache = LayerCache(self.cache_path)
+        stale_file = layer_cache._file_name('stale', '.commands.tmp')
+        fresh_file = layer_cache._file_name('fresh', '.commands.tmp')
+        for file_name in [stale_file, fresh_file]:
+            with open(file_name, 'wb') as recording:
+                recording.write('abandoned')
+        stale_time = time.time() - LayerCache.STALE_TEMP_SECONDS - 100
+        os.utime(stale_file, (stale_time, stale_time))
+
+        self.record(layer_cache, 'key', [Layer(0.1)])
+
+        self.assertFalse(os.path.exists(stale_file))
+        self.assertTrue(os.path.exists(fresh_file))
+
+    def test_least_recently_used_entries_are_evicted_when_full(self):
+        layer = Layer(0.1, [LateralDraw([0.0, 0.0], [1.0, 1.0], 100.0)] * 10)
+        layer_cache = LayerCache(self.cache_path, max_size_bytes=1200)
+        self.record(layer_cache, 'first', [layer])
+        self.record(layer_cache, 'second', [layer])
+        os.utime(os.path.join(self.cache_path, 'first.json'), (time.time() - 100, time.time() - 100))
+        os.utime(os.path.join(self.cache_path, 'second.json'), (time.time() - 200, time.time() - 200))
+        layer_cache.get('second')
+
+        self.record(layer_cache, 'third', [layer])
+
+        self.assertEquals(None, layer_cache.get('first'))
+        self.assertNotEquals(None, layer_cache.get('second'))
+        self.assertNotEquals(None, layer_cache.get('third'))
+
+    def test_gcode_reader_uses_cache_on_second_read(self):
+        layer_cache = LayerCache(self.cache_path)
+        expected = list(GCodeReader(StringIO.StringIO(self.gcode)).get_layers())
+
+        first = GCodeReader(StringIO.StringIO(self.gcode), layer_cache=layer_cache).get_layers()
+        first_layers = list(first)
+        second = GCodeReader(StringIO.StringIO(self.gcode), layer_cache=layer_cache).get_layers()
+
+        self.assertEquals(CachingLayerGenerator, type(first))
+        self.assertEquals(CachedLayerGenerator, type(second))
+        self.assertLayersEquals(expected, first_layers)
+        self.assertLayersEquals(expected, list(second))
+
+    def test_gcode_reader_check_populates_cache_and_keeps_errors(self):
+        layer_cache = LayerCache(self.cache_path)
+        gcode = self.gcode + "Fake Gcode\n"
+
+        errors = GCodeReader(StringIO.StringIO(gcode), layer_cache=layer_cache).check()
+        cached_errors = GCodeReader(StringIO.StringIO(gcode), layer_cache=layer_cache).check()
+
+        self.assertEquals(["Error 8: Unsupported Command: Fake Gcode"], errors)
+        self.assertEquals(errors, cached_errors)
+
+    def test_gcode_reader_skips_cache_when_file_cannot_be_hashed(self):
+        layer_cache = MagicMock()
+        test_gcode = StringIO.StringIO(self.gcode)
+        test_gcode.seek = MagicMock(side_effect=IOError("Not seekable"))
+
+        layers = GCodeReader(test_gcode, layer_cache=layer_cache).get_layers()
+
+        self.assertEquals(2, len(list(layers)))
+        self.assertFalse(layer_cache.recorder.called)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()
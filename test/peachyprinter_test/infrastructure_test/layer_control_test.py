@@ -11,6 +11,9 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'sr
 from peachyprinter.infrastructure.layer_control import *
 from peachyprinter.domain.commands import *
 from peachyprinter.infrastructure.machine import *
+from peachyprinter.infrastructure.path_to_points import PathToPoints
+from peachyprinter.infrastructure.transformer import OneToOneTransformer
+from peachyprinter.domain.laser_control import LaserControl
 
 
 @patch('peachyprinter.domain.laser_control.LaserControl')
@@ -240,6 +243,41 @@ class LayerWriterTests(unittest.TestCase):
         mock_path_to_points.process.assert_called_with(
             state.xyz, state.xyz, state.speed)
 
+    def test_wait_till_time_holds_position_with_dwell_blocks(self, mock_MicroDisseminator, mock_PathToPoints, mock_LaserControl):
+        mock_path_to_points = mock_PathToPoints.return_value
+        mock_path_to_points.process.return_value = [[0.0, 0.0], [0.5, 0.5]]
+        mock_disseminator = Mock(spec=['process', 'hold', 'close'])
+        mock_laser_control = mock_LaserControl.return_value
+        self.writer = LayerWriter(
+            mock_disseminator, mock_path_to_points, mock_laser_control, MachineState(), override_move_speed=2.0, override_draw_speed=2.0)
+
+        before = time.time()
+        self.writer.wait_till_time(before + 0.3)
+        after = time.time()
+
+        self.assertTrue(before + 0.3 <= after)
+        self.assertEqual(1, mock_path_to_points.process.call_count)
+        self.assertTrue(mock_disseminator.hold.call_count >= 3)
+        for ((point, seconds), kwargs) in mock_disseminator.hold.call_args_list:
+            self.assertEqual([0.5, 0.5], point)
+            self.assertTrue(0.0 < seconds <= LayerWriter.HOLD_BLOCK_SECONDS)
+
+    def test_wait_till_time_returns_when_aborted_while_waiting(self, mock_MicroDisseminator, mock_PathToPoints, mock_LaserControl):
+        mock_path_to_points = mock_PathToPoints.return_value
+        mock_path_to_points.process.return_value = [[0.0, 0.0]]
+        mock_disseminator = Mock(spec=['process', 'hold', 'close'])
+        mock_laser_control = mock_LaserControl.return_value
+        self.writer = LayerWriter(
+            mock_disseminator, mock_path_to_points, mock_laser_control, MachineState(), override_move_speed=2.0, override_draw_speed=2.0)
+        mock_disseminator.hold.side_effect = lambda point, seconds: self.writer.abort_current_command()
+
+        before = time.time()
+        self.writer.wait_till_time(before + 100)
+        after = time.time()
+
+        self.assertTrue(before + 10 > after)
+        self.assertEqual(1, mock_disseminator.hold.call_count)
+
     def test_post_fire_delay_will_wait_after_laser_on(self, mock_MicroDisseminator, mock_PathToPoints, mock_LaserControl):
         mock_path_to_points = mock_PathToPoints.return_value
         mock_disseminator = mock_MicroDisseminator.return_value
@@ -296,6 +334,25 @@ class LayerWriterTests(unittest.TestCase):
 
         self.assertTrue(before + 10 > after)
 
+    def test_abort_current_command_discards_unsent_samples(self, mock_MicroDisseminator, mock_PathToPoints, mock_LaserControl):
+        mock_disseminator = mock_MicroDisseminator.return_value
+        self.writer = LayerWriter(
+            mock_disseminator, mock_PathToPoints.return_value, mock_LaserControl.return_value, MachineState())
+
+        self.writer.abort_current_command()
+
+        mock_disseminator.discard.assert_called_once_with()
+
+    def test_finish_waits_for_samples_to_be_sent(self, mock_MicroDisseminator, mock_PathToPoints, mock_LaserControl):
+        mock_disseminator = mock_MicroDisseminator.return_value
+        self.writer = LayerWriter(
+            mock_disseminator, mock_PathToPoints.return_value, mock_LaserControl.return_value, MachineState())
+
+        self.writer.finish()
+
+        mock_disseminator.flush.assert_called_once_with(LayerWriter.FINISH_TIMEOUT_SECONDS)
+        self.assertEqual(0, mock_disseminator.discard.call_count)
+
     def test_terminate_shutsdown_audio_writer(self, mock_MicroDisseminator, mock_PathToPoints, mock_LaserControl):
         mock_path_to_points = mock_PathToPoints.return_value
         mock_disseminator = mock_MicroDisseminator.return_value
@@ -426,6 +483,54 @@ class LayerProcessingTest(unittest.TestCase):
         self.assertEqual(1, mock_writer.process_layer.call_count)
         self.assertEqual(2, mock_writer.wait_till_time.call_count)
 
+    def test_process_should_prepare_layer_once_while_waiting_for_zaxis(self, mock_ZAxis, mock_Writer):
+        mock_writer = mock_Writer.return_value
+        mock_zaxis = mock_ZAxis.return_value
+        zaxis_return_values = [0.0, 0.0, 0.0, 1.0, 1.0]
+        mock_zaxis.current_z_location_mm.side_effect = lambda: zaxis_return_values.pop(0)
+        test_layer = Layer(1.0, [LateralDraw([0.0, 0.0], [2.0, 2.0], 2.0)])
+        layer_processing = LayerProcessing(
+            mock_writer, MachineState(), MachineStatus(), mock_zaxis, 0.0, NullCommander(), 0, 'a', 'b', 'z')
+
+        layer_processing.process(test_layer)
+
+        self.assertEqual(3, mock_writer.wait_till_time.call_count)
+        mock_writer.prepare_layer.assert_called_once_with(test_layer)
+        self.assertEqual(['wait_till_time', 'prepare_layer'], [name for (name, args, kwargs) in mock_writer.method_calls][:2])
+
+    def test_process_should_wait_till_predicted_height(self, mock_ZAxis, mock_Writer):
+        mock_writer = mock_Writer.return_value
+        mock_zaxis = mock_ZAxis.return_value
+        zaxis_return_values = [0.0, 1.0, 1.0]
+        mock_zaxis.current_z_location_mm.side_effect = lambda: zaxis_return_values.pop(0)
+        mock_zaxis.seconds_until.return_value = 0.02
+        test_layer = Layer(1.0, [LateralDraw([0.0, 0.0], [2.0, 2.0], 2.0)])
+        layer_processing = LayerProcessing(
+            mock_writer, MachineState(), MachineStatus(), mock_zaxis, 0.0, NullCommander(), 0, 'a', 'b', 'z')
+
+        start = time.time()
+        layer_processing.process(test_layer)
+
+        mock_zaxis.seconds_until.assert_called_with(1.0)
+        wait_time = mock_writer.wait_till_time.call_args_list[0][0][0]
+        self.assertTrue(start + 0.02 <= wait_time <= time.time() + 0.02)
+
+    def test_process_should_poll_when_height_cannot_be_predicted(self, mock_ZAxis, mock_Writer):
+        mock_writer = mock_Writer.return_value
+        mock_zaxis = mock_ZAxis.return_value
+        zaxis_return_values = [0.0, 1.0, 1.0]
+        mock_zaxis.current_z_location_mm.side_effect = lambda: zaxis_return_values.pop(0)
+        mock_zaxis.seconds_until.return_value = None
+        test_layer = Layer(1.0, [LateralDraw([0.0, 0.0], [2.0, 2.0], 2.0)])
+        layer_processing = LayerProcessing(
+            mock_writer, MachineState(), MachineStatus(), mock_zaxis, 0.0, NullCommander(), 0, 'a', 'b', 'z')
+
+        start = time.time()
+        layer_processing.process(test_layer)
+
+        wait_time = mock_writer.wait_till_time.call_args_list[0][0][0]
+        self.assertTrue(start + LayerProcessing.POLL_SECONDS <= wait_time <= time.time() + LayerProcessing.POLL_SECONDS)
+
     @patch('peachyprinter.infrastructure.machine.MachineStatus')
     def test_process_should_set_waiting_while_wating_for_z(self, mock_MachineStatus, mock_ZAxis, mock_Writer):
         mock_writer = mock_Writer.return_value
@@ -639,6 +744,160 @@ class LayerProcessingTest(unittest.TestCase):
         self.assertTrue(mock_writer.wait_till_time.call_args_list[0][0][0] >= start_time + pre_layer_delay, "Was %s, expected: %s" % (mock_writer.wait_till_time.call_args_list[0][0], start_time + pre_layer_delay))
         self.assertTrue(mock_writer.wait_till_time.call_args_list[0][0][0] <= end_time + pre_layer_delay, "Was %s, expected: %s" % (mock_writer.wait_till_time.call_args_list[0][0], start_time + pre_layer_delay))
 
+class RecordingDisseminator(object):
+    def __init__(self, laser_control):
+        self._laser_control = laser_control
+        self.points = []
+        self.laser = []
+        self.layers = []
+        self.process_points_calls = 0
+        self.on_process_points = None
+
+    def next_layer(self, height):
+        self.layers.append(height)
+
+    def process(self, data):
+        self.points.extend(data.tolist())
+        self.laser.extend([self._laser_control.laser_is_on()] * len(data))
+
+    def process_points(self, data, laser_on):
+        self.process_points_calls += 1
+        self.points.extend(data.tolist())
+        self.laser.extend(laser_on.tolist())
+        if self.on_process_points:
+            self.on_process_points()
+
+
+class EncodingDisseminator(RecordingDisseminator):
+    def __init__(self, laser_control):
+        super(EncodingDisseminator, self).__init__(laser_control)
+        self.send_encoded_calls = 0
+
+    def encode_points(self, data, laser_on):
+        return (data.copy(), laser_on.copy())
+
+    def send_encoded(self, frames, points=None):
+        self.send_encoded_calls += 1
+        (data, laser_on) = frames
+        self.points.extend(data.tolist())
+        self.laser.extend(laser_on.tolist())
+
+
+class LayerWriterRecordsTests(unittest.TestCase):
+    commands = [
+        LateralDraw([0.0, 0.0], [1.0, 1.0], 100.0),
+        LateralDraw([1.0, 1.0], [1.0, 0.5], 50.0),
+        LateralMove([1.0, 0.5], [0.2, 0.2], 100.0),
+        LateralDraw([0.2, 0.2], [0.3, 0.2], 100.0),
+        LateralDraw([0.3, 0.2], [0.3, 0.201], 100.0),
+        LateralDraw([0.3, 0.2], [0.3, 0.3], 20.0),
+        LateralDraw([0.9, 0.9], [0.9, 0.9], 10.0),
+        LateralMove([0.9, 0.9], [0.5, 0.5], 100.0),
+        ]
+
+    def write(self, layers, laser_on=False, laser_off_override=False, **kwargs):
+        laser_control = LaserControl(0.5)
+        if laser_on:
+            laser_control.set_laser_on()
+        disseminator = RecordingDisseminator(laser_control)
+        state = MachineState([0.1, 0.1, 0.0], 10.0)
+        writer = LayerWriter(disseminator, PathToPoints(200, OneToOneTransformer(), 0.01), laser_control, state, **kwargs)
+        writer.laser_off_override = laser_off_override
+        extents = [writer.process_layer(layer) for layer in layers]
+        return (disseminator, state, laser_control, extents)
+
+    def assertSameOutput(self, **kwargs):
+        expected = self.write([Layer(0.1, list(self.commands)), Layer(0.2, list(self.commands))], **kwargs)
+        actual = self.write([ArrayLayer.from_commands(0.1, self.commands), ArrayLayer.from_commands(0.2, self.commands)], **kwargs)
+
+        self.assertTrue(actual[0].process_points_calls > 0)
+        self.assertEquals(len(expected[0].points), len(actual[0].points))
+        for (expected_point, actual_point) in zip(expected[0].points, actual[0].points):
+            self.assertAlmostEqual(expected_point[0], actual_point[0])
+            self.assertAlmostEqual(expected_point[1], actual_point[1])
+        self.assertEquals(expected[0].laser, actual[0].laser)
+        self.assertEquals(expected[0].layers, actual[0].layers)
+        self.assertEquals(expected[1].xyz, actual[1].xyz)
+        self.assertEquals(expected[1].speed, actual[1].speed)
+        self.assertEquals(expected[2].laser_is_on(), actual[2].laser_is_on())
+        self.assertEquals(expected[3], actual[3])
+
+    def test_process_layer_with_records_matches_commands(self):
+        self.assertSameOutput()
+
+    def test_process_layer_with_records_matches_commands_with_delays(self):
+        self.assertSameOutput(wait_speed=5.0, post_fire_delay_speed=4.0, slew_delay_speed=3.0)
+
+    def test_process_layer_with_records_matches_commands_when_laser_starts_on(self):
+        self.assertSameOutput(laser_on=True, slew_delay_speed=3.0, post_fire_delay_speed=4.0)
+
+    def test_process_layer_with_records_matches_commands_with_override_speeds(self):
+        self.assertSameOutput(override_draw_speed=30.0, override_move_speed=300.0, move_distance_to_ignore=0.01)
+
+    def test_process_layer_with_records_matches_commands_when_laser_forced_off(self):
+        self.assertSameOutput(laser_off_override=True, post_fire_delay_speed=4.0)
+
+    def prepared_write(self, change_state=False):
+        laser_control = LaserControl(0.5)
+        disseminator = EncodingDisseminator(laser_control)
+        state = MachineState([0.1, 0.1, 0.0], 10.0)
+        writer = LayerWriter(disseminator, PathToPoints(200, OneToOneTransformer(), 0.01), laser_control, state, post_fire_delay_speed=4.0)
+        layer = ArrayLayer.from_commands(0.1, self.commands)
+        writer.prepare_layer(layer)
+        if change_state:
+            state.set_state([0.5, 0.5, 0.0], 10.0)
+        extents = writer.process_layer(layer)
+        return (disseminator, state, extents)
+
+    def test_process_layer_sends_prepared_layer_encoded(self):
+        (disseminator, state, extents) = self.prepared_write()
+        expected = self.write([ArrayLayer.from_commands(0.1, self.commands)], post_fire_delay_speed=4.0)
+
+        self.assertEquals(0, disseminator.process_points_calls)
+        self.assertTrue(disseminator.send_encoded_calls > 0)
+        self.assertEquals(expected[0].points, disseminator.points)
+        self.assertEquals(expected[0].laser, disseminator.laser)
+        self.assertEquals(expected[1].xyz, state.xyz)
+        self.assertEquals(expected[3][0], extents)
+
+    def test_process_layer_discards_prepared_layer_when_state_changes(self):
+        (disseminator, state, extents) = self.prepared_write(change_state=True)
+        laser_control = LaserControl(0.5)
+        expected = RecordingDisseminator(laser_control)
+        writer = LayerWriter(expected, PathToPoints(200, OneToOneTransformer(), 0.01), laser_control, MachineState([0.5, 0.5, 0.0], 10.0), post_fire_delay_speed=4.0)
+        writer.process_layer(ArrayLayer.from_commands(0.1, self.commands))
+
+        self.assertEquals(0, disseminator.send_encoded_calls)
+        self.assertTrue(disseminator.process_points_calls > 0)
+        self.assertEquals(expected.points, disseminator.points)
+
+    def test_process_layer_with_records_and_no_draws_returns_empty_extents(self):
+        disseminator, state, laser_control, extents = self.write([ArrayLayer.from_commands(0.1, [LateralMove([0.0, 0.0], [1.0, 1.0], 100.0)])])
+
+        self.assertEquals([[[None, None], [None, None], None]], extents)
+        self.assertEquals([], disseminator.points)
+        self.assertEquals([0.1, 0.1, 0.0], state.xyz)
+
+    def test_process_layer_with_records_stops_on_abort(self):
+        laser_control = LaserControl(0.5)
+        disseminator = RecordingDisseminator(laser_control)
+        state = MachineState()
+        writer = LayerWriter(disseminator, PathToPoints(200, OneToOneTransformer(), 0.01), laser_control, state)
+        writer.POINTS_PER_CHUNK = 1
+        layer = ArrayLayer.from_commands(0.1, [LateralDraw([0.0, 0.0], [float(i), 0.0], 100.0) for i in range(1, 4)])
+
+        def abort():
+            writer._abort_current_command = True
+        disseminator.on_process_points = abort
+
+        extents = writer.process_layer(layer)
+
+        self.assertEquals(1, disseminator.process_points_calls)
+        self.assertEquals([[0.0, 1.0], [0.0, 0.0], 0.1], extents)
+        self.assertEquals([1.0, 0.0, 0.1], state.xyz)
+        self.assertFalse(writer._abort_current_command)
+
+
 if __name__ == '__main__':
     logging.basicConfig(
         format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
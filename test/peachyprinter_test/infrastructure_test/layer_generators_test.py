@@ -2,6 +2,7 @@ import unittest
 import os
 import sys
 import logging
+from mock import patch
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
@@ -120,6 +121,82 @@ class HilbertGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
         self.assertLayerEquals(expected, actual)
 
 
+    def test_next_starts_from_end_of_last_layer(self):
+        layer_generator = HilbertGenerator(order=1, speed=100.0, radius=50.0)
+        layer_generator.next()
+
+        actual = layer_generator.next()
+
+        self.assertCommandEqual(LateralMove([-25.0, 25.0], [-25.0, -25.0], 100.0), actual.commands[0])
+
+    def test_next_only_works_out_curve_when_radius_or_order_changes(self):
+        layer_generator = HilbertGenerator(order=2, speed=100.0, radius=50.0)
+        with patch.object(layer_generator, '_get_hilbert', wraps=layer_generator._get_hilbert) as get_hilbert:
+            layers = [layer_generator.next() for i in range(3)]
+            layer_generator.set_speed(20.0)
+            layers.append(layer_generator.next())
+            self.assertEquals(1, get_hilbert.call_count)
+
+            layer_generator.set_radius(10.0)
+            layer_generator.next()
+            layer_generator._order = 3
+            self.assertEquals(64, len(layer_generator.next()))
+            self.assertEquals(3, get_hilbert.call_count)
+
+        self.assertTrue(layers[1].records is layers[2].records)
+        self.assertEquals([20.0], list(set(layers[3].records['speed'].tolist())))
+        with self.assertRaises(ValueError):
+            layers[0].records['speed'] = 1.0
+
+
+class PatternGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
+    def test_scale_generator_draws_square_from_origin(self):
+        actual = ScaleGenerator(speed=2.0, radius=1.0).next()
+
+        self.assertEquals(ArrayLayer, type(actual))
+        self.assertEquals(400, len(actual))
+        self.assertCommandEqual(LateralDraw([0.0, 1.0], [0.0, 1.0], 2.0), actual.commands[0])
+        self.assertCommandEqual(LateralDraw([1.0, 0.01], [1.0, 0.0], 2.0), actual.commands[200])
+        self.assertCommandEqual(LateralDraw([0.0, 0.98], [0.0, 0.99], 2.0), actual.commands[-1])
+
+    def test_circle_generator_draws_on_from_last_point(self):
+        layer_generator = CircleGenerator(speed=10.0, radius=2.0, steps=4)
+
+        first = layer_generator.next()
+        second = layer_generator.next()
+
+        self.assertCommandsEqual([
+            LateralDraw([0.0, 0.0], [0.0, 2.0], 10.0),
+            LateralDraw([0.0, 2.0], [2.0, 0.0], 10.0),
+            LateralDraw([2.0, 0.0], [0.0, -2.0], 10.0),
+            LateralDraw([0.0, -2.0], [-2.0, 0.0], 10.0),
+            ], first.commands)
+        self.assertCommandEqual(LateralDraw([-2.0, 0.0], [0.0, 2.0], 10.0), second.commands[0])
+        self.assertCommandsEqual(first.commands[1:], second.commands[1:])
+
+    def test_circle_generator_changes_radius(self):
+        layer_generator = CircleGenerator(speed=10.0, radius=2.0, steps=4)
+        layer_generator.next()
+
+        layer_generator.set_radius(1.0)
+        actual = layer_generator.next()
+
+        self.assertCommandEqual(LateralDraw([-2.0, 0.0], [0.0, 1.0], 10.0), actual.commands[0])
+        self.assertCommandEqual(LateralDraw([0.0, -1.0], [-1.0, 0.0], 10.0), actual.commands[-1])
+
+    def test_spiral_generator_moves_to_centre_then_draws_out(self):
+        layer_generator = SpiralGenerator(speed=10.0, radius=5.0, steps=4)
+        layer_generator.next()
+
+        actual = layer_generator.next()
+
+        self.assertEquals(41, len(actual))
+        self.assertEquals([False] + [True] * 40, actual.records['draw'].tolist())
+        self.assertCommandEqual(LateralMove([-4.875, 0.0], [0.0, 0.0], 10.0), actual.commands[0])
+        self.assertCommandEqual(LateralDraw([0.0, 0.0], [0.0, 0.0], 10.0), actual.commands[1])
+        self.assertCommandEqual(LateralDraw([0.0, 0.0], [0.125, 0.0], 10.0), actual.commands[2])
+
+
 class MemoryHourglassTests(unittest.TestCase, test_helpers.TestHelpers):
     def test_can_call_next_and_get_specified_command(self):
         layer_generator = MemoryHourglassGenerator(speed=100.0, radius=50.0)
@@ -223,6 +300,39 @@ class SublayerGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
         with self.assertRaises(StopIteration):
             sublayer_generator.next()
 
+    def test_sublayers_are_new_layers(self):
+        layer1 = Layer(0.0, [LateralDraw([0.0, 0.0], [0.0, 0.0], 100.0)])
+        layer2 = Layer(1.0, [LateralDraw([0.0, 0.0], [0.0, 0.0], 100.0)])
+        sublayer_generator = SubLayerGenerator(StubLayerGenerator([layer1, layer2]), 0.5)
+
+        first = sublayer_generator.next()
+        second = sublayer_generator.next()
+
+        self.assertEquals(0.0, first.z)
+        self.assertEquals(0.5, second.z)
+
+    def test_sublayers_of_array_layers_are_array_layers(self):
+        layer1 = ArrayLayer.from_commands(0.0, [LateralDraw([0.0, 0.0], [1.0, 0.0], 100.0)])
+        layer2 = ArrayLayer.from_commands(1.0, [LateralDraw([0.0, 0.0], [1.0, 0.0], 100.0)])
+        sublayer_generator = SubLayerGenerator(StubLayerGenerator([layer1, layer2]), 0.5)
+
+        layers = [sublayer_generator.next() for i in range(3)]
+
+        self.assertEquals([ArrayLayer] * 3, [type(layer) for layer in layers])
+        self.assertEquals([0.0, 0.5, 1.0], [layer.z for layer in layers])
+        self.assertLayerEquals(Layer(0.5, [LateralDraw([0.0, 0.0], [1.0, 0.0], 100.0)]), layers[1])
+
+
+    def test_sublayers_continue_across_empty_array_layers(self):
+        layer1 = ArrayLayer(0.0)
+        layer2 = ArrayLayer(0.5)
+        layer3 = ArrayLayer.from_commands(1.0, [LateralDraw([0.0, 0.0], [1.0, 0.0], 100.0)])
+        sublayer_generator = SubLayerGenerator(StubLayerGenerator([layer1, layer2, layer3]), 0.1)
+
+        layers = list(sublayer_generator)
+
+        self.assertEquals([x / 10.0 for x in range(0, 11)], [round(layer.z, 6) for layer in layers])
+        self.assertEquals([0] * 10 + [1], [len(layer) for layer in layers])
 
 class ShuffleGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
 
@@ -319,6 +429,18 @@ class ShuffleGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
         with self.assertRaises(StopIteration):
             shuffle_generator.next()
 
+    def test_shuffle_generator_should_shuffle_array_layers(self):
+        commands = [LateralDraw([0.0, 0.0], [float(i), float(i)], 100.0) for i in range(4)]
+        layers = [ArrayLayer.from_commands(i / 10.0, commands) for i in range(3)]
+        shuffle_generator = ShuffleGenerator(StubLayerGenerator(layers), 3)
+
+        actual = [shuffle_generator.next() for i in range(3)]
+
+        self.assertEquals([ArrayLayer] * 3, [type(layer) for layer in actual])
+        self.assertLayerEquals(Layer(0.0, commands), actual[0])
+        self.assertLayerEquals(Layer(0.1, commands[3:] + commands[:3]), actual[1])
+        self.assertLayerEquals(Layer(0.2, commands[2:] + commands[:2]), actual[2])
+
 
 class OverLapGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
     def test_next_should_return_input_when_single_command(self):
@@ -457,6 +579,27 @@ class OverLapGeneratorTests(unittest.TestCase, test_helpers.TestHelpers):
 
         self.assertLayerEquals(expected_layer, actual_layer)
 
+    def test_next_should_overlap_array_layers_the_same_as_layers(self):
+        test_commands = [
+            [LateralDraw([0.0, 0.0], [1.0, 1.0], 100.0)],
+            [LateralDraw([1.0, 1.0], [1.0, 1.0], 100.0), LateralDraw([1.0, 1.0], [11.0, 11.0], 100.0), LateralDraw([11.0, 11.0], [1.0, 1.0], 100.0)],
+            [LateralDraw([0.75, 0.75], [1.0, 1.0], 100.0), LateralDraw([1.0, 1.0], [11.0, 11.0], 90.0), LateralDraw([11.0, 11.0], [0.75, 0.75], 80.0)],
+            [LateralDraw([0.75, 0.75], [1.0, 1.0], 100.0), LateralMove([1.0, 1.0], [11.0, 11.0], 100.0), LateralDraw([11.0, 11.0], [0.75, 0.75], 100.0)],
+            [LateralMove([0.0, 0.0], [1.0, 1.0], 100.0), LateralDraw([1.0, 1.0], [0.0, 0.0], 100.0)],
+            [LateralDraw([0.0, 0.0], [0.2, 0.0], 100.0), LateralDraw([0.2, 0.0], [0.2, 0.2], 100.0), LateralDraw([0.2, 0.2], [0.0, 0.0], 100.0)],
+            ]
+        for overlap in [0.1, 1.0, 3.0]:
+            for commands in test_commands:
+                expected = OverLapGenerator(StubLayerGenerator([Layer(0.0, list(commands))]), overlap).next()
+                actual = OverLapGenerator(StubLayerGenerator([ArrayLayer.from_commands(0.0, commands)]), overlap).next()
+                self.assertEquals(ArrayLayer, type(actual))
+                self.assertLayerEquals(expected, actual)
+
+    def test_next_should_pass_through_empty_array_layers(self):
+        overlap_generator = OverLapGenerator(StubLayerGenerator([ArrayLayer(0.0)]))
+
+        self.assertEquals(0, len(overlap_generator.next()))
+
         # islands
 
 #---------------- Cure Test Generators  -------------------------------------
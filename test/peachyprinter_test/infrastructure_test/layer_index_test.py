@@ -0,0 +1,171 @@
+import unittest
+import StringIO
+import os
+import sys
+import shutil
+import tempfile
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+import test_helpers
+from mock import patch, MagicMock
+
+from peachyprinter.infrastructure.layer_index import LayerIndex
+from peachyprinter.infrastructure.layer_cache import file_hash
+from peachyprinter.infrastructure.gcode_layer_generator import GCodeReader
+from peachyprinter.domain.commands import *
+
+
+class LayerIndexTests(unittest.TestCase, test_helpers.TestHelpers):
+    gcode = "\n".join([
+        "G21",
+        "G1 F6000",
+        "G1 Z0.1",
+        "G1 X1.0 Y1.0 E1",
+        "G1 X2.0 Y1.0",
+        "G1 Z0.2",
+        "G1 X2.0 Y2.0 E2 F3000",
+        "G1 Z0.2",
+        "G1 X3.0 Y2.0 E3",
+        "G1 Z0.5 E4",
+        "G1 X0.0 Y0.0 E5",
+        "G20",
+        "G1 Z0.1",
+        "G1 X1.0 Y1.0 E6",
+        ]) + "\n"
+
+    def setUp(self):
+        self.index_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_path)
+
+    def read(self, gcode, start_height, layer_index=None, batch_size=None):
+        return list(GCodeReader(StringIO.StringIO(gcode), start_height=start_height, batch_size=batch_size, layer_index=layer_index).get_layers())
+
+    def key(self, layer_index, gcode=None, scale=1.0):
+        return layer_index.key(file_hash(StringIO.StringIO(gcode or self.gcode)), scale)
+
+    def indexed(self, gcode=None, scale=1.0, batch_size=None):
+        layer_index = LayerIndex(self.index_path)
+        list(GCodeReader(StringIO.StringIO(gcode or self.gcode), scale=scale, batch_size=batch_size, layer_index=layer_index).get_layers())
+        return layer_index
+
+    def test_find_returns_none_before_file_has_been_read(self):
+        layer_index = LayerIndex(self.index_path)
+
+        self.assertEquals(None, layer_index.find(self.key(layer_index), 0.15))
+
+    def test_find_returns_none_below_first_layer(self):
+        layer_index = self.indexed()
+
+        self.assertEquals(None, layer_index.find(self.key(layer_index), 0.05))
+
+    def test_find_returns_offset_line_and_state_of_layer(self):
+        layer_index = self.indexed()
+
+        resume = layer_index.find(self.key(layer_index), 0.15)
+
+        self.assertEquals(self.gcode.index("G1 Z0.1"), resume['offset'])
+        self.assertEquals(2, resume['line_number'])
+        self.assertEquals({'xy': [0.0, 0.0], 'mm_per_s': 100.0, 'z_pos': 0.0, 'layer_height': None, 'units': 'mm'}, resume['state'])
+
+    def test_batched_read_records_same_index(self):
+        expected = self.indexed()
+        expected_index = expected.get(self.key(expected))
+        shutil.rmtree(self.index_path)
+
+        actual = self.indexed(batch_size=4)
+
+        self.assertEquals(expected_index.tobytes(), actual.get(self.key(actual)).tobytes())
+
+    def test_find_returns_first_of_repeated_heights(self):
+        layer_index = self.indexed()
+
+        self.assertEquals(5, layer_index.find(self.key(layer_index), 0.2)['line_number'])
+
+    def test_resumed_layers_match_full_read(self):
+        for batch_size in [None, 4]:
+            layer_index = self.indexed(batch_size=batch_size)
+            for start_height in [0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.5, 2.0, 2.54, 3.0]:
+                expected = self.read(self.gcode, start_height, batch_size=batch_size)
+                actual = self.read(self.gcode, start_height, layer_index, batch_size=batch_size)
+                self.assertLayersEquals(expected, actual)
+
+    def test_resumed_layers_match_full_read_with_windows_line_endings(self):
+        gcode = self.gcode.replace("\n", "\r\n")
+        layer_index = self.indexed(gcode)
+        for start_height in [0.15, 0.25, 3.0]:
+            expected = self.read(gcode, start_height)
+            actual = self.read(gcode, start_height, layer_index)
+            self.assertLayersEquals(expected, actual)
+
+    def test_resumed_errors_use_file_line_numbers(self):
+        gcode = self.gcode + "Fake Gcode\n"
+        layer_index = self.indexed(gcode)
+        layers = GCodeReader(StringIO.StringIO(gcode), start_height=2.0, layer_index=layer_index).get_layers()
+        list(layers)
+
+        self.assertEquals(["Error 15: Unsupported Command: Fake Gcode"], layers.errors)
+
+    def test_resume_seeks_to_indexed_layer(self):
+        layer_index = self.indexed()
+        test_gcode = StringIO.StringIO(self.gcode)
+
+        layers = GCodeReader(test_gcode, start_height=0.3, layer_index=layer_index).get_layers()
+        offset = test_gcode.tell()
+
+        self.assertEquals(self.gcode.index("G1 Z0.2"), offset)
+        self.assertEquals(0.5, layers.next().z)
+
+    def test_index_is_recorded_once_from_a_full_read(self):
+        layer_index = self.indexed()
+
+        with patch.object(LayerIndex, '_store') as mock_store:
+            self.read(self.gcode, 0.0, layer_index)
+            self.read(self.gcode, 0.3, layer_index)
+            self.assertFalse(mock_store.called)
+
+    def test_index_is_not_recorded_by_a_partial_read(self):
+        layer_index = LayerIndex(self.index_path)
+
+        next(iter(GCodeReader(StringIO.StringIO(self.gcode), layer_index=layer_index).get_layers()))
+
+        self.assertEquals(None, layer_index.get(self.key(layer_index)))
+
+    def test_index_depends_on_scale(self):
+        layer_index = self.indexed()
+        self.indexed(scale=2.0)
+
+        self.assertEquals(5, layer_index.find(self.key(layer_index), 0.3)['line_number'])
+        self.assertEquals(2, layer_index.find(self.key(layer_index, scale=2.0), 0.3)['line_number'])
+
+    def test_least_recently_used_indexes_are_evicted(self):
+        layer_index = LayerIndex(self.index_path, max_entries=2)
+        for extra in ["", "G1 X1.0 Y1.0\n", "G1 X2.0 Y2.0\n"]:
+            self.read(self.gcode + extra, 0.0, layer_index)
+
+        self.assertEquals(2, len(os.listdir(self.index_path)))
+
+    def test_gcode_reader_reads_from_start_when_index_fails(self):
+        layer_index = MagicMock()
+        layer_index.find.side_effect = IOError("Not seekable")
+        expected = self.read(self.gcode, 0.3)
+
+        actual = self.read(self.gcode, 0.3, layer_index)
+
+        self.assertLayersEquals(expected, actual)
+
+    def test_gcode_reader_does_not_use_index_from_bottom(self):
+        layer_index = MagicMock()
+
+        self.read(self.gcode, 0.0, layer_index)
+
+        self.assertFalse(layer_index.find.called)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()
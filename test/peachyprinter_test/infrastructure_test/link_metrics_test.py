@@ -0,0 +1,96 @@
+import unittest
+import sys
+import os
+import json
+import StringIO
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+from peachyprinter.infrastructure.link_metrics import LinkMetrics
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class LinkMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = LinkMetrics(window_seconds=2.0, clock=self.clock)
+
+    def test_empty_snapshot(self):
+        self.clock.now += 1.0
+
+        snapshot = self.metrics.snapshot()
+
+        self.assertEquals(0.0, snapshot['packets_per_second'])
+        self.assertEquals(0.0, snapshot['bytes_per_second'])
+        self.assertEquals(None, snapshot['write_latency_us']['mean'])
+        self.assertEquals(None, snapshot['queue_fill'])
+        self.assertEquals([], snapshot['detach_events'])
+
+    def test_rates_are_over_the_window(self):
+        self.clock.now += 1.0
+        self.metrics.record_write(10, 100, 0.0002)
+        self.metrics.record_write(30, 300, 0.003)
+        self.clock.now += 1.0
+
+        snapshot = self.metrics.snapshot()
+
+        self.assertEquals(2.0, snapshot['window_seconds'])
+        self.assertEquals(20.0, snapshot['packets_per_second'])
+        self.assertEquals(200.0, snapshot['bytes_per_second'])
+        self.assertEquals(1.0, snapshot['writes_per_second'])
+        self.assertAlmostEquals(0.0016, snapshot['write_busy_fraction'])
+        self.assertEquals([0, 0, 1, 0, 0, 0, 1, 0, 0, 0], snapshot['write_latency_us']['counts'])
+        self.assertAlmostEquals(3000.0, snapshot['write_latency_us']['max'])
+
+    def test_old_events_leave_the_window_but_totals_remain(self):
+        self.metrics.record_write(10, 100, 0.001)
+        self.metrics.record_detach("Gone")
+        self.clock.now += 3.0
+        self.metrics.record_write(5, 50, 0.001)
+
+        snapshot = self.metrics.snapshot()
+
+        self.assertEquals(2.5, snapshot['packets_per_second'])
+        self.assertEquals([], snapshot['detach_events'])
+        self.assertEquals(15, snapshot['total_packets'])
+        self.assertEquals(150, snapshot['total_bytes'])
+        self.assertEquals(1, snapshot['total_detach_events'])
+
+    def test_queue_fill_is_latest_and_max(self):
+        self.metrics.record_queue(6, 8)
+        self.metrics.record_queue(2, 8)
+
+        snapshot = self.metrics.snapshot()
+
+        self.assertEquals(0.25, snapshot['queue_fill'])
+        self.assertEquals(0.75, snapshot['queue_fill_max'])
+
+    def test_detach_events_are_reported(self):
+        self.metrics.record_detach(Exception("Printer Gone"))
+
+        self.assertEquals(["Printer Gone"], self.metrics.snapshot()['detach_events'])
+
+    def test_export_writes_json_lines(self):
+        output = StringIO.StringIO()
+        self.metrics.record_write(10, 100, 0.001)
+
+        self.metrics.export(output)
+        self.metrics.export(output)
+
+        lines = output.getvalue().splitlines()
+        self.assertEquals(2, len(lines))
+        self.assertEquals(10, json.loads(lines[0])['total_packets'])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import sys
+import os
+import time
+import logging
+from threading import Thread
+from mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+from peachyprinter.libraries import load_library
+from peachyprinter.infrastructure import peachyusb
+from peachyprinter.infrastructure.loopback_usb import LoopbackDevice, LoopbackLibrary
+from peachyprinter.infrastructure.communicator import UsbPacketCommunicator, MissingPrinterException
+from peachyprinter.infrastructure.messages import *
+
+
+class LoopbackDeviceTest(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        self.devices = []
+
+    def tearDown(self):
+        for device in self.devices:
+            device.shutdown()
+
+    def device(self, capacity=50, **options):
+        options.setdefault('status_interval', 0)
+        device = LoopbackDevice(capacity, **options)
+        device.set_read_callback(lambda data, length: self.received.append(data[:length]))
+        self.devices.append(device)
+        return device
+
+    def frame(self, message):
+        data = chr(message.TYPE_ID) + message.get_bytes()
+        return chr(len(data)) + data
+
+    def replies(self, message_type):
+        return [message_type.from_bytes(data[1:]) for data in list(self.received) if ord(data[0]) == message_type.TYPE_ID]
+
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertTrue(condition())
+
+    def test_consumes_move_packets(self):
+        device = self.device(samples_per_second=0)
+
+        for x in range(100):
+            device.write(self.frame(MoveMessage(x, x, 255)))
+
+        self.assertTrue(device.drain(2.0))
+        self.assertEquals(100, device.samples)
+        self.assertEquals(100, device.packets)
+
+    def test_consumes_move_packets_at_samples_per_second(self):
+        device = self.device(capacity=1000, samples_per_second=1000)
+        start = time.time()
+
+        for x in range(200):
+            device.write(self.frame(MoveMessage(x, x, 255)))
+        device.drain(2.0)
+
+        self.assertTrue(time.time() - start >= 0.19)
+        self.assertEquals(200, device.samples)
+
+    def test_write_blocks_while_full(self):
+        device = self.device(capacity=2, samples_per_second=1)
+        writer = Thread(target=lambda: [device.write(self.frame(MoveMessage(1, 1, 255))) for i in range(3)])
+        writer.daemon = True
+
+        writer.start()
+        time.sleep(0.05)
+
+        self.assertTrue(writer.is_alive())
+        self.assertEquals(2, device.depth())
+        device.shutdown()
+        writer.join(1.0)
+        self.assertFalse(writer.is_alive())
+
+    def test_answers_identify(self):
+        device = self.device(data_rate=8000, serial_number='SN1')
+
+        device.write(self.frame(IdentifyMessage()))
+
+        self.wait_for(lambda: self.replies(IAmMessage))
+        self.assertEquals(IAmMessage('loopback', 'loopback', 'SN1', 8000), self.replies(IAmMessage)[0])
+
+    def test_reports_drips_from_drip_count(self):
+        device = self.device(drips_per_second=1000)
+        self.wait_for(lambda: [message for message in self.replies(DripRecordedMessage) if message.drips > 50])
+        reported = len(self.replies(DripRecordedMessage))
+
+        device.write(self.frame(SetDripCountMessage(0)))
+
+        self.wait_for(lambda: [message for message in self.replies(DripRecordedMessage)[reported:] if message.drips < 50])
+
+    def test_sends_printer_status(self):
+        device = self.device(status_interval=0.01)
+
+        device.write(self.frame(MoveMessage(1, 1, 255)))
+
+        self.wait_for(lambda: [message for message in self.replies(PrinterStatusMessage) if message.laserOn])
+
+
+class LoopbackLibraryTest(unittest.TestCase):
+    def test_load_library_returns_loopback_when_selected(self):
+        environment = {'PEACHY_API_DLL_PATH': 'loopback', 'PEACHY_LOOPBACK_SAMPLES_PER_SECOND': '500', 'PEACHY_LOOPBACK_DRIPS_PER_SECOND': '2.5'}
+        with patch.dict(os.environ, environment):
+            library = load_library('libPeachyUSB')
+
+        self.assertTrue(isinstance(library, LoopbackLibrary))
+        self.assertEquals({'samples_per_second': 500, 'drips_per_second': 2.5}, library.device_options)
+        self.assertEquals('loopback', library.peachyusb_version())
+
+    def test_missing_printer_when_not_attached(self):
+        library = LoopbackLibrary(attached=False)
+        with patch.object(peachyusb, 'lib', library):
+            with self.assertRaises(MissingPrinterException):
+                UsbPacketCommunicator(50).start()
+
+    def test_communicator_round_trip(self):
+        library = LoopbackLibrary(samples_per_second=0, status_interval=0)
+        replies = []
+        with patch.object(peachyusb, 'lib', library):
+            with patch.object(peachyusb, '_write_address', peachyusb._address_writer(library)):
+                communicator = UsbPacketCommunicator(50)
+                communicator.start()
+                communicator.register_handler(IAmMessage, replies.append)
+
+                communicator.send(IdentifyMessage())
+                communicator.send_frames(MoveMessage.frames(range(300), range(300), [255] * 300))
+                library.device.drain(2.0)
+                deadline = time.time() + 2.0
+                while not replies and time.time() < deadline:
+                    time.sleep(0.001)
+                communicator.close()
+
+        self.assertEquals(300, library.device.samples)
+        self.assertEquals(1, len(replies))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='INFO')
+    unittest.main()
@@ -60,6 +60,14 @@ class MachineStatusTests(unittest.TestCase):
 
         self.assertEqual(1, status.status()['skipped_layers'])
 
+    def test_layer_queue_call_back_updates_layer_queue_depth(self):
+        status = MachineStatus()
+        self.assertEqual(0, status.status()['layer_queue_depth'])
+
+        status.layer_queue_call_back(3)
+
+        self.assertEqual(3, status.status()['layer_queue_depth'])
+
     def test_status_is_starting_before_first_drip(self):
         status = MachineStatus()
         self.assertEqual('Starting', status.status()['status'])
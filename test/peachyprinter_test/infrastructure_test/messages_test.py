@@ -18,6 +18,21 @@ class MoveMesssageTests(unittest.TestCase):
         decoded_message = MoveMessage.from_bytes(proto_bytes)
         self.assertEqual(inital_message, decoded_message)
 
+    def test_frames_match_framed_get_bytes(self):
+        messages = [MoveMessage(x, y, laser_power) for (x, y, laser_power) in [
+            (0, 0, 0), (1, 127, 255), (128, 16383, 127), (16384, 262143, 1), (-1, 300, 128), (-262143, 5, 0)]]
+        expected = ''.join(chr(len(message.get_bytes()) + 1) + chr(MoveMessage.TYPE_ID) + message.get_bytes() for message in messages)
+
+        actual = MoveMessage.frames(
+            [message.x_pos for message in messages],
+            [message.y_pos for message in messages],
+            [message.laser_power for message in messages])
+
+        self.assertEqual(expected, actual)
+
+    def test_frames_of_nothing_is_empty(self):
+        self.assertEqual('', MoveMessage.frames([], [], []))
+
 
 class DripRecordedMesssageTests(unittest.TestCase):
 
@@ -17,9 +17,13 @@ from peachyprinter.infrastructure.messages import MoveMessage
 class MicroDisseminatorTests(unittest.TestCase, TestHelpers):
     def setUp(self):
         self.max_value = pow(2, MicroDisseminator.BIT_DEPTH) - 1
-        self.mock_comm = MagicMock()
+        self.mock_comm = MagicMock(spec=['send', 'close'])
+        self.mock_frames_comm = MagicMock(spec=['send', 'send_frames', 'close'])
         self.laser_control = LaserControl()
 
+    def framed(self, messages):
+        return ''.join(chr(len(message.get_bytes()) + 1) + chr(message.TYPE_ID) + message.get_bytes() for message in messages)
+
     def test_samples_per_second_is_data_rate(self):
         expected_samples_per_second = 8000
         micro_disseminator = MicroDisseminator(LaserControl(), MagicMock(), expected_samples_per_second)
@@ -76,6 +80,120 @@ class MicroDisseminatorTests(unittest.TestCase, TestHelpers):
             call(MoveMessage(self.max_value, self.max_value / 2, 255)),
             ])
 
+    def test_process_points_should_set_laser_power_per_point(self):
+        laser_control = LaserControl(0.5)
+        sample_data_chunk = numpy.array([(0.0, 1.0), (0.5, 0.0), (1.0, 0.5)])
+        micro_disseminator = MicroDisseminator(laser_control, self.mock_comm, 8000)
+        micro_disseminator.process_points(sample_data_chunk, numpy.array([True, False, True]))
+        self.mock_comm.send.assert_has_calls([
+            call(MoveMessage(0,     self.max_value, 127)),
+            call(MoveMessage(self.max_value / 2, 0,     0)),
+            call(MoveMessage(self.max_value, self.max_value / 2, 127)),
+            ])
+        self.assertFalse(laser_control.laser_is_on())
+
+    def test_process_points_should_handle_empty_lists(self):
+        micro_disseminator = MicroDisseminator(self.laser_control, self.mock_comm, 8000)
+        micro_disseminator.process_points(numpy.empty((0, 2)), numpy.empty(0, dtype=bool))
+        self.assertEqual(0, self.mock_comm.send.call_count)
+
+    def test_process_should_send_one_buffer_of_frames_when_supported(self):
+        self.laser_control.set_laser_on()
+        sample_data_chunk = numpy.array([(0.0, 1.0), (0.5, 0.0), (1.0, 0.5)])
+        micro_disseminator = MicroDisseminator(self.laser_control, self.mock_frames_comm, 8000)
+        micro_disseminator.process(sample_data_chunk)
+        self.mock_frames_comm.send_frames.assert_called_once_with(self.framed([
+            MoveMessage(0,     self.max_value, 255),
+            MoveMessage(self.max_value / 2, 0,     255),
+            MoveMessage(self.max_value, self.max_value / 2, 255),
+            ]), 3)
+        self.assertEqual(0, self.mock_frames_comm.send.call_count)
+
+    def test_process_points_should_send_one_buffer_of_frames_when_supported(self):
+        laser_control = LaserControl(0.5)
+        sample_data_chunk = numpy.array([(0.0, 1.0), (0.5, 0.0), (1.0, 0.5)])
+        micro_disseminator = MicroDisseminator(laser_control, self.mock_frames_comm, 8000)
+        micro_disseminator.process_points(sample_data_chunk, numpy.array([True, False, True]))
+        self.mock_frames_comm.send_frames.assert_called_once_with(self.framed([
+            MoveMessage(0,     self.max_value, 127),
+            MoveMessage(self.max_value / 2, 0,     0),
+            MoveMessage(self.max_value, self.max_value / 2, 127),
+            ]), 3)
+
+    def test_process_should_not_send_frames_for_empty_lists(self):
+        micro_disseminator = MicroDisseminator(self.laser_control, self.mock_frames_comm, 8000)
+        micro_disseminator.process(numpy.array([]))
+        micro_disseminator.process_points(numpy.empty((0, 2)), numpy.empty(0, dtype=bool))
+        self.assertEqual(0, self.mock_frames_comm.send_frames.call_count)
+
+    def test_encode_points_gives_frames_that_process_points_would_send(self):
+        laser_control = LaserControl(0.5)
+        sample_data_chunk = numpy.array([(0.0, 1.0), (0.5, 0.0), (1.0, 0.5)])
+        laser_on = numpy.array([True, False, True])
+        micro_disseminator = MicroDisseminator(laser_control, self.mock_frames_comm, 8000)
+
+        frames = micro_disseminator.encode_points(sample_data_chunk, laser_on)
+        micro_disseminator.send_encoded(frames, len(sample_data_chunk))
+        micro_disseminator.process_points(sample_data_chunk, laser_on)
+
+        self.assertEqual(2, self.mock_frames_comm.send_frames.call_count)
+        self.assertEqual(self.mock_frames_comm.send_frames.call_args_list[0], self.mock_frames_comm.send_frames.call_args_list[1])
+
+    def test_encode_points_is_none_when_frames_not_supported(self):
+        micro_disseminator = MicroDisseminator(self.laser_control, self.mock_comm, 8000)
+
+        self.assertEqual(None, micro_disseminator.encode_points(numpy.array([(0.0, 1.0)]), numpy.array([True])))
+
+    def test_encoder_encodes_with_its_own_laser_control_and_cannot_send(self):
+        laser_control = LaserControl(0.5)
+        micro_disseminator = MicroDisseminator(self.laser_control, self.mock_frames_comm, 8000)
+        encoder = micro_disseminator.encoder(laser_control)
+        sample_data_chunk = numpy.array([(0.0, 1.0), (0.5, 0.0)])
+        laser_on = numpy.array([True, False])
+
+        self.assertEqual(self.framed([MoveMessage(0, self.max_value, 127), MoveMessage(self.max_value / 2, 0, 0)]), encoder.encode_points(sample_data_chunk, laser_on))
+        self.assertEqual(8000, encoder.samples_per_second)
+        with self.assertRaises(Exception):
+            encoder.send_encoded(encoder.encode_points(sample_data_chunk, laser_on))
+        self.assertEqual(0, self.mock_frames_comm.send_frames.call_count)
+
+    def test_hold_sends_laser_off_frames_for_seconds(self):
+        self.laser_control.set_laser_on()
+        micro_disseminator = MicroDisseminator(self.laser_control, self.mock_frames_comm, 100)
+        micro_disseminator.hold([0.5, 1.0], 0.05)
+        self.mock_frames_comm.send_frames.assert_called_once_with(self.framed([MoveMessage(self.max_value / 2, self.max_value, 0)] * 5), 5)
+
+    def test_hold_sends_messages_when_frames_not_supported(self):
+        micro_disseminator = MicroDisseminator(self.laser_control, self.mock_comm, 100)
+        micro_disseminator.hold([0.5, 1.0], 0.05)
+        self.assertEqual([call(MoveMessage(self.max_value / 2, self.max_value, 0))] * 5, self.mock_comm.send.call_args_list)
+
+    def test_discard_leaves_laser_off_at_last_position_sent(self):
+        communicator = MagicMock(spec=['send', 'send_frames', 'discard', 'close'])
+        self.laser_control.set_laser_on()
+        micro_disseminator = MicroDisseminator(self.laser_control, communicator, 8000)
+        micro_disseminator.process([[0.0, 0.0], [0.5, 1.0]])
+
+        micro_disseminator.discard()
+
+        communicator.discard.assert_called_once_with(self.framed([MoveMessage(self.max_value / 2, self.max_value, 0)]), 1)
+
+    def test_discard_does_nothing_when_communicator_cannot_discard(self):
+        micro_disseminator = MicroDisseminator(self.laser_control, self.mock_frames_comm, 8000)
+
+        micro_disseminator.discard()
+
+        self.assertEqual(0, self.mock_frames_comm.send_frames.call_count)
+
+    def test_flush_waits_on_communicator(self):
+        communicator = MagicMock(spec=['send', 'send_frames', 'flush', 'close'])
+        communicator.flush.return_value = False
+        micro_disseminator = MicroDisseminator(self.laser_control, communicator, 8000)
+
+        self.assertFalse(micro_disseminator.flush(2.0))
+        communicator.flush.assert_called_once_with(2.0)
+        self.assertTrue(MicroDisseminator(self.laser_control, self.mock_comm, 8000).flush(2.0))
+
     def test_close_calls_close_on_communicator(self):
         micro_disseminator = MicroDisseminator(self.laser_control, self.mock_comm, 8000)
         micro_disseminator.close()
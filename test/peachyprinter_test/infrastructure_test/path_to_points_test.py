@@ -2,6 +2,7 @@ import unittest
 import sys
 import os
 import numpy
+from mock import patch
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
@@ -95,6 +96,124 @@ class PathToPointsTests(unittest.TestCase, TestHelpers):
         self.assertNumpyArrayEquals(expected1, actual1)
         self.assertNumpyArrayEquals(expected2, actual2)
 
+    def test_process_segments_returns_points_of_each_segment_with_counts(self):
+        path2audio = PathToPoints(10, self.transformer, 0.5)
+        starts = numpy.array([[0.0, 0.0, 1.0], [0.0, 1.0, 1.0], [1.0, 1.0, 1.0]])
+        ends = numpy.array([[0.0, 1.0, 1.0], [1.0, 1.0, 1.0], [1.0, 3.0, 1.0]])
+        speeds = numpy.array([10.0, 10.0, 5.0])
+        expected_points = numpy.array([[0.0, 0.0], [1.0, 1.0], [1.0, 1.0], [1.0, 5.0 / 3.0], [1.0, 7.0 / 3.0], [1.0, 3.0]])
+
+        points, counts = path2audio.process_segments(starts, ends, speeds)
+
+        self.assertEquals([0, 2, 4], counts.tolist())
+        self.assertNumpyArrayClose(expected_points, points)
+
+    def test_process_segments_handles_no_segments(self):
+        path2audio = PathToPoints(10, self.transformer, 0.5)
+
+        points, counts = path2audio.process_segments(numpy.empty((0, 3)), numpy.empty((0, 3)), numpy.empty(0))
+
+        self.assertEquals((0, 2), points.shape)
+        self.assertEquals(0, len(counts))
+
+
+    def get_segments(self, count=2000, seed=7):
+        random = numpy.random.RandomState(seed)
+        heights = numpy.repeat([1.0, 1.0, 1.1, 1.05, 1.2], count // 5)[:count]
+        xy = numpy.cumsum(random.uniform(-0.2, 0.2, (count + 1, 2)), axis=0)
+        xy[random.rand(count + 1) < 0.05] = 0.0
+        starts = numpy.column_stack((xy[:-1], heights))
+        ends = numpy.column_stack((xy[1:], heights))
+        starts[1::7] = ends[:-1:7]
+        speeds = random.choice([0.5, 5.0, 50.0], count)
+        return (starts, ends, speeds)
+
+    def assertSegmentsMatchProcess(self, transformer, starts, ends, speeds, splits):
+        expected = PathToPoints(100, transformer, 0.5)
+        actual = PathToPoints(100, transformer, 0.5)
+        expected_paths = [expected.process(start, end, speed) for (start, end, speed) in zip(starts.tolist(), ends.tolist(), speeds.tolist())]
+        actual_points = []
+        actual_counts = []
+        for (first, last) in zip([0] + splits, splits + [len(speeds)]):
+            points, counts = actual.process_segments(starts[first:last], ends[first:last], speeds[first:last])
+            actual_points.append(points)
+            actual_counts.append(counts)
+
+        self.assertEquals([len(path) for path in expected_paths], numpy.concatenate(actual_counts).tolist())
+        self.assertNumpyArrayEquals(numpy.concatenate(expected_paths), numpy.concatenate(actual_points))
+        self.assertEquals(expected._left_over_samples, actual._left_over_samples)
+        self.assertEquals(expected._left_over_start, actual._left_over_start)
+        self.assertEquals(expected._last_z, actual._last_z)
+
+    def test_process_segments_matches_process(self):
+        starts, ends, speeds = self.get_segments()
+
+        self.assertSegmentsMatchProcess(self.transformer, starts, ends, speeds, [])
+
+    def test_process_segments_carries_left_over_samples_between_calls(self):
+        starts, ends, speeds = self.get_segments()
+
+        self.assertSegmentsMatchProcess(self.transformer, starts, ends, speeds, [1, 2, 3, 50, 51, 401, 997, 1500])
+
+    def test_process_segments_matches_process_with_transformer(self):
+        starts, ends, speeds = self.get_segments(count=500)
+
+        self.assertSegmentsMatchProcess(TuningTransformer(scale=0.5), starts / 100.0, ends / 100.0, speeds / 100.0, [250])
+
+    def test_advance_segments_leaves_carry_state_of_process_segments(self):
+        starts, ends, speeds = self.get_segments()
+        expected = PathToPoints(100, self.transformer, 0.5)
+        actual = PathToPoints(100, self.transformer, 0.5)
+
+        expected.process_segments(starts, ends, speeds)
+        actual.advance_segments(starts, ends, speeds)
+
+        self.assertEquals(expected.carry_state(), actual.carry_state())
+
+    def test_copy_keeps_settings_and_carry_state(self):
+        path2audio = PathToPoints(10, self.transformer, 0.5)
+        path2audio.process([0.0, 0.0, 1.0], [0.0, 1.0, 1.0], 10.0)
+        state = path2audio.carry_state()
+
+        copied = path2audio.copy()
+        copied_points = copied.process([0.0, 1.0, 1.0], [1.0, 1.0, 1.0], 10.0)
+
+        self.assertEquals(10, copied.samples_per_second)
+        self.assertEquals(0.5, copied.laser_size)
+        self.assertEquals(state, path2audio.carry_state())
+        self.assertNumpyArrayEquals(path2audio.process([0.0, 1.0, 1.0], [1.0, 1.0, 1.0], 10.0), copied_points)
+
+    def test_process_segments_picks_up_left_over_samples_from_process(self):
+        path2audio = PathToPoints(10, self.transformer, 0.5)
+        expected = numpy.array([[0.0, 0.0], [1.0, 1.0]])
+
+        path2audio.process([0.0, 0.0, 1.0], [0.0, 1.0, 1.0], 10.0)
+        points, counts = path2audio.process_segments(numpy.array([[0.0, 1.0, 1.0]]), numpy.array([[1.0, 1.0, 1.0]]), numpy.array([10.0]))
+
+        self.assertEquals([2], counts.tolist())
+        self.assertNumpyArrayEquals(expected, points)
+
+    def test_process_segments_reports_complex_data_once_per_height(self):
+        path2audio = PathToPoints(10, self.transformer, 0.5)
+        starts = numpy.array([[0.0, 0.0, 1.0], [0.0, 0.1, 1.0], [0.0, 0.0, 1.0], [0.0, 0.0, 1.1]])
+        ends = numpy.array([[0.0, 0.1, 1.0], [0.0, 0.2, 1.0], [5.0, 0.0, 1.0], [0.0, 0.1, 1.1]])
+
+        with patch('peachyprinter.infrastructure.path_to_points.logger') as mock_logger:
+            path2audio.process_segments(starts, ends, numpy.array([10.0, 10.0, 10.0, 10.0]))
+
+        self.assertEquals(2, mock_logger.info.call_count)
+
+    def test_restore_carry_state_undoes_processing(self):
+        path2audio = PathToPoints(10, self.transformer, 0.5)
+        path2audio.process([0.0, 0.0, 1.0], [0.0, 0.1, 1.0], 10.0)
+        state = path2audio.carry_state()
+        expected = path2audio.process([0.0, 0.1, 1.0], [1.0, 1.0, 1.0], 10.0)
+
+        path2audio.restore_carry_state(state)
+        path2audio.process_segments(numpy.array([[5.0, 5.0, 2.0]]), numpy.array([[5.0, 5.1, 2.0]]), numpy.array([10.0]))
+        path2audio.restore_carry_state(state)
+
+        self.assertNumpyArrayEquals(expected, path2audio.process([0.0, 0.1, 1.0], [1.0, 1.0, 1.0], 10.0))
 
 if __name__ == '__main__':
     unittest.main()
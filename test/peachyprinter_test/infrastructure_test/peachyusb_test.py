@@ -0,0 +1,132 @@
+import unittest
+import sys
+import os
+import logging
+import ctypes
+import subprocess
+from mock import patch, MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+from peachyprinter.infrastructure import peachyusb
+from peachyprinter.infrastructure.peachyusb import PeachyUSB, PeachyUSBException
+from peachyprinter.infrastructure.messages import MoveMessage
+
+
+@patch('peachyprinter.infrastructure.peachyusb.lib')
+class PeachyUSBTest(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        patcher = patch('peachyprinter.infrastructure.peachyusb._write_address', side_effect=self.record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, context, address, length):
+        self.written.append(ctypes.string_at(address, length))
+
+    def test_write_many_writes_each_packet_from_str(self, mock_lib):
+        frames = MoveMessage.frames([1, 200000, 3], [4, 5, 6], [255, 0, 127])
+
+        packets = PeachyUSB(50).write_many(frames)
+
+        self.assertEquals(3, packets)
+        self.assertEquals(3, len(self.written))
+        self.assertEquals(frames, ''.join(self.written))
+        self.assertEquals(ord(frames[0]) + 1, len(self.written[0]))
+
+    def test_write_many_accepts_bytearray_and_memoryview(self, mock_lib):
+        frames = MoveMessage.frames([1, 2], [4, 5], [255, 0])
+
+        PeachyUSB(50).write_many(bytearray(frames))
+        PeachyUSB(50).write_many(memoryview(bytearray(frames)))
+
+        self.assertEquals(frames * 2, ''.join(self.written))
+
+    def test_write_many_raises_on_truncated_packet(self, mock_lib):
+        frames = MoveMessage.frames([1, 2], [4, 5], [255, 0])
+
+        with self.assertRaises(PeachyUSBException) as context:
+            PeachyUSB(50).write_many(frames[:-1])
+        self.assertEquals(PeachyUSB.MALFORMED_PACKET, context.exception.value)
+
+    def test_init_raises_when_no_printer_found(self, mock_lib):
+        mock_lib.peachyusb_init.return_value = None
+
+        with self.assertRaises(PeachyUSBException):
+            PeachyUSB(50)
+
+
+
+@patch('peachyprinter.infrastructure.peachyusb._load_library')
+class LibraryLoadTest(unittest.TestCase):
+    def setUp(self):
+        for (name, value) in [('lib', None), ('_write_address', None), ('_load_error', None)]:
+            patcher = patch.object(peachyusb, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_library_is_loaded_once_on_first_use(self, mock_load_library):
+        PeachyUSB(50)
+        PeachyUSB(50)
+
+        self.assertEquals(1, mock_load_library.call_count)
+        self.assertEquals(mock_load_library.return_value, peachyusb.lib)
+
+    def test_load_failure_is_kept(self, mock_load_library):
+        mock_load_library.side_effect = OSError("libPeachyUSB.so: cannot open shared object file")
+
+        for attempt in range(2):
+            with self.assertRaises(PeachyUSBException):
+                PeachyUSB(50)
+
+        self.assertEquals(1, mock_load_library.call_count)
+
+
+class ImportTest(unittest.TestCase):
+    IMPORT_BUDGET_SECONDS = 1.0
+
+    def import_peachyprinter(self):
+        src = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join([src] + [path for path in [os.environ.get('PYTHONPATH')] if path])
+        script = "; ".join([
+            "import sys, time",
+            "start = time.time()",
+            "import peachyprinter",
+            "print('%s %s' % (time.time() - start, sys.modules['peachyprinter.infrastructure.peachyusb'].lib is None))",
+            ])
+        output = subprocess.check_output([sys.executable, '-c', script], env=environment)
+        (seconds, lazy) = output.split()[-2:]
+        return (float(seconds), lazy == 'True')
+
+    def test_import_does_not_load_native_library(self):
+        (seconds, lazy) = self.import_peachyprinter()
+
+        self.assertTrue(lazy)
+
+    def test_import_is_within_budget(self):
+        seconds = min(self.import_peachyprinter()[0] for attempt in range(3))
+
+        self.assertTrue(seconds < self.IMPORT_BUDGET_SECONDS, "import peachyprinter took %.3fs, budget is %.3fs" % (seconds, self.IMPORT_BUDGET_SECONDS))
+
+    def test_lib_version_is_loaded_when_first_used(self):
+        src = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join([src] + [path for path in [os.environ.get('PYTHONPATH')] if path])
+        environment['PEACHY_API_DLL_PATH'] = 'loopback'
+        script = "; ".join([
+            "import sys",
+            "import peachyprinter",
+            "lazy = sys.modules['peachyprinter.infrastructure.peachyusb'].lib is None",
+            "from peachyprinter import lib_version",
+            "print('%s %s %s' % (lazy, lib_version, peachyprinter.get_lib_version()))",
+            ])
+        output = subprocess.check_output([sys.executable, '-c', script], env=environment)
+
+        self.assertEquals(['True', 'loopback', 'loopback'], output.split()[-3:])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
@@ -3,7 +3,10 @@ import StringIO
 import os
 import sys
 import time
+import shutil
+import tempfile
 import logging
+import numpy
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
@@ -14,6 +17,17 @@ from mock import patch
 from peachyprinter.infrastructure.gcode_layer_generator import GCodeReader, GCodeToLayerGenerator, GCodeCommandReader
 from peachyprinter.infrastructure.layer_generators import *
 from peachyprinter.infrastructure.transformer import *
+from peachyprinter.infrastructure.point_transformer import PointTransformer
+from peachyprinter.infrastructure import print_test_layer_generators
+from peachyprinter.infrastructure.path_to_points import PathToPoints
+from peachyprinter.infrastructure.messages import MoveMessage
+from peachyprinter.infrastructure.communicator import UsbPacketCommunicator
+from peachyprinter.infrastructure.micro_disseminator import MicroDisseminator
+from peachyprinter.infrastructure import peachyusb
+import peachyprinter.config as config
+from peachyprinter.infrastructure.configuration import ConfigurationGenerator
+from peachyprinter.api.print_api import PrintAPI
+from peachyprinter.domain.laser_control import LaserControl
 from peachyprinter.domain.commands import * 
 
 # class GcodeUnifiedPerformanceTest(unittest.TestCase):
@@ -141,6 +155,55 @@ from peachyprinter.domain.commands import *
 #         print("Mean: %s" % (sum(layer_times) / len(layer_times) * 1.0))
 #         afile.close()
 
+class GCodeBatchPerformanceTest(unittest.TestCase):
+    def get_gcode(self, layers=50, lines_per_layer=4000):
+        gcode = ["G21", "G90", "M107", "G1 F6000"]
+        for layer in range(1, layers + 1):
+            gcode.append("G1 Z%.3f F6000" % (layer * 0.1))
+            for line in range(lines_per_layer):
+                gcode.append("G1 X%.3f Y%.3f E%.5f" % (line % 97 * 0.5, line % 89 * 0.5, line * 0.01))
+            gcode.append("G1 X0.000 Y0.000 F9000")
+        return "\n".join(gcode)
+
+    def time_layers(self, gcode, batch_size):
+        start_time = time.time()
+        layers = GCodeToLayerGenerator(StringIO.StringIO(gcode), batch_size=batch_size)
+        commands = sum(len(layer) for layer in layers)
+        return (time.time() - start_time, commands)
+
+    def test_performance_batch_tokenizer(self):
+        gcode = self.get_gcode()
+        lines = gcode.count("\n") + 1
+        line_time, line_commands = self.time_layers(gcode, None)
+        batch_time, batch_commands = self.time_layers(gcode, 5000)
+        self.assertEquals(line_commands, batch_commands)
+        print("GCode Tokenizer Times")
+        print("Lines: %s" % lines)
+        print("Line by line: %.3fs (%.0f lines/s)" % (line_time, lines / line_time))
+        print("Batched     : %.3fs (%.0f lines/s)" % (batch_time, lines / batch_time))
+        print("Speed up    : %.2fx" % (line_time / batch_time))
+
+    def test_performance_batch_command_reader(self):
+        gcode_lines = [line.strip() for line in self.get_gcode().split("\n")]
+        start_time = time.time()
+        command_reader = GCodeCommandReader()
+        line_commands = [command for line in gcode_lines for command in command_reader.to_command(line)]
+        line_time = time.time() - start_time
+        start_time = time.time()
+        command_reader = GCodeCommandReader()
+        batch_commands = []
+        for index in range(0, len(gcode_lines), 5000):
+            batch_commands.extend(command_reader.to_commands(gcode_lines[index:index + 5000]))
+        batch_time = time.time() - start_time
+        self.assertEquals(
+            [(type(command), command.start, command.end, command.speed) for command in line_commands],
+            [(type(command), command.start, command.end, command.speed) for command in batch_commands])
+        print("GCode Command Reader Times")
+        print("Lines: %s" % len(gcode_lines))
+        print("to_command  : %.3fs (%.0f lines/s)" % (line_time, len(gcode_lines) / line_time))
+        print("to_commands : %.3fs (%.0f lines/s)" % (batch_time, len(gcode_lines) / batch_time))
+        print("Speed up    : %.2fx" % (line_time / batch_time))
+
 class HomogenousTransformerTest(unittest.TestCase):
     def get_layers(self):
         afile = open(os.path.join(os.path.dirname(os.path.realpath(__file__)),'test_data','julia.gcode'), 'r')
@@ -201,6 +264,241 @@ class HomogenousTransformerTest(unittest.TestCase):
 # Mean: 0.000330474715383
 
 
+class GridTransformerPerformanceTest(unittest.TestCase):
+    def compare(self, name, exact, points, **grid_options):
+        start = time.time()
+        grid = GridTransformer(exact, (-40.0, 40.0), (-40.0, 40.0), **grid_options)
+        bake_time = time.time() - start
+
+        start = time.time()
+        expected = exact.transform_many(points)
+        exact_time = time.time() - start
+        start = time.time()
+        actual = grid.transform_many(points)
+        grid_time = time.time() - start
+
+        print("")
+        print(name)
+        print("Points      : %s" % len(points))
+        print("Bake        : %.3fs" % bake_time)
+        print("Exact       : %.3fs" % exact_time)
+        print("Grid        : %.3fs" % grid_time)
+        print("Max error   : %s (reported %s)" % (numpy.abs(expected - actual).max(), grid.max_error))
+        print("Speed up    : %.2fx" % (exact_time / grid_time))
+
+    def homogenous_transformer(self):
+        lower_points = {
+                (1.0, 1.0):( 600.0,  60.0),
+                (0.0, 1.0):(-600.0,  60.0),
+                (1.0, 0.0):( 600.0, -60.0),
+                (0.0, 0.0):(-600.0, -60.0)
+                }
+        upper_points = {
+                (1.0, 1.0):( 50.0,  50.0),
+                (0.0, 1.0):(-50.0,  50.0),
+                (1.0, 0.0):( 50.0, -50.0),
+                (0.0, 0.0):(-50.0, -50.0)
+                }
+        return HomogenousTransformer(1.0, 50.0, lower_points, upper_points, cache_size=1024)
+
+    def test_performance_grid_lookup_layer_heights(self):
+        points = numpy.random.uniform(-40.0, 40.0, (1000000, 3))
+        points[:, 2] = numpy.random.randint(0, 500, len(points)) / 10.0
+        self.compare("Homogenous, 500 layer heights", self.homogenous_transformer(), points, z_range=(0.0, 50.0), steps=129, z_steps=51)
+
+    def test_performance_grid_lookup_continuous_heights(self):
+        points = numpy.random.uniform(-40.0, 40.0, (100000, 3))
+        points[:, 2] = numpy.random.uniform(0.0, 50.0, len(points))
+        self.compare("Homogenous, continuous heights", self.homogenous_transformer(), points, z_range=(0.0, 50.0), steps=129, z_steps=51)
+
+    def test_performance_grid_lookup_point_transformer(self):
+        calibration_points = [((dx, dy), [dx * 40.0 + dx * dy * 2.0, dy * 40.0 - dx * dx]) for dx in [-1.0, -0.5, 0.0, 0.5, 1.0] for dy in [-1.0, 0.0, 1.0]]
+        calibration_points.sort(key=lambda ((dx, dy), actual): abs(dx) != 1.0 or abs(dy) != 1.0)
+        points = numpy.random.uniform(-40.0, 40.0, (1000000, 3))
+        self.compare("PointTransformer", PointTransformer(calibration_points), points, steps=257, tolerance=1e-4)
+
+
+class TestPrintPerformanceTest(unittest.TestCase):
+    def test_performance_test_prints(self):
+        print("")
+        for name in ['HalfVaseTestGenerator', 'TwistVaseTestGenerator', 'SolidObjectTestGenerator', 'ConcentricCircleTestGenerator', 'LollipopTestGenerator']:
+            generator = getattr(print_test_layer_generators, name)
+            start = time.time()
+            layers = sum(len(layer) for layer in generator(80.0, 80.0, 0.01, 120.0))
+            first_time = time.time() - start
+            start = time.time()
+            sum(len(layer) for layer in generator(80.0, 80.0, 0.01, 120.0))
+            repeat_time = time.time() - start
+            print("%-30s: %s segments, first %.3fs, repeated %.3fs" % (name, layers, first_time, repeat_time))
+
+
+class PathToPointsPerformanceTest(unittest.TestCase):
+    def get_transformer(self):
+        points = {
+                (1.0, 1.0): ( 50.0,  50.0),
+                (0.0, 1.0): (-50.0,  50.0),
+                (1.0, 0.0): ( 50.0, -50.0),
+                (0.0, 0.0): (-50.0, -50.0)
+                }
+        return HomogenousTransformer(1.0, 50.0, points, points)
+
+    def get_layers(self, layers=20, segments_per_layer=3000):
+        angles = numpy.linspace(0.0, 2.0 * numpy.pi * 7, segments_per_layer + 1)
+        radius = 30.0 + 2.0 * numpy.sin(angles * 11.0)
+        xy = numpy.column_stack((radius * numpy.cos(angles), radius * numpy.sin(angles)))
+        speeds = numpy.full(segments_per_layer, 100.0)
+        result = []
+        for layer in range(1, layers + 1):
+            z = numpy.full((segments_per_layer, 1), layer * 0.1)
+            result.append((numpy.hstack((xy[:-1], z)), numpy.hstack((xy[1:], z)), speeds))
+        return result
+
+    def test_performance_process_segments(self):
+        layers = self.get_layers()
+        segments = sum(len(speeds) for (starts, ends, speeds) in layers)
+
+        path_to_points = PathToPoints(11000, self.get_transformer(), 0.1)
+        start_time = time.time()
+        process_points = 0
+        for (starts, ends, speeds) in layers:
+            for (start, end, speed) in zip(starts.tolist(), ends.tolist(), speeds.tolist()):
+                process_points += len(path_to_points.process(start, end, speed))
+        process_time = time.time() - start_time
+
+        path_to_points = PathToPoints(11000, self.get_transformer(), 0.1)
+        start_time = time.time()
+        segments_points = 0
+        for (starts, ends, speeds) in layers:
+            segments_points += len(path_to_points.process_segments(starts, ends, speeds)[0])
+        segments_time = time.time() - start_time
+
+        self.assertEquals(process_points, segments_points)
+        print("Path To Points Times")
+        print("Segments: %s Points: %s" % (segments, segments_points))
+        print("process          : %.3fs (%.0f segments/s)" % (process_time, segments / process_time))
+        print("process_segments : %.3fs (%.0f segments/s)" % (segments_time, segments / segments_time))
+        print("Speed up         : %.2fx" % (process_time / segments_time))
+
+class MoveFramesPerformanceTest(unittest.TestCase):
+    def test_performance_move_frames(self):
+        points = 200000
+        x = numpy.arange(points) % 262144
+        y = (numpy.arange(points) * 7) % 262144
+        laser_power = numpy.where(numpy.arange(points) % 3, 255, 0)
+
+        start_time = time.time()
+        messages = []
+        for (x_pos, y_pos, power) in zip(x.tolist(), y.tolist(), laser_power.tolist()):
+            data = chr(MoveMessage.TYPE_ID) + MoveMessage(x_pos, y_pos, power).get_bytes()
+            messages.append(chr(len(data)) + data)
+        message_time = time.time() - start_time
+
+        start_time = time.time()
+        frames = MoveMessage.frames(x, y, laser_power)
+        frames_time = time.time() - start_time
+
+        self.assertEquals(''.join(messages), frames)
+        print("Move Frame Encoding Times")
+        print("Points: %s" % points)
+        print("MoveMessage : %.3fs (%.0f points/s)" % (message_time, points / message_time))
+        print("frames      : %.3fs (%.0f points/s)" % (frames_time, points / frames_time))
+        print("Speed up    : %.2fx" % (message_time / frames_time))
+
+class UsbSendPerformanceTest(unittest.TestCase):
+    def test_performance_send_frames(self):
+        points = numpy.column_stack((numpy.linspace(0.0, 1.0, 100000), numpy.linspace(1.0, 0.0, 100000)))
+
+        with patch('peachyprinter.infrastructure.peachyusb.lib') as mock_lib:
+            mock_lib.peachyusb_write = lambda context, data, length: None
+            with patch('peachyprinter.infrastructure.peachyusb._write_address', lambda context, address, length: None):
+                communicator = UsbPacketCommunicator(50)
+                communicator.start()
+                start_time = time.time()
+                for (x, y) in points.tolist():
+                    communicator.send(MoveMessage(int(x * 262143), int(y * 262143), 255))
+                send_time = time.time() - start_time
+
+                laser_control = LaserControl()
+                laser_control.set_laser_on()
+                disseminator = MicroDisseminator(laser_control, communicator, 11000)
+                start_time = time.time()
+                for index in range(0, len(points), 4096):
+                    disseminator.process(points[index:index + 4096])
+                frames_time = time.time() - start_time
+
+        print("USB Send Times")
+        print("Points: %s" % len(points))
+        print("send        : %.3fs (%.2f us per point)" % (send_time, send_time * 1000000.0 / len(points)))
+        print("send_frames : %.3fs (%.2f us per point)" % (frames_time, frames_time * 1000000.0 / len(points)))
+        print("Speed up    : %.2fx" % (send_time / frames_time))
+
+class LoopbackPrintPerformanceTest(unittest.TestCase):
+    '''Prints a gcode file end to end against the loopback usb device and reports the sustained samples per second.
+    Set PEACHY_BENCHMARK_GCODE to print your own file and PEACHY_LOOPBACK_SAMPLES_PER_SECOND to consume at a real data rate.
+    The layer cache and index are kept in a temporary folder rather than the user's peachy folder'''
+
+    DATA_RATE = 11000
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder)
+
+    def generated_gcode(self, layers=10, size=20.0, lines=40):
+        file_name = os.path.join(self.temp_folder, 'benchmark.gcode')
+        with open(file_name, 'w') as gcode:
+            gcode.write("G21\nG1 F4800\n")
+            for layer in range(layers):
+                gcode.write("G1 Z%.2f\n" % ((layer + 1) * 0.1))
+                gcode.write("G1 X0.0 Y0.0\n")
+                for (x, y) in [(size, 0.0), (size, size), (0.0, size), (0.0, 0.0)]:
+                    gcode.write("G1 X%.3f Y%.3f E1\n" % (x, y))
+                for line in range(lines):
+                    y = size * line / lines
+                    gcode.write("G1 X0.0 Y%.3f\n" % y)
+                    gcode.write("G1 X%.3f Y%.3f E1\n" % (size, y))
+        return file_name
+
+    def test_performance_print_gcode(self):
+        file_name = os.environ.get('PEACHY_BENCHMARK_GCODE') or self.generated_gcode()
+        environment = {
+            'PEACHY_API_DLL_PATH': 'loopback',
+            'PEACHY_LOOPBACK_SAMPLES_PER_SECOND': os.environ.get('PEACHY_LOOPBACK_SAMPLES_PER_SECOND', '0'),
+            'PEACHY_LOOPBACK_DRIPS_PER_SECOND': '5000',
+            'PEACHY_LOOPBACK_DATA_RATE': str(self.DATA_RATE),
+            }
+        with patch.dict(os.environ, environment):
+            library = peachyusb._load_library()
+        configuration = ConfigurationGenerator().default_configuration()
+        configuration.circut.data_rate = self.DATA_RATE
+        configuration.dripper.dripper_type = 'microcontroller'
+        configuration.dripper.max_lead_distance_mm = 1000000.0
+
+        with patch.object(config, 'PEACHY_PATH', self.temp_folder), patch.object(peachyusb, 'lib', library):
+            with patch.object(peachyusb, '_write_address', peachyusb._address_writer(library)):
+                api = PrintAPI(configuration)
+                start_time = time.time()
+                api.print_gcode(file_name)
+                while api.get_status()['status'] not in ['Complete', 'Cancelled', 'Failed']:
+                    time.sleep(0.01)
+                api._communicator.flush()
+                library.device.drain()
+                print_time = time.time() - start_time
+                status = api.get_status()
+                api.close()
+                api._communicator.close()
+
+        self.assertEquals('Complete', status['status'])
+        samples = library.device.samples
+        print("Loopback Print")
+        print("File           : %s" % file_name)
+        print("Layers         : %s" % status['current_layer'])
+        print("Samples        : %s" % samples)
+        print("Time           : %.3fs" % print_time)
+        print("Sustained rate : %.0f samples/s (%.2fx data rate of %s)" % (samples / print_time, samples / print_time / self.DATA_RATE, self.DATA_RATE))
+        print("USB busy       : %.2f" % status['link']['write_busy_fraction'])
+
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='ERROR')
     unittest.main()
\ No newline at end of file
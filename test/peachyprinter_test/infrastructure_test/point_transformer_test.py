@@ -4,6 +4,7 @@ import sys
 import logging
 import numpy as np
 import math
+import time
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
@@ -69,6 +70,46 @@ class PointTransformerTest(unittest.TestCase):
         print(average_diffrence)
         self.assertTrue(average_diffrence < acceptable_diffrence, 'Difference was %s' % average_diffrence)
 
+    def calibration_points(self, count, z_height=-300):
+        printer = self.factory.new_peachy_printer()
+        deflection_points = [
+            [ 1.0, 1.0],[-1.0, 1.0],[ 1.0,-1.0],[-1.0, -1.0],
+            [ 0.0, 1.0 ],[ 0.0, -1.0 ],[1.0,0.0],[-1.0,0.0],
+            [ 0.8, 0.8],[-0.8, 0.8],[ 0.8,-0.8],[-0.8, -0.8],
+            [ 0.0, 0.8],[ 0.0, -0.8 ],[0.8,0.0],[-0.8,0.0],
+        ]
+        return [ ((dx,dy),printer.write(dx,dy,z_height).tolist()[0][:2]) for (dx,dy) in deflection_points[:count] ]
+
+    def test_twelve_point_calibration_fits_in_under_a_second(self):
+        start = time.time()
+        pt = PointTransformer(self.calibration_points(12))
+        self.assertTrue(time.time() - start < 1.0)
+        for (deflection, position) in self.calibration_points(12):
+            actual = pt.transform(position + [-300])
+            self.assertAlmostEquals(deflection[0], actual[0], places=1)
+            self.assertAlmostEquals(deflection[1], actual[1], places=1)
+
+    def test_transform_many_matches_transform(self):
+        pt = PointTransformer(self.calibration_points(16))
+        points = np.array(list(self.get_test_points(5, -300))) * 50.0 - 25.0
+
+        expected = [pt.transform(point)[:2] for point in points.tolist()]
+
+        self.assertTrue(np.allclose(expected, pt.transform_many(points)))
+
+    def test_batched_fit_matches_single_least_squares(self):
+        pt = PointTransformer(self.calibration_points(16))
+        deflections = np.array([deflection for (deflection, actual) in self.calibration_points(16)])
+        fit = pt.squarer.fit_many([actual for (deflection, actual) in self.calibration_points(16)])
+
+        coeffecients, errors = pt._get_coeffecient_vectors(fit, deflections, np.array([0.5, 0.9]), np.array([0.4, 0.1]), np.array([0.7, 0.0]))
+
+        matrix = pt._monomials(pt._bend_many(fit, [0.5], [0.4], [0.7])[0])
+        expected, residuals = np.linalg.lstsq(matrix, deflections, rcond=None)[:2]
+        self.assertTrue(np.allclose(expected, coeffecients[0]))
+        self.assertAlmostEquals(residuals.sum(), errors[0])
+        self.assertEquals(np.inf, errors[1])
+
 class SquareTransformTest(unittest.TestCase):
     def test_requires_four_square_point_mappings(self):
         points = [
@@ -185,6 +226,19 @@ class SquareTransformTest(unittest.TestCase):
             self.assertAlmostEquals(expected_deflection[0], actual_x )
             self.assertAlmostEquals(expected_deflection[1], actual_y )
 
+    def test_fit_many_matches_fit(self):
+        configuration_points = [
+            ([ 0.60, 0.74],[  6.0,  7.4]),
+            ([ 0.70,-0.68],[  7.0, -6.8]),
+            ([-0.80,-0.90],[ -8.0, -9.0]),
+            ([-0.75, 0.80],[ -7.5,  8.0])
+            ]
+        positions = [[5.0, -5.0], [10.0, 10.0], [-7.5, 7.5], [-5.0, -5.0]]
+
+        squarer = SquareTransform(configuration_points)
+
+        self.assertTrue(np.allclose([squarer.fit(*position) for position in positions], squarer.fit_many(positions)))
+
     def test_can_use_somewhat_random_deflections(self):
         configuration_points = [
             ([ 0.60, 0.74],[  6.0,  7.4]),
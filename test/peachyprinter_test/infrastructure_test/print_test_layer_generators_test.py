@@ -9,7 +9,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
 
 from peachyprinter.infrastructure.print_test_layer_generators import *
-from peachyprinter.domain.commands import Layer
+from peachyprinter.domain.commands import ArrayLayer, LateralMove
 
 
 class SolidObjectTestGeneratorTest(unittest.TestCase):
@@ -23,7 +23,7 @@ class SolidObjectTestGeneratorTest(unittest.TestCase):
         layer_height = 1
         speed = 100
         generator = SolidObjectTestGenerator(height, width, layer_height, speed)
-        self.assertEquals(Layer, type(generator.next()))
+        self.assertEquals(ArrayLayer, type(generator.next()))
 
     def test_next_should_have_object_end_in_peak(self):
         height = 100
@@ -48,6 +48,62 @@ class SolidObjectTestGeneratorTest(unittest.TestCase):
         self.assertTrue(layer_distance[-1] <= 1.0, '{} <= {}'.format(layer_distance[-1], 1.0))
 
 
+
+class CompiledTestGeneratorTest(unittest.TestCase):
+
+    def test_layers_step_up_by_layer_height_until_height(self):
+        layers = list(HalfVaseTestGenerator(1, 10, 0.25, 50))
+
+        self.assertEquals([0.0, 0.25, 0.5, 0.75], [layer.z for layer in layers])
+        self.assertEquals([101] * 4, [len(layer) for layer in layers])
+        self.assertTrue(all(layer.records['draw'].all() for layer in layers))
+        self.assertEquals([50.0], list(set(layers[0].records['speed'].tolist())))
+
+    def test_half_vase_draws_from_and_back_to_centre(self):
+        layer = HalfVaseTestGenerator(10, 10, 1).next()
+
+        self.assertEquals([0.0, 0.0], layer.commands[0].start)
+        self.assertEquals([0.0, 4.375], layer.commands[0].end)
+        self.assertEquals([0.0, 0.0], layer.commands[-1].end)
+
+    def test_twist_vase_turns_three_times_as_far_as_half_vase(self):
+        half_vase = list(HalfVaseTestGenerator(10, 10, 5))[1]
+        twist_vase = list(TwistVaseTestGenerator(10, 10, 5))[1]
+
+        self.assertAlmostEquals(1.0, half_vase.commands[0].end[0] / 4.375)
+        self.assertAlmostEquals(-1.0, twist_vase.commands[0].end[0] / 4.375)
+
+    def test_concentric_circles_move_to_each_ring(self):
+        layer = ConcentricCircleTestGenerator(10, 30, 1).next()
+        moves = [command for command in layer.commands if type(command) == LateralMove]
+
+        self.assertEquals(300, len(layer))
+        self.assertEquals([[0.0, 5.0], [0.0, 10.0], [0.0, 15.0]], [move.end for move in moves])
+        self.assertEquals([move.end for move in moves], [move.start for move in moves])
+
+    def test_lollipop_with_narrow_pop_has_empty_layers_below_pop(self):
+        layers = list(LollipopTestGenerator(7, 3, 1))
+
+        self.assertEquals(7, len(layers))
+        self.assertAlmostEquals(0.3, layers[0].records['end'][:, 1].max())
+        self.assertEquals(0.0, abs(layers[3].records['end']).max())
+
+    def test_repeated_test_print_shares_compiled_records(self):
+        first = list(SolidObjectTestGenerator(10, 10, 0.5))
+        second = list(SolidObjectTestGenerator(10, 10, 0.5))
+        other = list(SolidObjectTestGenerator(10, 10, 0.25))
+
+        self.assertTrue(all(a.records.base is b.records.base for (a, b) in zip(first, second)))
+        self.assertFalse(first[0].records.base is other[0].records.base)
+        with self.assertRaises(ValueError):
+            first[0].records['speed'] = 1.0
+
+    def test_compiled_test_prints_are_dropped_oldest_first(self):
+        compiled = [list(SimpleVaseTestGenerator(10, 10, 1, speed)) for speed in range(1, CompiledTestGenerator.CACHE_SIZE + 2)]
+
+        self.assertFalse(SimpleVaseTestGenerator(10, 10, 1, 1).next().records.base is compiled[0][0].records.base)
+        self.assertTrue(SimpleVaseTestGenerator(10, 10, 1, 3).next().records.base is compiled[2][0].records.base)
+
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,191 @@
+import unittest
+import os
+import sys
+import time
+import logging
+from mock import MagicMock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+from peachyprinter.infrastructure.render_pool import LayerRenderPool
+from peachyprinter.infrastructure.layer_control import LayerWriter
+from peachyprinter.infrastructure.micro_disseminator import MicroDisseminator
+from peachyprinter.infrastructure.machine import MachineState
+from peachyprinter.infrastructure.path_to_points import PathToPoints
+from peachyprinter.infrastructure.transformer import OneToOneTransformer
+from peachyprinter.domain.laser_control import LaserControl
+from peachyprinter.domain.commands import *
+
+
+class FramesCommunicator(object):
+    def __init__(self):
+        self.frames = []
+
+    def send(self, message):
+        raise Exception('Expected frames')
+
+    def send_frames(self, frames, packets=None):
+        self.frames.append(frames)
+
+    def close(self):
+        pass
+
+
+class SlowPlanner(object):
+    '''Renders layers below 1.0 instantly and takes an hour over any others'''
+
+    def render(self, records, z, key):
+        if z >= 1.0:
+            time.sleep(3600)
+        return {'frames': ['frames at %s' % z], 'points': None, 'laser_on': None}
+
+    def end_key(self, records, z, key):
+        return key
+
+
+class StubLayer(object):
+    def __init__(self, z):
+        self.z = z
+        self.records = None
+
+
+class LayerRenderPoolTests(unittest.TestCase):
+    commands = [
+        LateralDraw([0.0, 0.0], [1.0, 1.0], 10.0),
+        LateralDraw([1.0, 1.0], [1.0, 0.5], 5.0),
+        LateralMove([1.0, 0.5], [0.2, 0.2], 10.0),
+        LateralDraw([0.2, 0.2], [0.3, 0.2], 10.0),
+        LateralDraw([0.3, 0.2], [0.3, 0.201], 10.0),
+        LateralDraw([0.9, 0.9], [0.5, 0.5], 2.0),
+        ]
+
+    def setUp(self):
+        self.writers = []
+        self.pools = []
+
+    def tearDown(self):
+        for writer in self.writers:
+            writer.terminate()
+        for pool in self.pools:
+            pool.close()
+
+    def slow_pool(self):
+        pool = LayerRenderPool.start(SlowPlanner(), processes=1, depth=1)
+        self.pools.append(pool)
+        return pool
+
+    def wait_for_renders(self, render_pool):
+        for (layer, key, result, slot) in list(render_pool._pending):
+            result.wait(10.0)
+
+    def writer(self, xyz=[0.1, 0.1, 0.0], processes=None, communicator=None):
+        laser_control = LaserControl(0.5)
+        communicator = communicator or FramesCommunicator()
+        writer = LayerWriter(MicroDisseminator(laser_control, communicator, 200), PathToPoints(200, OneToOneTransformer(), 0.01), laser_control, MachineState(xyz, 10.0), post_fire_delay_speed=4.0)
+        if processes:
+            writer.start_render_pool(processes)
+        self.writers.append(writer)
+        return (writer, communicator)
+
+    def layers(self):
+        return [ArrayLayer.from_commands(0.1 * (index + 1), self.commands) for index in range(4)]
+
+    def test_writer_with_render_pool_sends_same_frames(self):
+        (expected, expected_communicator) = self.writer()
+        (actual, actual_communicator) = self.writer(processes=1)
+        layers = self.layers()
+
+        for layer in layers:
+            actual.render_ahead(layer)
+        self.wait_for_renders(actual._render_pool)
+        expected_extents = [expected.process_layer(layer) for layer in layers]
+        actual_extents = [actual.process_layer(layer) for layer in layers]
+
+        self.assertEquals(len(layers), actual._render_pool.rendered)
+        self.assertEquals(0, actual._render_pool.missed)
+        self.assertEquals(expected_communicator.frames, actual_communicator.frames)
+        self.assertEquals(expected_extents, actual_extents)
+        self.assertEquals(expected._state.xyz, actual._state.xyz)
+
+    def test_writer_renders_layer_itself_when_state_differs_from_prediction(self):
+        (expected, expected_communicator) = self.writer(xyz=[0.5, 0.5, 0.0])
+        (actual, actual_communicator) = self.writer(processes=1)
+        layer = self.layers()[0]
+
+        actual.render_ahead(layer)
+        actual._state.set_state([0.5, 0.5, 0.0], 10.0)
+        expected.process_layer(layer)
+        actual.process_layer(layer)
+
+        self.assertEquals(0, actual._render_pool.rendered)
+        self.assertEquals(1, actual._render_pool.missed)
+        self.assertEquals(expected_communicator.frames, actual_communicator.frames)
+
+    def test_discard_rendered_drops_layers_rendered_ahead(self):
+        (expected, expected_communicator) = self.writer()
+        (actual, actual_communicator) = self.writer(processes=1)
+        layers = self.layers()
+
+        for layer in layers[:2]:
+            actual.render_ahead(layer)
+        actual.discard_rendered()
+        for layer in layers[2:]:
+            expected.process_layer(layer)
+            actual.process_layer(layer)
+
+        self.assertEquals(0, actual._render_pool.rendered)
+        self.assertEquals(0, actual._render_pool.missed)
+        self.assertEquals(expected_communicator.frames, actual_communicator.frames)
+
+    def test_take_does_not_wait_for_unfinished_render(self):
+        pool = self.slow_pool()
+        layer = StubLayer(1.0)
+        key = pool.submit(layer, ('key', True))
+
+        before = time.time()
+        plan = pool.take(layer, key)
+
+        self.assertTrue(time.time() - before < 1.0)
+        self.assertEquals(None, plan)
+        self.assertEquals(1, pool.missed)
+
+    def test_take_returns_finished_render(self):
+        pool = self.slow_pool()
+        layer = StubLayer(0.5)
+        key = pool.submit(layer, ('key', True))
+        self.wait_for_renders(pool)
+
+        plan = pool.take(layer, key)
+
+        self.assertEquals(['frames at 0.5'], plan['frames'])
+        self.assertEquals(1, pool.rendered)
+
+    def test_stuck_workers_are_replaced(self):
+        pool = self.slow_pool()
+        stuck = StubLayer(1.0)
+        pool.take(stuck, pool.submit(stuck, ('key', True)))
+        old_workers = pool._pool
+        pool.STUCK_SECONDS = 0.01
+        time.sleep(0.02)
+
+        layer = StubLayer(0.5)
+        key = pool.submit(layer, ('key', True))
+        self.wait_for_renders(pool)
+
+        self.assertFalse(pool._pool is old_workers)
+        self.assertEquals(['frames at 0.5'], pool.take(layer, key)['frames'])
+
+    def test_start_returns_none_without_processes(self):
+        self.assertEquals(None, LayerRenderPool.start(MagicMock(), processes=0))
+
+    def test_start_render_pool_does_nothing_when_frames_not_supported(self):
+        (writer, communicator) = self.writer(processes=1, communicator=MagicMock(spec=['send', 'close']))
+
+        self.assertEquals(None, writer._render_pool)
+        writer.render_ahead(self.layers()[0])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
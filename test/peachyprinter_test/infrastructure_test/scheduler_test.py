@@ -0,0 +1,70 @@
+import unittest
+import sys
+import os
+import time
+import logging
+from threading import Event
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
+
+from peachyprinter.infrastructure.scheduler import Scheduler, shared_scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.calls = []
+        self.done = Event()
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def record(self, name):
+        self.calls.append(name)
+        if len(self.calls) == 3:
+            self.done.set()
+
+    def test_calls_back_in_time_order(self):
+        now = time.time()
+        self.scheduler.schedule(now + 0.06, self.record, 'c')
+        self.scheduler.schedule(now + 0.02, self.record, 'a')
+        self.scheduler.schedule(now + 0.04, self.record, 'b')
+
+        self.assertTrue(self.done.wait(1.0))
+        self.assertEquals(['a', 'b', 'c'], self.calls)
+        self.assertTrue(time.time() >= now + 0.06)
+
+    def test_cancelled_callbacks_are_not_called(self):
+        now = time.time()
+        handle = self.scheduler.schedule(now + 0.01, self.record, 'cancelled')
+        self.scheduler.cancel(handle)
+        for name in ['a', 'b', 'c']:
+            self.scheduler.schedule(now + 0.02, self.record, name)
+
+        self.assertTrue(self.done.wait(1.0))
+        self.assertEquals(['a', 'b', 'c'], self.calls)
+        self.assertEquals(0, self.scheduler.pending())
+
+    def test_failing_callback_does_not_stop_scheduler(self):
+        def fail():
+            raise Exception('Failed')
+        now = time.time()
+        self.scheduler.schedule(now, fail)
+        for name in ['a', 'b', 'c']:
+            self.scheduler.schedule(now + 0.01, self.record, name)
+
+        self.assertTrue(self.done.wait(1.0))
+
+    def test_schedule_after_shutdown_raises(self):
+        self.scheduler.shutdown()
+        with self.assertRaises(Exception):
+            self.scheduler.schedule(time.time(), self.record, 'a')
+
+    def test_shared_scheduler_is_one_instance(self):
+        self.assertTrue(shared_scheduler() is shared_scheduler())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
+    unittest.main()
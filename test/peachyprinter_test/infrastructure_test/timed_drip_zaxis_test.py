@@ -7,6 +7,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
 
 from peachyprinter.infrastructure.timed_drip_zaxis import TimedDripZAxis, PhotoZAxis
+from peachyprinter.infrastructure.scheduler import Scheduler
 
 
 class TimedDripZaxisTests(unittest.TestCase):
@@ -145,6 +146,59 @@ class TimedDripZaxisTests(unittest.TestCase):
         self.tdza.start()
         self.tdza.move_to(7.0)
 
+    def test_seconds_until_predicts_from_drip_rate(self):
+        self.tdza = TimedDripZAxis(10, 0.0, drips_per_second=20)
+        self.assertEquals(None, self.tdza.seconds_until(1.0))
+
+        self.tdza.start()
+
+        self.assertTrue(0.3 < self.tdza.seconds_until(1.0) <= 0.5)
+        self.assertEquals(0.0, self.tdza.seconds_until(-1.0))
+
+
+    def test_drip_history_follows_drip_rate_changes(self):
+        self.tdza = TimedDripZAxis(1, 0.0, drips_per_second=100)
+        self.tdza.start()
+        time.sleep(0.1)
+        self.tdza.set_drips_per_second(50)
+        time.sleep(0.1)
+
+        history = self.tdza.drip_history
+
+        self.assertTrue(13 <= len(history) <= 17)
+        self.assertAlmostEquals(0.01, history[1] - history[0], places=5)
+        self.assertAlmostEquals(0.02, history[-1] - history[-2], places=5)
+        self.assertTrue(history[-1] <= time.time())
+
+    def test_drip_history_is_limited(self):
+        self.tdza = TimedDripZAxis(1, 0.0, drips_per_second=10000)
+        self.tdza.start()
+        time.sleep(0.1)
+
+        self.assertEquals(TimedDripZAxis.HISTORY_LENGTH, len(self.tdza.drip_history))
+
+    def test_calls_back_when_drips_land(self):
+        self.tdza = TimedDripZAxis(1, 0.0, call_back=self.call_back, drips_per_second=20)
+        self.tdza.start()
+        time.sleep(0.22)
+
+        self.assertTrue(4 <= self.calls <= 6, self.calls)
+        self.assertEquals(4, self.drips)
+        self.assertEquals(4, len(self.drip_history))
+
+    def test_emulated_drippers_can_share_a_scheduler(self):
+        scheduler = Scheduler()
+        drippers = [TimedDripZAxis(1, 0.0, call_back=self.call_back, calls_back_per_second=100, drips_per_second=20, scheduler=scheduler) for i in range(10)]
+        for dripper in drippers:
+            dripper.start()
+        time.sleep(0.12)
+        for dripper in drippers:
+            dripper.close()
+
+        self.assertTrue(self.calls >= 30, self.calls)
+        self.assertEquals(0, scheduler.pending())
+        scheduler.shutdown()
+
 
 class PhotoZAxisTests(unittest.TestCase):
 
@@ -169,6 +223,16 @@ class PhotoZAxisTests(unittest.TestCase):
         test_zaxis = PhotoZAxis(starting_height)
         self.assertEquals(starting_height, test_zaxis.current_z_location_mm())
 
+    def test_seconds_until_is_time_to_height_change(self):
+        test_zaxis = PhotoZAxis(0.0, 0.5)
+        self.assertEquals(None, test_zaxis.seconds_until(10.0))
+
+        test_zaxis.move_to(10.0)
+
+        self.assertTrue(0.4 < test_zaxis.seconds_until(10.0) <= 0.5)
+        self.assertEquals(None, test_zaxis.seconds_until(11.0))
+        self.assertEquals(0.0, test_zaxis.seconds_until(0.0))
+
     def test_calling_move_to_changes_z_height_when_delay_0(self):
         expected_height = 10.0
         test_zaxis = PhotoZAxis(0.0, 0.0)
@@ -3,11 +3,12 @@ import os
 import sys
 import logging
 import math
+import numpy as np
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
 
-from peachyprinter.infrastructure.transformer import OneToOneTransformer, TuningTransformer, HomogenousTransformer
+from peachyprinter.infrastructure.transformer import OneToOneTransformer, TuningTransformer, HomogenousTransformer, GridTransformer
 
 
 class OneToOneTransformerTests(unittest.TestCase):
@@ -227,6 +228,115 @@ class HomogenousTransformerTests(unittest.TestCase):
             self.assertAlmostEquals(expected_points[idx][0], actual_points[idx][0])
             self.assertAlmostEquals(expected_points[idx][1], actual_points[idx][1])
 
+    def test_transform_many_matches_transform(self):
+        lower_points = {
+                (0.75, 0.75): (4.0, 4.0),
+                (0.25, 0.75): (-4.0, 4.0),
+                (0.75, 0.25): (4.0, -4.0),
+                (0.25, 0.25): (-4.0, -4.0)
+                }
+        upper_points = {
+                (1.0, 1.0): (4.0, 4.0),
+                (0.0, 1.0): (-4.0, 4.0),
+                (1.0, 0.0): (4.0, -4.0),
+                (0.0, 0.0): (-4.0, -4.0)
+                }
+        transformer = HomogenousTransformer(1.0, 2.0, lower_points, upper_points)
+        test_points = [
+            [4.0, 4.0, 0.0], [-1.0, -1.0, 0.0], [0.5, 0.5, 1.0],
+            [1.0, 1.0, 2.0], [-3.0, 2.0, 1.0], [0.0, 0.0, 0.5], [2.5, -0.5, 2.0]]
+
+        expected_points = [transformer.transform(point) for point in test_points]
+        actual_points = transformer.transform_many(np.array(test_points))
+
+        self.assertEquals((len(test_points), 2), actual_points.shape)
+        for (expected, actual) in zip(expected_points, actual_points.tolist()):
+            self.assertAlmostEquals(expected[0], actual[0])
+            self.assertAlmostEquals(expected[1], actual[1])
+
+    def test_transform_many_clips_and_counts_points_outside_range(self):
+        points = {
+                (1.0, 1.0): (1.0, 1.0),
+                (0.0, 1.0): (-1.0, 1.0),
+                (1.0, 0.0): (1.0, -1.0),
+                (0.0, 0.0): (-1.0, -1.0)
+                }
+        transformer = HomogenousTransformer(1.0, 1.0, points, points)
+
+        actual = transformer.transform_many([[-2.0, -2.0, 0.0], [0.0, 0.0, 0.0], [2.0, 0.0, 0.0]])
+        transformer.transform_many([[0.0, 3.0, 0.0]])
+
+        self.assertEquals([[0.0, 0.0], [0.5, 0.5], [1.0, 0.5]], actual.tolist())
+        self.assertEquals(3, transformer.points_out_of_bounds)
+
+    def test_transform_many_handles_no_points(self):
+        points = {
+                (1.0, 1.0): (1.0, 1.0),
+                (0.0, 1.0): (-1.0, 1.0),
+                (1.0, 0.0): (1.0, -1.0),
+                (0.0, 0.0): (-1.0, -1.0)
+                }
+        transformer = HomogenousTransformer(1.0, 1.0, points, points)
+
+        self.assertEquals((0, 2), transformer.transform_many(np.empty((0, 3))).shape)
+
+    def get_skewed_transformer(self, cache_size=64):
+        lower_points = {
+                (0.75, 0.75): (4.0, 4.0),
+                (0.25, 0.75): (-4.0, 4.0),
+                (0.75, 0.25): (4.0, -4.0),
+                (0.25, 0.25): (-4.0, -4.0)
+                }
+        upper_points = {
+                (1.0, 1.0): (4.0, 4.0),
+                (0.0, 1.0): (-4.0, 4.0),
+                (1.0, 0.0): (4.0, -4.0),
+                (0.0, 0.0): (-4.0, -4.0)
+                }
+        return HomogenousTransformer(1.0, 2.0, lower_points, upper_points, cache_size=cache_size)
+
+    def test_alternating_heights_hit_the_cache(self):
+        transformer = self.get_skewed_transformer()
+        expected = [transformer.transform([4.0, 4.0, height]) for height in [0.5, 1.0]]
+
+        actual = [transformer.transform([4.0, 4.0, height]) for height in [0.5, 1.0, 0.5, 1.0, 0.5]]
+
+        self.assertEquals(expected + expected + expected[:1], actual)
+        self.assertEquals({'hits': 5, 'misses': 2, 'size': 2, 'max_size': 64}, transformer.cache_info())
+
+    def test_cache_keys_on_rounded_height(self):
+        transformer = self.get_skewed_transformer()
+
+        transformer.transform([4.0, 4.0, 0.3])
+        transformer.transform([4.0, 4.0, 0.1 + 0.2])
+
+        self.assertEquals(1, transformer.cache_info()['hits'])
+
+    def test_least_recently_used_heights_are_evicted(self):
+        transformer = self.get_skewed_transformer(cache_size=2)
+
+        for height in [0.1, 0.2, 0.1, 0.3, 0.1, 0.2]:
+            transformer.transform([1.0, 1.0, height])
+
+        self.assertEquals({'hits': 2, 'misses': 4, 'size': 2, 'max_size': 2}, transformer.cache_info())
+
+    def test_prewarm_fills_the_cache(self):
+        transformer = self.get_skewed_transformer()
+
+        transformer.prewarm([0.1, 0.2, 0.3])
+        transformer.transform_many([[1.0, 1.0, 0.1], [1.0, 1.0, 0.2], [1.0, 1.0, 0.3]])
+
+        self.assertEquals({'hits': 3, 'misses': 3, 'size': 3, 'max_size': 64}, transformer.cache_info())
+
+    def test_set_scale_clears_the_cache(self):
+        transformer = self.get_skewed_transformer()
+        before = transformer.transform([1.0, 1.0, 1.0])
+
+        transformer.set_scale(2.0)
+
+        self.assertNotEquals(before, transformer.transform([1.0, 1.0, 1.0]))
+        self.assertEquals(2, transformer.cache_info()['misses'])
+
     # def test_given_a_basic_mapping_yields_expected_results_3(self):
     #     height = 10.0
     #     lower_points = {
@@ -265,6 +375,86 @@ class HomogenousTransformerTests(unittest.TestCase):
         pam = 10 ^ places
         return math.ceil(value * pam) / pam
 
+
+class QuadraticTransformer(object):
+    def transform(self, xyz):
+        x, y, z = xyz
+        return [x * x, y]
+
+
+class GridTransformerTests(unittest.TestCase):
+    def get_skewed_transformer(self):
+        lower_points = {
+                (0.75, 0.75): (4.0, 4.0),
+                (0.25, 0.75): (-4.0, 4.0),
+                (0.75, 0.25): (4.0, -4.0),
+                (0.25, 0.25): (-4.0, -4.0)
+                }
+        upper_points = {
+                (1.0, 1.0): (4.0, 4.0),
+                (0.0, 1.0): (-4.0, 4.0),
+                (1.0, 0.0): (4.0, -4.0),
+                (0.0, 0.0): (-4.0, -4.0)
+                }
+        return HomogenousTransformer(1.0, 2.0, lower_points, upper_points)
+
+    def test_bilinear_lookup_ignores_height(self):
+        transformer = GridTransformer(OneToOneTransformer(), (0.0, 1.0), (0.0, 1.0), steps=3)
+
+        self.assertEquals([0.3, 0.7], transformer.transform([0.3, 0.7, 5.0]))
+        self.assertAlmostEquals(0.0, transformer.max_error)
+
+    def test_trilinear_lookup_matches_homogenous_transformer(self):
+        exact = self.get_skewed_transformer()
+        transformer = GridTransformer(exact, (-4.0, 4.0), (-4.0, 4.0), (0.0, 2.0), steps=9, z_steps=5)
+        test_points = [[4.0, 4.0, 0.0], [-1.0, -1.0, 0.0], [0.5, 0.5, 1.0], [1.0, 1.0, 2.0], [-3.0, 2.0, 1.3], [2.5, -0.5, 0.7]]
+
+        errors = np.sqrt(((exact.transform_many(test_points) - transformer.transform_many(test_points)) ** 2).sum(axis=1))
+
+        self.assertTrue(transformer.max_error < 0.01)
+        self.assertTrue((errors <= transformer.max_error).all())
+
+    def test_baking_does_not_count_points_out_of_bounds(self):
+        exact = self.get_skewed_transformer()
+        GridTransformer(exact, (-8.0, 8.0), (-8.0, 8.0), (0.0, 2.0))
+
+        self.assertEquals(0, exact.points_out_of_bounds)
+
+    def test_reports_error_against_exact_transform(self):
+        transformer = GridTransformer(QuadraticTransformer(), (0.0, 1.0), (0.0, 1.0), steps=5)
+
+        self.assertAlmostEquals(0.25 ** 2 / 4.0, transformer.max_error)
+        self.assertAlmostEquals(0.25 ** 2 / 4.0, transformer.mean_error)
+        self.assertAlmostEquals(0.625 ** 2 + 0.25 ** 2 / 4.0, transformer.transform([0.625, 0.0, 0.0])[0])
+
+    def test_refines_grid_until_within_tolerance(self):
+        transformer = GridTransformer(QuadraticTransformer(), (0.0, 1.0), (0.0, 1.0), steps=5, tolerance=0.001)
+
+        self.assertTrue(transformer.max_error <= 0.001)
+        self.assertAlmostEquals(0.5 ** 2, transformer.transform([0.5, 0.0, 0.0])[0])
+
+    def test_refinement_stops_at_max_steps(self):
+        transformer = GridTransformer(QuadraticTransformer(), (0.0, 1.0), (0.0, 1.0), steps=5, tolerance=0.0, max_steps=17)
+
+        self.assertAlmostEquals((1.0 / 16) ** 2 / 4.0, transformer.max_error)
+
+    def test_clamps_and_counts_points_outside_grid(self):
+        transformer = GridTransformer(OneToOneTransformer(), (0.0, 1.0), (0.0, 1.0))
+
+        actual = transformer.transform_many([[-1.0, 0.5, 0.0], [0.5, 0.5, 0.0], [2.0, 3.0, 0.0]])
+
+        self.assertEquals([[0.0, 0.5], [0.5, 0.5], [1.0, 1.0]], actual.tolist())
+        self.assertEquals(2, transformer.points_out_of_bounds)
+
+    def test_handles_no_points(self):
+        transformer = GridTransformer(OneToOneTransformer(), (0.0, 1.0), (0.0, 1.0))
+
+        self.assertEquals((0, 2), transformer.transform_many(np.empty((0, 3))).shape)
+
+    def test_requires_two_steps(self):
+        with self.assertRaises(Exception):
+            GridTransformer(OneToOneTransformer(), (0.0, 1.0), (0.0, 1.0), steps=1)
+
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level='DEBUG')
     unittest.main()
@@ -3,7 +3,7 @@ import os
 import sys
 import time
 import logging
-from mock import MagicMock
+from mock import MagicMock, patch
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src'))
@@ -102,6 +102,31 @@ class SerialDripZAxisTests(unittest.TestCase):
         sdza.drip_reported_handler(drip_message_2)
         self.assertEquals(10, len(mock_call_back.call_args_list[1][0][3]))
 
+    def test_drip_recorded_handler_should_call_back_with_read_only_history(self):
+        mock_communicatior = MagicMock()
+        mock_call_back = MagicMock()
+        sdza = SerialDripZAxis(mock_communicatior, 1.0, 0.0, mock_call_back)
+
+        sdza.drip_reported_handler(DripRecordedMessage(2))
+
+        history = mock_call_back.call_args_list[0][0][3]
+        self.assertEquals(2, len(history))
+        self.assertFalse(history.flags.writeable)
+        self.assertEquals(2.0, sdza.drips_per_second(1.0))
+
+    @patch('peachyprinter.infrastructure.zaxis.time')
+    def test_seconds_until_predicts_from_last_drip_and_drip_rate(self, mock_time):
+        sdza = SerialDripZAxis(MagicMock(), 10.0, 0.0)
+        self.assertEquals(None, sdza.seconds_until(2.0))
+        for drip in range(1, 11):
+            mock_time.time.return_value = drip * 0.1
+            sdza.drip_reported_handler(DripRecordedMessage(drip))
+
+        mock_time.time.return_value = 1.5
+
+        self.assertAlmostEquals(10 / (10.0 / 0.9) - 0.5, sdza.seconds_until(2.0))
+        self.assertEquals(0.0, sdza.seconds_until(0.5))
+
     def test_move_to_sends_drips(self):
         mock_communicatior = MagicMock()
         starting_height = 0.0
@@ -133,7 +158,7 @@ class SerialDripZAxisTests(unittest.TestCase):
         history = sdza.drip_history
 
         self.assertEqual(0.0, actual_height)
-        self.assertEqual([], history)
+        self.assertEqual([], list(history))
 
     def test_reset_removes_drips_count_accounting_for_hardware(self):
         mock_communicatior = MagicMock()